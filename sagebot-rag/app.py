@@ -9,6 +9,13 @@ from sagebot.rag import *
 from sagebot.progress import *
 from sagebot.work_rag import *
 from sagebot.work_rag import carregar_indice_existente
+from sagebot.cache_consultas import RESPOSTAS
+from sagebot.chat_async import RespostaStream, agendar
+from sagebot.contexto import ORCAMENTO_PADRAO, montar_contexto
+from sagebot.memoria import Conversa
+from sagebot.embeddings_locais import BACKENDS_EMBEDDING
+from sagebot.divisor import MODO_DIVISAO, MODOS_DIVISAO
+from sagebot import metricas
 import os
 os.environ.setdefault("USER_AGENT", "SageBot/1.0 (Streamlit)")
 
@@ -19,38 +26,41 @@ TIPOS_DE_ARQUIVOS =[
     'url','.md','.pdf'
 ]
 
+# orcamento: tokens do prompt por modelo (trechos recuperados / histórico da conversa)
 CONFIG_MODELOS ={'Groq': {'modelos': ['llama-3.1-8b-instant', 'llama-3.3-70b-versatile'],
-                          'chat': ChatGroq},
+                          'chat': ChatGroq,
+                          'orcamento': {'llama-3.1-8b-instant': {'contexto': 3000, 'historico': 1000},
+                                        'llama-3.3-70b-versatile': {'contexto': 4000, 'historico': 1500}}},
                   'OpenAI': {'modelos': [ 'gpt-4o', 'gpt-4.1-nano'],
-                             'chat': ChatOpenAI}}
+                             'chat': ChatOpenAI,
+                             'orcamento': {'gpt-4o': {'contexto': 6000, 'historico': 2000},
+                                           'gpt-4.1-nano': {'contexto': 4000, 'historico': 1500}}}}
 
 if "memoria" not in st.session_state:
-   st.session_state["memoria"] = []
+   st.session_state["memoria"] = Conversa()
 
 MENSAGENS_EXEMPLOS =[
     ("ASSISTANT", "Olá, como você está? Estou aqui para lhe ajudar sobre duvidas da documentação da AWS"),
 ]
 
 def carrega_arquivos(tipo_arquivos,arquivo):
+    """Lista de (caminho ou URL, nome da fonte) para a fila de indexação."""
     if tipo_arquivos == '.md':
-        if not arquivo:
+        arquivos = salvar_uploads(arquivo, '.md')
+        if not arquivos:
             st.error("Envie pelo menos um .md")
             st.stop()
-        documento = carrega_md(arquivo)  
-        return documento
+        return arquivos
 
     if tipo_arquivos == '.pdf':
-        paths = salvar_tmp(arquivo, '.pdf')
-        if not paths:
+        arquivos = salvar_uploads(arquivo, '.pdf')
+        if not arquivos:
             st.error("Envie pelo menos um PDF.")
             st.stop()
-        docs = [carrega_pdf(p) for p in paths]
-        documento = "\n\n".join(docs)
+        return arquivos
 
     if tipo_arquivos == 'url':
-        documento=carrega_site(arquivo)
-
-    return documento
+        return [(arquivo, arquivo)]
 
 def setup_chain(provedor, modelo, api_key):
     system_message = """
@@ -72,9 +82,12 @@ def setup_chain(provedor, modelo, api_key):
         chat = CONFIG_MODELOS[provedor]['chat'](model=modelo, api_key=api_key)
 
     st.session_state['chain'] = template | chat
+    st.session_state['modelo_chain'] = f"{provedor}/{modelo}"
+    st.session_state['modelo_llm'] = modelo
+    st.session_state['orcamento'] = CONFIG_MODELOS[provedor].get('orcamento', {}).get(modelo, ORCAMENTO_PADRAO)
 
 
-def carrega_modelo(provedor, modelo, api_key, tipo_arquivo,arquivo,embed_model, dims, k):
+def carrega_modelo(provedor, modelo, api_key, tipo_arquivo,arquivo,embed_model, dims, k, modo_busca=MODOS_BUSCA[0], fetch_k=30, divisao=MODO_DIVISAO):
 
     documento=carrega_arquivos(tipo_arquivo,arquivo)
 
@@ -98,12 +111,11 @@ def carrega_modelo(provedor, modelo, api_key, tipo_arquivo,arquivo,embed_model,
         chat = CONFIG_MODELOS[provedor]['chat'](model=modelo, api_key=api_key)
     chain = template | chat
     st.session_state['chain'] = chain
+    st.session_state['modelo_chain'] = f"{provedor}/{modelo}"
+    st.session_state['modelo_llm'] = modelo
+    st.session_state['orcamento'] = CONFIG_MODELOS[provedor].get('orcamento', {}).get(modelo, ORCAMENTO_PADRAO)
 
-    iniciar_async(documento, embed_model=embed_model, dims=dims, k=k)
-
-
-def tail_messages(messages, max_pairs=6):
-    return messages[-(max_pairs*2):]
+    iniciar_async(documento, embed_model=embed_model, dims=dims, k=k, modo_busca=modo_busca, fetch_k=fetch_k, divisao=divisao)
 
 
 def pagina_chat():
@@ -114,10 +126,16 @@ def pagina_chat():
         st.info('Inicialize o SageBot na barra lateral.')
         st.stop()
 
-    render_status()
+    acompanhar_job()
+    render_status(acompanhar_job)
 
-    mensagens = st.session_state.get('memoria', [])
-    for mensagem in mensagens:
+    conversa = st.session_state['memoria']
+    # as mensagens já resumidas ficam só no disco; lidas sob demanda
+    if conversa.n_resumidas and st.toggle(f"Mostrar {conversa.n_resumidas} mensagens anteriores", key="toggle_anteriores"):
+      st.caption(f"Resumo usado pelo modelo: {conversa.resumo}")
+      for mensagem in conversa.mensagens()[:conversa.n_resumidas]:
+        st.chat_message(mensagem.type).markdown(mensagem.content)
+    for mensagem in list(conversa.recentes):
       chat = st.chat_message(mensagem.type)
       chat.markdown(mensagem.content)
     
@@ -131,31 +149,72 @@ def pagina_chat():
     chat = st.chat_message("human")
     chat.markdown(input_usuario)
 
-    retriever = st.session_state.get("retriever",None)
-    contexto = "RAG ainda inicializando. Responda de forma geral e cite fontes oficiais."
+    # uma pergunta nova interrompe a resposta anterior que ainda estiver gerando
+    anterior = st.session_state.pop("chat_resposta", None)
+    if anterior is not None:
+        anterior.cancelar()
 
-    if retriever is not None:
+    # cache semântico só para perguntas sem histórico: follow-ups dependem da conversa
+    vs = st.session_state.get("vs")
+    chave_cache, vetor = None, None
+    if st.session_state.get("cache_semantico") and vs is not None and vs.embeddings and not len(conversa):
+        chave_cache = (st.session_state.get("current_index_hash", ""), st.session_state.get("modelo_chain", ""))
         try:
-            docs = retriever.invoke(input_usuario)
-            contexto = "\n\n".join(d.page_content for d in docs) if docs else "N/A"
+            vetor = vs.embeddings.embed_query(input_usuario)
+            achado = RESPOSTAS.buscar(chave_cache, vetor)
         except Exception as e:
-            st.warning(f"Não foi possível consultar o retriever ainda: {e}")
-        
-    
+            # cache quebrado não impede a resposta, mas fica visível nas métricas
+            metricas.registro.contar("sagebot_cache_semantico_falhas_total", erro=type(e).__name__)
+            chave_cache, achado = None, None
+        if achado:
+            pergunta, resposta, sim = achado
+            ai = st.chat_message("ai")
+            ai.markdown(resposta)
+            ai.caption(f"Resposta do cache semântico (similaridade {sim:.2f} com: “{pergunta}”)")
+            conversa.adicionar(HumanMessage(content=input_usuario), AIMessage(content=resposta))
+            return
 
-    hist = tail_messages(st.session_state['memoria'], max_pairs=6)
-    ai = st.chat_message("ai")
-
-    resposta = ai.write_stream(
-        chain.stream({
-            'system_message': st.session_state.get('system_message',''),
+    retriever = st.session_state.get("retriever",None)
+    # trechos e histórico entram até o orçamento de tokens do modelo, sem os pedaços repetidos pelo overlap do splitter
+    orcamento = st.session_state.get('orcamento', ORCAMENTO_PADRAO)
+    modelo_llm = st.session_state.get('modelo_llm', '')
+    hist = conversa.historico(orcamento['historico'], modelo_llm)
+    system_message = st.session_state.get('system_message','')
+
+    def montar_entrada(docs):
+        if retriever is None:
+            contexto = "RAG ainda inicializando. Responda de forma geral e cite fontes oficiais."
+        else:
+            contexto = montar_contexto(docs, orcamento['contexto'], modelo_llm)[0] if docs else ""
+            contexto = contexto or "N/A"
+        return {
+            'system_message': system_message,
             'context': contexto,
-            'input': input_usuario, 
+            'input': input_usuario,
             'chat_history': hist
-            }))
+            }
 
-    st.session_state['memoria'].append(HumanMessage(content=input_usuario))
-    st.session_state['memoria'].append(AIMessage(content=resposta))
+    # busca e aquecimento da conexão com o LLM rodam juntos; o streaming começa assim que o contexto fica pronto
+    stream = RespostaStream(chain, input_usuario, montar_entrada, retriever=retriever, chat=getattr(chain, "last", None))
+    st.session_state["chat_resposta"] = stream
+
+    ai = st.chat_message("ai")
+    resposta = ai.write_stream(stream)
+    if stream.erro_busca is not None:
+        st.warning(f"Não foi possível consultar o retriever ainda: {stream.erro_busca}")
+    m = stream.metricas
+    if "ttft_ms" in m:
+        ai.caption(f"Busca {m.get('busca_ms', 0):.0f} ms · 1º token {m['ttft_ms']:.0f} ms · total {m.get('total_ms', 0):.0f} ms")
+    hist_metricas = st.session_state.setdefault("metricas_chat", [])
+    hist_metricas.append(dict(m))
+    del hist_metricas[:-100]
+
+    conversa.adicionar(HumanMessage(content=input_usuario), AIMessage(content=resposta))
+    # mensagens que passaram do orçamento viram resumo em segundo plano, sem atrasar a próxima pergunta
+    if getattr(chain, "last", None) is not None:
+        agendar(conversa.aresumir(chain.last, orcamento['historico'], modelo_llm))
+    if chave_cache is not None and vetor is not None and retriever is not None:
+        RESPOSTAS.guardar(chave_cache, vetor, input_usuario, resposta)
 
     if st.session_state.pop("__needs_rerun", False):
         st.rerun()    
@@ -374,7 +433,7 @@ def ui_fonte_dados():
 
     with col2:
         if st.button('Apagar Histórico de Conversa', use_container_width=True):
-            st.session_state['memoria'] = []
+            st.session_state['memoria'] = Conversa()
 
 def sidebar():
     st.subheader("LLM & Embeddings")
@@ -399,15 +458,40 @@ def sidebar():
         st.session_state[f'api_key_{provedor}'] = api_key
 
         st.markdown("### Embeddings")
+        backend_emb = st.selectbox(
+            "Backend de embeddings",
+            list(BACKENDS_EMBEDDING),
+            index=0,
+            help="Local: roda na CPU (ONNX), sem rede nem custo por token; precisa do pacote fastembed.",
+            key="embed_backend_select"
+        )
         embed_model = st.selectbox(
-            "Modelo de embeddings (OpenAI)",
-            ["text-embedding-3-small", "text-embedding-3-large"],
+            f"Modelo de embeddings ({backend_emb})",
+            BACKENDS_EMBEDDING[backend_emb],
             index=0,
             help="small: mais barato/rápido; large: mais qualidade (custa mais).",
             key="embed_model_select"
         )
         dims = None
         k = st.slider("Top-K do Retriever", 1, 10, 4, key="k_slider")
+        fetch_k = st.slider(
+            "Candidatos do MMR (fetch_k)", 10, 500, 30, step=10,
+            help="Quantos vizinhos o MMR considera antes de diversificar. Mais = respostas mais variadas, busca um pouco mais lenta.",
+            key="fetch_k_slider"
+        )
+        modo_busca = st.selectbox(
+            "Modo de busca",
+            MODOS_BUSCA,
+            index=0,
+            help="Híbrida/Lexical acham nomes exatos de serviços, ações de API e códigos de erro.",
+            key="modo_busca_select"
+        )
+        st.session_state["cache_semantico"] = st.toggle(
+            "Cache semântico de respostas",
+            value=False,
+            help="Reaproveita a resposta de uma pergunta quase idêntica já feita sobre o mesmo índice (só no início da conversa).",
+            key="cache_semantico_toggle"
+        )
 
         openai_key = st.text_input("OPENAI_API_KEY (OpenAI)", type="password", key="openai_key_input")
         if openai_key:
@@ -425,6 +509,7 @@ def sidebar():
     indice_escolhido = None
     tipo_arquivo = None
     arquivo = None
+    divisao = MODO_DIVISAO
 
     if modo_fonte == "Usar índice existente":
         from work_rag import listar_indices_existentes
@@ -470,6 +555,13 @@ def sidebar():
             )
             if arquivo:
                 st.success(f"✅ {len(arquivo)} arquivo(s) PDF carregado(s) com sucesso!")
+        divisao = st.selectbox(
+            "Divisão dos trechos",
+            MODOS_DIVISAO,
+            index=MODOS_DIVISAO.index(MODO_DIVISAO),
+            help="caracteres: blocos de 1500 caracteres. estrutura: respeita títulos, páginas e blocos de código, mede em tokens do modelo de embedding e guarda a seção de cada trecho.",
+            key="divisao_select"
+        )
 
  
     col1, col2 = st.columns(2)
@@ -496,21 +588,31 @@ def sidebar():
             if modo_fonte == "Usar índice existente":
                 carregar_indice_existente(
                     h=indice_escolhido,
-                    embed_model=embed_model, dims=dims, k=k, compressed=True
+                    embed_model=embed_model, dims=dims, k=k, compressed=True,
+                    modo_busca=modo_busca, fetch_k=fetch_k
                 )
                 setup_chain(provedor, modelo, api_key)  # cria o chain (prompt + LLM)
                 st.session_state["__needs_rerun"] = True
                 st.success(f"Índice {indice_escolhido} carregado com sucesso!")
             else:
                 # fluxo de indexar novos arquivos/URL
-                carrega_modelo(provedor, modelo, api_key, tipo_arquivo, arquivo, embed_model, dims, k)
+                carrega_modelo(provedor, modelo, api_key, tipo_arquivo, arquivo, embed_model, dims, k, modo_busca, fetch_k, divisao)
                 st.success("SageBot carregado com sucesso!")
 
     with col2:
         if st.button('Apagar Histórico de Conversa', use_container_width=True, key="btn_clear"):
-            st.session_state['memoria'] = []
+            st.session_state['memoria'] = Conversa()
+
+    with st.expander("Métricas do processo"):
+        # somadas desde o start do servidor, de todas as sessões (Prometheus em SAGEBOT_METRICAS_PORTA)
+        resumo = metricas.registro.resumo()
+        if resumo:
+            st.table([{"etapa": e, **m} for e, m in sorted(resumo.items(), key=lambda x: -x[1]["segundos"])])
+        else:
+            st.caption("Nenhuma etapa medida ainda.")
 
 def main():
+    metricas.servir()
     with st.sidebar:
         sidebar()
     pagina_chat()
@@ -0,0 +1,187 @@
+# ann.py
+import math, os, warnings
+from typing import List, Optional, Sequence
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from .metricas import registro
+
+TIPOS_INDICE = ("auto", "flat", "hnsw", "ivf", "ivfpq")
+
+# abaixo de LIMIAR_HNSW a busca exata já é rápida; acima de LIMIAR_PQ os
+# vetores float32 deixam de caber em RAM e passam a ser comprimidos
+LIMIAR_HNSW = int(os.environ.get("SAGEBOT_LIMIAR_HNSW", "20000"))
+LIMIAR_IVF  = int(os.environ.get("SAGEBOT_LIMIAR_IVF", "500000"))
+LIMIAR_PQ   = int(os.environ.get("SAGEBOT_LIMIAR_PQ", "2000000"))
+
+NPROBE    = int(os.environ.get("SAGEBOT_NPROBE", "0")) or None
+EF_SEARCH = int(os.environ.get("SAGEBOT_EF_SEARCH", "0")) or None
+
+HNSW_M = 32
+NPROBE_MIN = 8  # com nlist pequeno, nlist // 32 daria 1 lista visitada e recall de um dígito
+BLOCO = 65536  # vetores reconstruídos por vez, para não duplicar a matriz inteira
+
+
+def escolher_tipo(n: int) -> str:
+    if n < LIMIAR_HNSW:
+        return "flat"
+    if n < LIMIAR_IVF:
+        return "hnsw"
+    if n < LIMIAR_PQ:
+        return "ivf"
+    return "ivfpq"
+
+
+def _nlist(n: int) -> int:
+    return max(16, min(65536, int(4 * math.sqrt(max(n, 1)))))
+
+
+def _pq_m(d: int) -> int:
+    """Nº de subquantizadores do PQ: ~8 dimensões por código, dividindo d."""
+    for m in range(max(1, d // 8), 0, -1):
+        if d % m == 0:
+            return m
+    return 1
+
+
+def tamanho_amostra(tipo: str, n: int) -> int:
+    """Quantos vetores usar no treino (o resto do corpus só é adicionado)."""
+    if tipo == "ivf":
+        return min(n, 40 * _nlist(n))
+    if tipo == "ivfpq":
+        return min(n, max(40 * _nlist(n), 256 * 40))
+    return 0
+
+
+def viavel(tipo: str, n_treino: int, n: int) -> bool:
+    """IVF precisa de ao menos nlist pontos de treino; PQ de 8 bits, de 256."""
+    if tipo == "ivf":
+        return n_treino >= _nlist(n)
+    if tipo == "ivfpq":
+        return n_treino >= max(_nlist(n), 256)
+    return True
+
+
+def criar_indice(tipo: str, d: int, n: int, metrica: int = faiss.METRIC_L2) -> faiss.Index:
+    if tipo == "flat":
+        return faiss.IndexFlat(d, metrica)
+    if tipo == "hnsw":
+        index = faiss.IndexHNSWFlat(d, HNSW_M, metrica)
+        index.hnsw.efConstruction = 200
+        index.hnsw.efSearch = 64
+        return index
+    nlist = _nlist(n)
+    quantizer = faiss.IndexFlat(d, metrica)
+    if tipo == "ivf":
+        index = faiss.IndexIVFFlat(quantizer, d, nlist, metrica)
+    elif tipo == "ivfpq":
+        index = faiss.IndexIVFPQ(quantizer, d, nlist, _pq_m(d), 8, metrica)
+    else:
+        raise ValueError(f"Tipo de índice desconhecido: {tipo}")
+    # os vetores entram com add() simples (ids = posições 0..n-1): o mapa em
+    # array é o que o reconstruct por posição usa (o Hashtable só é
+    # preenchido por add_with_ids e falha com "key not found")
+    index.set_direct_map_type(faiss.DirectMap.Array)
+    index.nprobe = min(nlist, max(NPROBE_MIN, nlist // 32))
+    return index
+
+
+def _rebaixar(pedido: str, motivo: str) -> str:
+    """Tipo pedido inviável: avisa (uma vez por local) e usa flat."""
+    registro.contar("sagebot_indice_rebaixado_total", tipo=pedido)
+    warnings.warn(f"Índice {pedido} inviável ({motivo}); usando flat.", RuntimeWarning, stacklevel=3)
+    return "flat"
+
+
+def _mapa_direto(index: faiss.Index):
+    """IVF salvo com o mapa Hashtable (versões anteriores): refaz em array a
+    partir das listas invertidas, que guardam as posições como ids."""
+    ivf = faiss.extract_index_ivf(index) if isinstance(index, faiss.IndexIVF) else None
+    if ivf is not None and ivf.direct_map.type != faiss.DirectMap.Array:
+        ivf.set_direct_map_type(faiss.DirectMap.Array)
+
+
+def tipo_de(index: faiss.Index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def suporta_remocao(index: faiss.Index) -> bool:
+    """Só o flat renumera as posições no remove_ids como o FAISS do LangChain espera;
+    HNSW não remove e IVF mantém os ids antigos, então esses são reconstruídos."""
+    return tipo_de(index) == "flat"
+
+
+def ajustar_busca(index: faiss.Index, nprobe: Optional[int] = NPROBE, ef_search: Optional[int] = EF_SEARCH):
+    """nprobe (IVF) / efSearch (HNSW): mais alto = mais recall, mais lento."""
+    if isinstance(index, faiss.IndexIVF):
+        _mapa_direto(index)
+        index.nprobe = nprobe or max(index.nprobe, min(index.nlist, NPROBE_MIN))
+    if ef_search and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+def vetores(index: faiss.Index, posicoes: Optional[Sequence[int]] = None) -> np.ndarray:
+    _mapa_direto(index)
+    if posicoes is None:
+        return index.reconstruct_n(0, index.ntotal)
+    return index.reconstruct_batch(np.asarray(posicoes, dtype="int64"))
+
+
+def indice_treinado(tipo: str, amostra: np.ndarray, n: int, metrica: int = faiss.METRIC_L2) -> faiss.Index:
+    if not viavel(tipo, len(amostra), n):
+        tipo = _rebaixar(tipo, f"{len(amostra)} vetores de treino para n={n}")
+    index = criar_indice(tipo, amostra.shape[1], n, metrica)
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(amostra, dtype="float32"))
+    return index
+
+
+def converter_indice(vs: FAISS, tipo: str = "auto", manter: Optional[List[int]] = None) -> FAISS:
+    """Recria o índice do `vs` como `tipo` (treinando numa amostra).
+
+    `manter` restringe às posições dadas (usado para apagar de um HNSW, que
+    não suporta remove_ids). Devolve um FAISS novo; o original não muda.
+    """
+    n = vs.index.ntotal if manter is None else len(manter)
+    if tipo == "auto":
+        tipo = escolher_tipo(n)
+    if not viavel(tipo, tamanho_amostra(tipo, n), n):
+        tipo = _rebaixar(tipo, f"corpus de {n} vetores")
+    if manter is None and tipo == tipo_de(vs.index):
+        return vs
+
+    posicoes = list(range(vs.index.ntotal)) if manter is None else list(manter)
+    metrica = vs.index.metric_type
+    k = tamanho_amostra(tipo, n)
+    if k:
+        sorteio = np.sort(np.random.default_rng(0).choice(len(posicoes), size=k, replace=False))
+        amostra = vetores(vs.index, [posicoes[i] for i in sorteio])
+    else:
+        amostra = np.zeros((0, vs.index.d), dtype="float32")
+    novo = indice_treinado(tipo, amostra, n, metrica) if k else criar_indice(tipo, vs.index.d, n, metrica)
+
+    mapa, docs = {}, {}
+    for ini in range(0, len(posicoes), BLOCO):
+        bloco = posicoes[ini:ini + BLOCO]
+        novo.add(vetores(vs.index, bloco))
+        for j, pos in enumerate(bloco):
+            _id = vs.index_to_docstore_id[pos]
+            mapa[ini + j] = _id
+            docs[_id] = vs.docstore.search(_id)
+    return FAISS(
+        vs.embeddings,
+        novo,
+        InMemoryDocstore(docs),
+        mapa,
+        normalize_L2=getattr(vs, "_normalize_L2", False),
+        distance_strategy=vs.distance_strategy,
+    )
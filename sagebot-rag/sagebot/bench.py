@@ -0,0 +1,324 @@
+# bench.py
+"""Benchmark do pipeline RAG, offline e determinístico.
+
+    python -m sagebot.bench --tamanhos 1000,10000,100000 --saida bench.json
+    python -m sagebot.bench --tamanhos 1000,10000 --comparar bench.json
+
+Para cada tamanho gera um corpus sintético (arquivos .md num diretório
+temporário) e mede, etapa por etapa, o caminho do app: leitura
+(loader.iter_fontes) → split → embeddings + FAISS (build_vectorstore, com o
+backend "sintetico:<dims>") → salvar/carregar → busca (RetrieverVetorial)
+→ montagem do prompt (montar_contexto + template do chat) → resposta de um
+LLM falso via RespostaStream. Nada sai da máquina.
+
+Por etapa: segundos, itens/s, p50/p95/p99 por item (lote de embedding,
+consulta) e pico de RSS. O resultado é um JSON; com --comparar, as etapas
+que ficaram mais lentas que a tolerância vão para o stderr e o código de
+saída é 1 (para CI).
+"""
+import argparse, itertools, json, os, platform, random, shutil, sys, tempfile, threading, time
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+from . import ann
+from .chat_async import RespostaStream
+from .contexto import ORCAMENTO_PADRAO, montar_contexto
+from .index_store import carregar_indice, salvar_indice
+from .loader import iter_fontes
+from .divisor import MODOS_DIVISAO, divisor
+from .rag import build_vectorstore, embeddings, retriever, split_documents, split_text
+
+TAMANHOS_PADRAO = [1_000, 10_000, 100_000]
+CHUNKS_POR_ARQUIVO = 200
+INTERVALO_RSS = 0.005
+
+_VOCABULARIO = (
+    "bucket instância região zona política IAM função Lambda fila SQS tópico SNS tabela DynamoDB "
+    "cluster EKS tarefa ECS volume EBS snapshot VPC sub-rede rota gateway balanceador listener "
+    "certificado KMS chave segredo parâmetro log métrica alarme CloudWatch pilha CloudFormation "
+    "permissão papel usuário grupo cota limite custo reserva spot escalonamento réplica backup"
+).split()
+
+_RESPOSTA = (
+    "Para isso, crie uma política IAM com a permissão mínima necessária, associe ao papel "
+    "da função e confira no CloudWatch se as chamadas passam. Veja docs.aws.amazon.com."
+)
+
+_TEMPLATE = ChatPromptTemplate.from_messages([
+    ("system", "{system_message}"),
+    MessagesPlaceholder("chat_history"),
+    ("human", "Contexto:\n```\n{context}\n```\n\nPergunta: {input}"),
+])
+
+
+def _rss() -> int:
+    """RSS atual em bytes (Linux); fora dele, o pico do processo."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico if sys.platform == "darwin" else pico * 1024
+
+
+class Etapa:
+    """Cronometra uma etapa e amostra o RSS numa thread enquanto ela roda."""
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.itens = 0
+        self.latencias: List[float] = []  # segundos por item (lote, consulta)
+        self.segundos = 0.0
+        self._pico = 0
+        self._fim = threading.Event()
+
+    def _amostrar(self):
+        while not self._fim.wait(INTERVALO_RSS):
+            self._pico = max(self._pico, _rss())
+
+    def __enter__(self):
+        self._pico = _rss()
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+        self._thread.start()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.segundos = time.perf_counter() - self._t0
+        self._fim.set()
+        self._thread.join()
+        self._pico = max(self._pico, _rss())
+
+    def resultado(self) -> Dict:
+        r = {
+            "segundos": round(self.segundos, 4),
+            "itens": self.itens,
+            "itens_por_s": round(self.itens / self.segundos, 1) if self.segundos > 0 else None,
+            "rss_pico_mb": round(self._pico / 2**20, 1),
+        }
+        if self.latencias:
+            p50, p95, p99 = np.percentile(np.asarray(self.latencias) * 1000, [50, 95, 99])
+            r.update(p50_ms=round(float(p50), 3), p95_ms=round(float(p95), 3), p99_ms=round(float(p99), 3))
+        return r
+
+
+def _frase(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(_VOCABULARIO) for _ in range(n)).capitalize() + "."
+
+
+def gerar_corpus(pasta: str, n_chunks: int, chunk_size: int, semente: int = 0) -> List[tuple]:
+    """Escreve .md sintéticos com ~`n_chunks` chunks no total; devolve (caminho, nome)."""
+    rng = random.Random(semente)
+    os.makedirs(pasta, exist_ok=True)
+    itens = []
+    for a in range(max(1, -(-n_chunks // CHUNKS_POR_ARQUIVO))):
+        n = min(CHUNKS_POR_ARQUIVO, n_chunks - a * CHUNKS_POR_ARQUIVO) or 1
+        blocos = []
+        for _ in range(n):
+            # um parágrafo por chunk, um pouco abaixo do chunk_size para não ser quebrado
+            paragrafo = []
+            while sum(len(p) + 1 for p in paragrafo) < chunk_size * 0.8:
+                paragrafo.append(_frase(rng, rng.randint(6, 18)))
+            blocos.append(" ".join(paragrafo))
+        caminho = os.path.join(pasta, f"doc-{a:05d}.md")
+        with open(caminho, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(blocos))
+        itens.append((caminho, os.path.basename(caminho)))
+    return itens
+
+
+def _consultas(chunks: List[Document], n: int, semente: int = 0) -> List[str]:
+    rng = random.Random(semente)
+    perguntas = []
+    for _ in range(n):
+        frases = rng.choice(chunks).page_content.split(". ")
+        perguntas.append(rng.choice(frases)[:200])
+    return perguntas
+
+
+def _medir_embeddings(emb, etapa: Etapa):
+    """Envolve embed_documents para registrar a latência de cada lote."""
+    original = emb.embed_documents
+
+    def embed_documents(texts):
+        t = time.perf_counter()
+        try:
+            return original(texts)
+        finally:
+            etapa.latencias.append(time.perf_counter() - t)
+            etapa.itens += len(texts)
+
+    emb.embed_documents = embed_documents
+
+
+def rodar(n_chunks: int, pasta: str, args) -> Dict:
+    modelo = f"sintetico:{args.dims}"
+    itens = gerar_corpus(os.path.join(pasta, "corpus"), n_chunks, args.chunk_size)
+    etapas: Dict[str, Etapa] = {}
+
+    with Etapa("ingestao") as e:
+        paginas = list(iter_fontes(itens, pdf_workers=1))
+        e.itens = len(paginas)
+    etapas[e.nome] = e
+
+    with Etapa("split") as e:
+        splitter = split_text(chunk_size=args.chunk_size, chunk_overlap=100) if args.divisao == "caracteres" else divisor(args.divisao, modelo)
+        chunks = list(split_documents(paginas, splitter))
+        e.itens = len(chunks)
+    etapas[e.nome] = e
+    del paginas
+
+    # build_vectorstore cria o próprio Embeddings; o sintético é barato, então
+    # a etapa "embed" mede o mesmo modelo lote a lote num passe separado
+    emb = embeddings(model=modelo)
+    with Etapa("embed") as e:
+        _medir_embeddings(emb, e)
+        for i in range(0, len(chunks), args.lote):
+            emb.embed_documents([d.page_content for d in chunks[i:i + args.lote]])
+    etapas[e.nome] = e
+
+    with Etapa("indexacao") as e:
+        vs = build_vectorstore(
+            chunks, embed_model=modelo, cache=False, step=args.lote,
+            max_workers=args.embed_workers, tipo_indice=args.tipo_indice, n_estimado=len(chunks),
+        )
+        e.itens = vs.index.ntotal
+    etapas[e.nome] = e
+
+    path = os.path.join(pasta, "indice")
+    with Etapa("salvar") as e:
+        salvar_indice(vs, path)
+        e.itens = vs.index.ntotal
+    etapas[e.nome] = e
+    del vs
+
+    with Etapa("carregar") as e:
+        vs = carregar_indice(path, emb, mmap=True)
+        e.itens = vs.index.ntotal
+    etapas[e.nome] = e
+
+    perguntas = _consultas(chunks, args.consultas)
+    del chunks
+    ret = retriever(vs, k=args.k, fetch_k=args.fetch_k)
+    resultados = []
+    with Etapa("busca") as e:
+        for q in perguntas:
+            t = time.perf_counter()
+            resultados.append(ret.invoke(q))
+            e.latencias.append(time.perf_counter() - t)
+        e.itens = len(perguntas)
+    etapas[e.nome] = e
+
+    with Etapa("prompt") as e:
+        for q, docs in zip(perguntas, resultados):
+            t = time.perf_counter()
+            contexto = montar_contexto(docs, ORCAMENTO_PADRAO["contexto"])[0]
+            _TEMPLATE.format_messages(system_message="SageBot", chat_history=[], context=contexto, input=q)
+            e.latencias.append(time.perf_counter() - t)
+        e.itens = len(perguntas)
+    etapas[e.nome] = e
+
+    # LLM falso: sem rede, mede só a busca + montagem + streaming do app
+    chain = _TEMPLATE | GenericFakeChatModel(messages=itertools.cycle([AIMessage(content=_RESPOSTA)]))
+    ttft = []
+    with Etapa("chat") as e:
+        for q in perguntas:
+            stream = RespostaStream(
+                chain, q, retriever=ret,
+                montar_entrada=lambda docs, q=q: {
+                    "system_message": "SageBot", "chat_history": [], "input": q,
+                    "context": montar_contexto(docs or [], ORCAMENTO_PADRAO["contexto"])[0],
+                },
+            )
+            for _ in stream:
+                pass
+            e.latencias.append(stream.metricas["total_ms"] / 1000)
+            ttft.append(stream.metricas.get("ttft_ms", 0.0))
+        e.itens = len(perguntas)
+    etapas[e.nome] = e
+
+    saida = {nome: et.resultado() for nome, et in etapas.items()}
+    if ttft:
+        saida["chat"]["ttft_p50_ms"] = round(float(np.percentile(ttft, 50)), 3)
+        saida["chat"]["ttft_p95_ms"] = round(float(np.percentile(ttft, 95)), 3)
+    return {"chunks_alvo": n_chunks, "chunks": etapas["split"].itens, "etapas": saida}
+
+
+def comparar(atual: Dict, anterior: Dict, tolerancia: float) -> List[str]:
+    """Etapas mais lentas que `anterior` além da tolerância (vazão ou p95)."""
+    antes = {r["chunks_alvo"]: r["etapas"] for r in anterior.get("resultados", [])}
+    regressoes = []
+    for r in atual["resultados"]:
+        for nome, m in r["etapas"].items():
+            a = antes.get(r["chunks_alvo"], {}).get(nome)
+            if not a:
+                continue
+            if a.get("itens_por_s") and m.get("itens_por_s") and m["itens_por_s"] < a["itens_por_s"] * (1 - tolerancia):
+                regressoes.append(f"{r['chunks_alvo']}/{nome}: {a['itens_por_s']} -> {m['itens_por_s']} itens/s")
+            if a.get("p95_ms") and m.get("p95_ms") and m["p95_ms"] > a["p95_ms"] * (1 + tolerancia):
+                regressoes.append(f"{r['chunks_alvo']}/{nome}: p95 {a['p95_ms']} -> {m['p95_ms']} ms")
+    return regressoes
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m sagebot.bench", description="Benchmark offline do pipeline RAG do SageBot.")
+    parser.add_argument("--tamanhos", default=",".join(map(str, TAMANHOS_PADRAO)), help="chunks por rodada, separados por vírgula (ex.: 1000,10000,1000000)")
+    parser.add_argument("--dims", type=int, default=384)
+    parser.add_argument("--chunk-size", type=int, default=1500)
+    parser.add_argument("--divisao", default="caracteres", choices=MODOS_DIVISAO, help="estrutura: títulos/código, medido em tokens (ignora --chunk-size)")
+    parser.add_argument("--lote", type=int, default=128, help="chunks por lote de embedding")
+    parser.add_argument("--embed-workers", type=int, default=1)
+    parser.add_argument("--tipo-indice", default="auto", choices=ann.TIPOS_INDICE)
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--fetch-k", type=int, default=30)
+    parser.add_argument("--dir", default=None, help="diretório de trabalho (padrão: temporário, apagado no fim)")
+    parser.add_argument("--saida", default=None, help="arquivo JSON do resultado (padrão: stdout)")
+    parser.add_argument("--comparar", default=None, help="JSON de uma execução anterior")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="piora aceita no --comparar (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    tamanhos = [int(t) for t in args.tamanhos.split(",") if t.strip()]
+    raiz = args.dir or tempfile.mkdtemp(prefix="sagebot-bench-")
+    resultado = {
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("dir", "saida", "comparar")},
+        "resultados": [],
+    }
+    try:
+        for n in tamanhos:
+            pasta = os.path.join(raiz, str(n))
+            print(f"[bench] {n} chunks...", file=sys.stderr, flush=True)
+            resultado["resultados"].append(rodar(n, pasta, args))
+            if not args.dir:
+                shutil.rmtree(pasta, ignore_errors=True)
+    finally:
+        if not args.dir:
+            shutil.rmtree(raiz, ignore_errors=True)
+
+    texto = json.dumps(resultado, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regressoes = comparar(resultado, json.load(f), args.tolerancia)
+        for r in regressoes:
+            print(f"[bench] regressão: {r}", file=sys.stderr)
+        return 1 if regressoes else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
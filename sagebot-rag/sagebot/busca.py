@@ -0,0 +1,178 @@
+# busca.py
+import os, threading
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from langchain_community.vectorstores import FAISS
+
+from . import ann
+from .index_store import ARQ_PAIS_OFF, DocstoreEmDisco, carregar_pais
+from .metricas import etapa
+
+
+def _normalizar(m: np.ndarray) -> np.ndarray:
+    n = np.linalg.norm(m, axis=-1, keepdims=True)
+    n[n == 0] = 1.0
+    return m / n
+
+
+def mmr_lote(
+    consultas: np.ndarray,
+    candidatos: np.ndarray,
+    k: int,
+    lambda_mult: float = 0.5,
+    validos: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """MMR vetorizado para B consultas de uma vez.
+
+    `consultas` é [B, d], `candidatos` é [B, F, d] e `validos` ([B, F]) marca
+    as linhas de preenchimento. Devolve [B, k] com os índices escolhidos em
+    cada linha (-1 quando faltam candidatos). Cada passo guloso é uma operação
+    [B, F], sem a matriz F x F inteira, então fetch_k na casa das centenas
+    continua barato. Mesmo critério e desempate do
+    langchain_community.vectorstores.utils.maximal_marginal_relevance.
+    """
+    B, F, _ = candidatos.shape
+    k = min(k, F)
+    saida = np.full((B, k), -1, dtype="int64")
+    if B == 0 or k == 0:
+        return saida
+    if validos is None:
+        validos = np.ones((B, F), dtype=bool)
+
+    q = _normalizar(consultas.astype("float32"))
+    c = _normalizar(candidatos.astype("float32"))
+    relevancia = np.einsum("bfd,bd->bf", c, q)
+    bloqueado = ~validos
+    linhas = np.arange(B)
+
+    score = np.where(bloqueado, -np.inf, relevancia)
+    escolha = score.argmax(axis=1)
+    ok = np.isfinite(score[linhas, escolha])
+    saida[:, 0] = np.where(ok, escolha, -1)
+    bloqueado[linhas, escolha] = True
+    redundancia = np.einsum("bfd,bd->bf", c, c[linhas, escolha])
+
+    for j in range(1, k):
+        score = lambda_mult * relevancia - (1 - lambda_mult) * redundancia
+        score[bloqueado] = -np.inf
+        escolha = score.argmax(axis=1)
+        ok = np.isfinite(score[linhas, escolha])
+        saida[:, j] = np.where(ok, escolha, -1)
+        bloqueado[linhas, escolha] = True
+        redundancia = np.maximum(redundancia, np.einsum("bfd,bd->bf", c, c[linhas, escolha]))
+    return saida
+
+
+class RetrieverVetorial(BaseRetriever):
+    """MMR + filtro de similaridade usando os vetores que já estão no índice.
+
+    Substitui o par MMR + EmbeddingsFilter: em vez de embedar de novo os
+    chunks retornados, reconstrói os vetores candidatos direto do FAISS e
+    aplica o limiar de cosseno num passo NumPy. Só a consulta é embedada.
+    """
+
+    vs: FAISS
+    k: int = 4
+    fetch_k: int = 30
+    lambda_mult: float = 0.5
+    similarity_threshold: Optional[float] = None
+
+    def candidatos(self, consultas: np.ndarray):
+        """Posições [B, F] (-1 = vazio) e vetores armazenados [B, F, d] dos vizinhos."""
+        q = np.ascontiguousarray(consultas, dtype="float32").copy()
+        if getattr(self.vs, "_normalize_L2", False):
+            faiss.normalize_L2(q)
+        _, idx = self.vs.index.search(q, self.fetch_k)
+        vetores = np.zeros(idx.shape + (self.vs.index.d,), dtype="float32")
+        validos = idx != -1
+        if validos.any():
+            vetores[validos] = ann.vetores(self.vs.index, idx[validos])
+        return idx, vetores
+
+    def buscar_lote(self, consultas: List[str]) -> List[List[Document]]:
+        """Várias perguntas numa busca FAISS e num MMR vetorizado só."""
+        if not consultas:
+            return []
+        with etapa("embed_consulta"):
+            q = np.asarray([self.vs._embed_query(c) for c in consultas], dtype="float32")
+        with etapa("busca_vetorial"):
+            pos, vetores = self.candidatos(q)
+            escolhidos = mmr_lote(q, vetores, self.k, self.lambda_mult, validos=pos != -1)
+
+        if self.similarity_threshold is not None:
+            with etapa("compressao"):
+                linhas = np.arange(len(consultas))[:, None]
+                sims = np.einsum("bkd,bd->bk", _normalizar(vetores[linhas, np.maximum(escolhidos, 0)]), _normalizar(q))
+                escolhidos = np.where(sims >= self.similarity_threshold, escolhidos, -1)
+
+        resultado = []
+        for b in range(len(consultas)):
+            docs = []
+            for i in escolhidos[b]:
+                if i < 0:
+                    continue
+                doc = self.vs.docstore.search(self.vs.index_to_docstore_id[int(pos[b, i])])
+                if isinstance(doc, Document):
+                    docs.append(doc)
+            resultado.append(docs)
+        return resultado
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.buscar_lote([query])[0]
+
+
+FILHOS_POR_PAI = 3  # trechos buscados por seção pedida: vizinhos costumam cair na mesma seção
+
+_pais: Dict[str, Tuple[int, DocstoreEmDisco]] = {}
+_lock_pais = threading.Lock()
+
+
+def pais_de(path: str) -> Optional[DocstoreEmDisco]:
+    """Seções-pai do índice em `path` (abertas uma vez por processo e de novo
+    quando um delta troca o pais.off); None se não houver."""
+    try:
+        versao = os.stat(os.path.join(path, ARQ_PAIS_OFF)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _lock_pais:
+        atual = _pais.get(path)
+        if atual is None or atual[0] != versao:
+            ds = carregar_pais(path)
+            if ds is None:
+                return None
+            atual = _pais[path] = (versao, ds)
+        return atual[1]
+
+
+class RetrieverPais(BaseRetriever):
+    """Busca nos trechos pequenos e devolve as seções-pai deles.
+
+    O `base` é chamado com k * FILHOS_POR_PAI; só as seções dos k primeiros
+    pais distintos são lidas do disco, na ordem do melhor trecho de cada uma.
+    Trechos sem "pai" (ex.: vindos de um delta) voltam como estão.
+    """
+
+    base: BaseRetriever
+    pais: DocstoreEmDisco
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        filhos = self.base.invoke(query)
+        with etapa("secoes_pai"):
+            saida, vistos = [], set()
+            for f in filhos:
+                pai = f.metadata.get("pai")
+                if pai is None:
+                    saida.append(f)
+                elif pai not in vistos:
+                    vistos.add(pai)
+                    doc = self.pais.search(str(pai))
+                    saida.append(doc if isinstance(doc, Document) else f)
+                if len(saida) >= self.k:
+                    break
+        return saida
@@ -0,0 +1,128 @@
+# cache_consultas.py
+import os, threading, time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+QUERY_CACHE_MAX = int(os.environ.get("SAGEBOT_QUERY_CACHE_MAX", "4096"))
+QUERY_CACHE_TTL = float(os.environ.get("SAGEBOT_QUERY_CACHE_TTL", "3600"))
+RESPOSTAS_MAX = int(os.environ.get("SAGEBOT_RESPOSTAS_MAX", "500"))
+RESPOSTAS_TTL = float(os.environ.get("SAGEBOT_RESPOSTAS_TTL", "86400"))
+LIMIAR_SEMANTICO = float(os.environ.get("SAGEBOT_LIMIAR_SEMANTICO", "0.97"))
+
+
+class LRUTTL:
+    """Dicionário LRU com expiração, seguro entre threads."""
+
+    def __init__(self, max_itens: int, ttl: float):
+        self.max_itens, self.ttl = max_itens, ttl
+        self._d: "OrderedDict[object, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            item = self._d.get(chave)
+            if item is None:
+                return None
+            t, valor = item
+            if time.monotonic() - t > self.ttl:
+                del self._d[chave]
+                return None
+            self._d.move_to_end(chave)
+            return valor
+
+    def put(self, chave, valor):
+        with self._lock:
+            self._d[chave] = (time.monotonic(), valor)
+            self._d.move_to_end(chave)
+            while len(self._d) > self.max_itens:
+                self._d.popitem(last=False)
+
+
+class EmbeddingsComCacheDeConsulta(Embeddings):
+    """Embeda a consulta uma vez só: o retriever e o filtro de compressão
+    recebem o mesmo vetor. Documentos passam direto para o backend."""
+
+    def __init__(self, base: Embeddings, max_itens: int = QUERY_CACHE_MAX, ttl: float = QUERY_CACHE_TTL):
+        self.base = base
+        self.cache = LRUTTL(max_itens, ttl)
+
+    def embed_query(self, text: str) -> List[float]:
+        vetor = self.cache.get(text)
+        if vetor is None:
+            vetor = self.base.embed_query(text)
+            self.cache.put(text, vetor)
+        return vetor
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+
+_por_modelo: Dict[Tuple[str, Optional[int]], EmbeddingsComCacheDeConsulta] = {}
+_lock = threading.Lock()
+
+
+def embeddings_consulta(base_factory, model: str, dims=None) -> EmbeddingsComCacheDeConsulta:
+    """Um wrapper por (modelo, dims) no processo, então o cache vale para todas as sessões."""
+    with _lock:
+        emb = _por_modelo.get((model, dims))
+        if emb is None:
+            emb = EmbeddingsComCacheDeConsulta(base_factory(model=model, dimensions=dims))
+            _por_modelo[(model, dims)] = emb
+        return emb
+
+
+class CacheRespostas:
+    """Cache semântico: devolve a resposta de uma pergunta quase idêntica já
+    respondida sobre o mesmo índice (e com o mesmo LLM)."""
+
+    def __init__(self, max_itens: int = RESPOSTAS_MAX, ttl: float = RESPOSTAS_TTL):
+        self.max_itens, self.ttl = max_itens, ttl
+        self._por_chave: Dict[Tuple[str, str], Dict] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalizar(vetor) -> np.ndarray:
+        v = np.asarray(vetor, dtype="float32")
+        n = float(np.linalg.norm(v))
+        return v / n if n else v
+
+    def buscar(self, chave: Tuple[str, str], vetor, limiar: float = LIMIAR_SEMANTICO) -> Optional[Tuple[str, str, float]]:
+        """Retorna (pergunta, resposta, similaridade) ou None."""
+        with self._lock:
+            ent = self._por_chave.get(chave)
+            if not ent or not ent["respostas"]:
+                return None
+            agora = time.monotonic()
+            vivos = [i for i, t in enumerate(ent["tempos"]) if agora - t <= self.ttl]
+            if len(vivos) < len(ent["tempos"]):
+                self._manter(ent, vivos)
+                if not vivos:
+                    return None
+            sims = ent["matriz"] @ self._normalizar(vetor)
+            i = int(np.argmax(sims))
+            if sims[i] < limiar:
+                return None
+            return ent["perguntas"][i], ent["respostas"][i], float(sims[i])
+
+    def guardar(self, chave: Tuple[str, str], vetor, pergunta: str, resposta: str):
+        v = self._normalizar(vetor)[None, :]
+        with self._lock:
+            ent = self._por_chave.setdefault(chave, {"matriz": None, "perguntas": [], "respostas": [], "tempos": []})
+            ent["matriz"] = v if ent["matriz"] is None else np.vstack([ent["matriz"], v])
+            ent["perguntas"].append(pergunta)
+            ent["respostas"].append(resposta)
+            ent["tempos"].append(time.monotonic())
+            if len(ent["respostas"]) > self.max_itens:
+                self._manter(ent, list(range(len(ent["respostas"]) - self.max_itens, len(ent["respostas"]))))
+
+    @staticmethod
+    def _manter(ent: Dict, idx: List[int]):
+        ent["matriz"] = ent["matriz"][idx] if idx else None
+        for campo in ("perguntas", "respostas", "tempos"):
+            ent[campo] = [ent[campo][i] for i in idx]
+
+
+RESPOSTAS = CacheRespostas()
@@ -0,0 +1,171 @@
+# chat_async.py
+import asyncio, queue, threading, time, uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.schema import Document
+
+from .metricas import observar_etapa, rastreio, registro
+
+AQUECER_TIMEOUT = 3.0
+
+_FIM = object()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+
+def loop() -> asyncio.AbstractEventLoop:
+    """Event loop do processo numa thread própria.
+
+    Fica vivo entre reruns do Streamlit, então os clientes async do LLM
+    (presos ao loop em que foram usados) mantêm as conexões abertas.
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="sagebot-chat", daemon=True).start()
+        return _loop
+
+
+def agendar(coro) -> "asyncio.Future":
+    """Roda `coro` no loop do processo, sem esperar (tarefas de fundo do chat)."""
+    return asyncio.run_coroutine_threadsafe(coro, loop())
+
+
+def _cliente_http(chat):
+    """(cliente httpx async, base_url) do SDK por trás do chat, se achar."""
+    raiz = getattr(chat, "root_async_client", None)  # ChatOpenAI
+    if raiz is None:
+        raiz = getattr(getattr(chat, "async_client", None), "_client", None)  # ChatGroq
+    http = getattr(raiz, "_client", None)
+    if http is None or not hasattr(http, "head"):
+        return None, None
+    return http, str(getattr(raiz, "base_url", "") or "")
+
+
+async def aquecer(chat):
+    """Abre (ou reaproveita) a conexão TLS com o provedor enquanto a busca roda.
+
+    Um HEAD sem autenticação basta: o status não importa, só a conexão que
+    fica no pool do httpx para a chamada de verdade.
+    """
+    http, base = _cliente_http(chat)
+    if http is None or not base:
+        return
+    try:
+        await asyncio.wait_for(http.head(base), AQUECER_TIMEOUT)
+    except Exception:
+        pass
+
+
+class RespostaStream:
+    """Uma resposta do chat em andamento.
+
+    Busca e aquecimento do cliente do LLM rodam juntos no loop do processo;
+    assim que o contexto fica pronto a chain começa a gerar e os tokens
+    chegam por uma fila. Iterar devolve os tokens (serve para
+    st.write_stream); parar de iterar ou chamar cancelar() interrompe a
+    geração. `metricas` tem busca_ms, ttft_ms (primeiro token) e total_ms,
+    contados a partir da criação; as mesmas etapas vão para o registro de
+    metricas.py sob o rastreio `id`.
+    """
+
+    def __init__(
+        self,
+        chain,
+        pergunta: str,
+        montar_entrada: Callable[[Optional[List[Document]]], Dict[str, Any]],
+        retriever=None,
+        chat=None,
+    ):
+        self.pergunta = pergunta
+        self.id = uuid.uuid4().hex[:12]
+        self.docs: Optional[List[Document]] = None
+        self.erro_busca: Optional[Exception] = None
+        self.metricas: Dict[str, float] = {}
+        self._t0 = time.perf_counter()
+        self._fila: "queue.Queue" = queue.Queue()
+        self._fut = asyncio.run_coroutine_threadsafe(self._rodar(chain, montar_entrada, retriever, chat), loop())
+
+    def _ms(self) -> float:
+        return round((time.perf_counter() - self._t0) * 1000, 1)
+
+    async def _buscar(self, retriever):
+        if retriever is None:
+            return
+        t0 = time.perf_counter()
+        try:
+            self.docs = await retriever.ainvoke(self.pergunta)
+        except Exception as e:
+            self.erro_busca = e
+            registro.contar("sagebot_busca_falhas_total")
+        observar_etapa("recuperacao", time.perf_counter() - t0)
+        self.metricas["busca_ms"] = self._ms()
+
+    async def _rodar(self, chain, montar_entrada, retriever, chat):
+        with rastreio(self.id):
+            await self._gerar(chain, montar_entrada, retriever, chat)
+
+    async def _gerar(self, chain, montar_entrada, retriever, chat):
+        # o aquecimento não segura a resposta: se a busca acabar antes, a chain abre a própria conexão
+        aquecimento = asyncio.ensure_future(aquecer(chat))
+        t_llm = None
+        try:
+            await self._buscar(retriever)
+            entrada = montar_entrada(self.docs)
+            registro.contar("sagebot_llm_chamadas_total")
+            t_llm = time.perf_counter()
+            async for chunk in chain.astream(entrada):
+                uso = getattr(chunk, "usage_metadata", None)
+                if uso:
+                    # só vem quando o provedor manda o uso no stream
+                    registro.contar("sagebot_llm_tokens_total", uso.get("input_tokens", 0), tipo="entrada")
+                    registro.contar("sagebot_llm_tokens_total", uso.get("output_tokens", 0), tipo="saida")
+                texto = getattr(chunk, "content", chunk)
+                if not texto:
+                    continue
+                registro.contar("sagebot_llm_chunks_total")
+                if "ttft_ms" not in self.metricas:
+                    self.metricas["ttft_ms"] = self._ms()
+                    observar_etapa("llm_primeiro_token", time.perf_counter() - t_llm)
+                self._fila.put(texto)
+        except asyncio.CancelledError:
+            self.metricas["cancelada"] = 1.0
+            registro.contar("sagebot_llm_canceladas_total")
+            raise
+        except Exception as e:
+            registro.contar("sagebot_llm_falhas_total", erro=type(e).__name__)
+            self._fila.put(e)
+        finally:
+            aquecimento.cancel()
+            if t_llm is not None:
+                observar_etapa("llm_resposta", time.perf_counter() - t_llm)
+            self.metricas["total_ms"] = self._ms()
+            self._fila.put(_FIM)
+
+    def __iter__(self):
+        try:
+            while True:
+                try:
+                    item = self._fila.get(timeout=0.1)
+                except queue.Empty:
+                    # cancelada antes de começar: o _rodar nem chegou a rodar
+                    if self._fut.done() and self._fila.empty():
+                        return
+                    continue
+                if item is _FIM:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # o rerun do Streamlit (nova mensagem) para de consumir o gerador
+            self.cancelar()
+
+    def cancelar(self):
+        if not self._fut.done():
+            self._fut.cancel()
+
+    @property
+    def terminada(self) -> bool:
+        return self._fut.done()
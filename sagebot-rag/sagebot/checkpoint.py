@@ -0,0 +1,146 @@
+# checkpoint.py
+import hashlib, json, os, shutil
+from itertools import chain
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+from .lotes import EMBED_TPM, EMBED_WORKERS, embed_em_lotes
+
+DIR_PARCIAL = ".parcial"  # dentro de data/index; começa com ponto para não ser listado como índice
+ARQ_VETORES = "vetores.f32"
+ARQ_LOTES = "lotes.jsonl"  # uma linha {"h", "n", "d"} por lote, só acrescentada
+ARQ_LOTES_ANTIGO = "lotes.json"  # formato anterior: a lista inteira regravada a cada lote
+
+
+def _hash_lote(lote: List[Document]) -> str:
+    h = hashlib.sha1()
+    for d in lote:
+        h.update(d.page_content.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class CheckpointEmbeddings:
+    """Lotes já embedados de um job, gravados à medida que terminam.
+
+    `path` guarda os vetores em float32 contíguos (vetores.f32) e, em
+    lotes.jsonl, uma linha com o hash do texto e o tamanho de cada lote
+    (gravar um lote custa o mesmo no primeiro e no milésimo). Numa nova execução
+    com a mesma entrada, os lotes cujo hash bate são lidos do disco em vez de
+    irem para a API; no primeiro que diverge o checkpoint é truncado e dali
+    em diante tudo é embedado (e gravado) de novo.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.d: Optional[int] = None
+        self.lotes: List[Tuple[str, int]] = []
+        self._ler()
+        self._truncar(len(self.lotes))
+
+    def _ler(self):
+        try:
+            with open(os.path.join(self.path, ARQ_LOTES), encoding="utf-8") as f:
+                for linha in f:
+                    try:
+                        rec = json.loads(linha)
+                        h, n, d = rec["h"], rec["n"], rec["d"]
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        break  # linha cortada por um crash: o resto não vale
+                    if self.d is not None and d != self.d:
+                        break
+                    self.d = d
+                    self.lotes.append((h, n))
+            return
+        except FileNotFoundError:
+            pass
+        try:
+            with open(os.path.join(self.path, ARQ_LOTES_ANTIGO), encoding="utf-8") as f:
+                dados = json.load(f)
+            self.d, self.lotes = dados["d"], [tuple(x) for x in dados["lotes"]]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+
+    @property
+    def linhas(self) -> int:
+        return sum(n for _, n in self.lotes)
+
+    def _truncar(self, n_lotes: int):
+        """Descarta os lotes a partir de `n_lotes` (e bytes de uma escrita
+        interrompida); lotes sem todos os vetores no disco também saem."""
+        self.lotes = self.lotes[:n_lotes]
+        arq = os.path.join(self.path, ARQ_VETORES)
+        existentes = os.path.getsize(arq) if os.path.exists(arq) else 0
+        while self.lotes and self.linhas * (self.d or 0) * 4 > existentes:
+            self.lotes.pop()
+        tamanho = self.linhas * (self.d or 0) * 4
+        if existentes != tamanho:
+            with open(arq, "r+b") as f:
+                f.truncate(tamanho)
+        self._reescrever_lotes()
+
+    def _linha(self, h: str, n: int) -> str:
+        return json.dumps({"h": h, "n": n, "d": self.d}) + "\n"
+
+    def _reescrever_lotes(self):
+        """Só na abertura e quando a entrada diverge; no resto é append."""
+        tmp = os.path.join(self.path, ARQ_LOTES + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(self._linha(h, n) for h, n in self.lotes)
+        os.replace(tmp, os.path.join(self.path, ARQ_LOTES))
+        antigo = os.path.join(self.path, ARQ_LOTES_ANTIGO)
+        if os.path.exists(antigo):
+            os.remove(antigo)
+
+    def _anexar(self, lote: List[Document], vetores):
+        m = np.asarray(vetores, dtype="float32")
+        if self.d is None:
+            self.d = int(m.shape[1])
+        # vetores primeiro, linha do lote depois: um crash no meio deixa bytes
+        # sobrando (truncados na abertura), nunca um lote sem os vetores
+        with open(os.path.join(self.path, ARQ_VETORES), "ab") as f:
+            f.write(m.tobytes())
+        h = _hash_lote(lote)
+        with open(os.path.join(self.path, ARQ_LOTES), "a", encoding="utf-8") as f:
+            f.write(self._linha(h, len(lote)))
+        self.lotes.append((h, len(lote)))
+
+    def embed_em_lotes(
+        self,
+        emb,
+        lotes: Iterable[List[Document]],
+        max_workers: int = EMBED_WORKERS,
+        tpm: Optional[int] = EMBED_TPM,
+    ) -> Iterator[Tuple[List[Document], List[List[float]]]]:
+        """Como lotes.embed_em_lotes, mas reaproveitando/gravando o checkpoint."""
+        it = iter(lotes)
+        divergente = None
+        if self.lotes:
+            vetores = np.memmap(os.path.join(self.path, ARQ_VETORES), dtype="float32", mode="r", shape=(self.linhas, self.d))
+            ini = 0
+            for i, (h, n) in enumerate(self.lotes):
+                lote = next(it, None)
+                if lote is None or len(lote) != n or _hash_lote(lote) != h:
+                    divergente = lote
+                    del vetores
+                    self._truncar(i)
+                    break
+                yield lote, vetores[ini:ini + n].tolist()
+                ini += n
+            else:
+                del vetores
+
+        resto = chain([divergente], it) if divergente is not None else it
+        for lote, vetores in embed_em_lotes(emb, resto, max_workers=max_workers, tpm=tpm):
+            self._anexar(lote, vetores)
+            yield lote, vetores
+
+    def descartar(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def caminho_parcial(base: str, chave: str) -> str:
+    return os.path.join(base, DIR_PARCIAL, chave)
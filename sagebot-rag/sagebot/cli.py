@@ -0,0 +1,235 @@
+# cli.py
+"""Indexação em lote, fora do Streamlit.
+
+    python -m sagebot.cli indexar docs/ manual.pdf https://docs.aws.amazon.com/... @urls.txt corpora.json
+    python -m sagebot.cli listar
+
+Cada entrada vira um índice em data/index/<hash> (o app só enxerga índices
+completos, via listar_indices_existentes). Diretórios são varridos atrás de
+.md/.txt/.pdf; `@arquivo` é uma lista de caminhos/URLs, uma por linha; um
+.json é um manifesto {"corpora": [{"nome": ..., "fontes": [...]}]}.
+"""
+import argparse, hashlib, json, os, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from . import ann
+from .divisor import MODO_DIVISAO, MODOS_DIVISAO, divisor
+from .embeddings_locais import BACKENDS_EMBEDDING
+from .indexador import BASE_INDEX, caminho_indice, indexar, indice_pronto, listar_indices, paginas_alteradas
+from .loader import EXT_PDF, EXT_TEXTO, PDF_WORKERS, eh_url, iter_fontes
+from .lotes import EMBED_WORKERS
+from .metricas import rastreio, registro, servir
+
+ARQ_ESTADO = ".cli_estado.json"
+INTERVALO_LOG_ANDAMENTO = 10.0  # segundos entre linhas de vazão/ETA no stderr
+
+_lock_saida = threading.Lock()
+
+
+def _varrer(pasta: str) -> List[Tuple[str, str]]:
+    """(caminho, nome relativo) dos arquivos suportados, em ordem estável."""
+    achados = []
+    for raiz, dirs, arquivos in os.walk(pasta):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for a in sorted(arquivos):
+            if a.lower().endswith(EXT_TEXTO + EXT_PDF):
+                p = os.path.join(raiz, a)
+                achados.append((p, os.path.relpath(p, pasta)))
+    return achados
+
+
+def _expandir(fontes: List[str]) -> List[Tuple[str, str]]:
+    """Fontes -> lista de (caminho ou URL, nome da fonte)."""
+    itens = []
+    for f in fontes:
+        if eh_url(f):
+            itens.append((f, f))
+        elif os.path.isdir(f):
+            itens.extend(_varrer(f))
+        elif os.path.isfile(f):
+            itens.append((f, os.path.basename(f)))
+        else:
+            raise FileNotFoundError(f"Fonte não encontrada: {f}")
+    return itens
+
+
+def corpora_de(entradas: List[str], juntar: bool = False) -> List[Tuple[str, List[Tuple[str, str]]]]:
+    """Entradas da linha de comando -> [(nome do corpus, itens)]."""
+    corpora = []
+    for e in entradas:
+        if e.startswith("@"):
+            with open(e[1:], encoding="utf-8") as f:
+                linhas = [l.strip() for l in f if l.strip() and not l.lstrip().startswith("#")]
+            corpora.append((os.path.basename(e[1:]), _expandir(linhas)))
+        elif e.lower().endswith(".json") and os.path.isfile(e):
+            with open(e, encoding="utf-8") as f:
+                man = json.load(f)
+            for i, c in enumerate(man.get("corpora", [])):
+                corpora.append((c.get("nome") or f"{os.path.basename(e)}#{i}", _expandir(c["fontes"])))
+        else:
+            corpora.append((os.path.basename(e.rstrip("/")) or e, _expandir([e])))
+    if juntar and len(corpora) > 1:
+        corpora = [("+".join(n for n, _ in corpora), [it for _, itens in corpora for it in itens])]
+    return corpora
+
+
+def chave_retomada(itens: List[Tuple[str, str]], embed_model: str, dims, divisao: str = "caracteres") -> str:
+    """Nome do checkpoint do corpus; o conteúdo é conferido lote a lote na retomada."""
+    cfg = [embed_model, dims, itens] + ([divisao] if divisao != "caracteres" else [])
+    return hashlib.sha1(json.dumps(cfg).encode("utf-8")).hexdigest()
+
+
+def chave_corpus(itens: List[Tuple[str, str]], embed_model: str, dims, divisao: str = "caracteres") -> Optional[str]:
+    """Assinatura barata (caminho, tamanho, mtime) do corpus; None se tiver URL,
+    cujo conteúdo só se conhece baixando."""
+    partes = [embed_model, str(dims)] + ([divisao] if divisao != "caracteres" else [])
+    for alvo, nome in itens:
+        if eh_url(alvo):
+            return None
+        st = os.stat(alvo)
+        partes.append(f"{nome}\0{st.st_size}\0{st.st_mtime_ns}")
+    return hashlib.sha1("\n".join(partes).encode("utf-8")).hexdigest()
+
+
+class Estado:
+    """Corpora já indexados (chave -> hash), para uma reexecução pular o que
+    não mudou sem nem ler os arquivos. Guarda também a última versão de cada
+    conjunto de arquivos (chave_retomada -> hash), para comparar páginas."""
+
+    def __init__(self, base: str):
+        self.path = os.path.join(base, ARQ_ESTADO)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._d: Dict[str, str] = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._d = {}
+
+    def hash_de(self, chave: Optional[str], base: str) -> Optional[str]:
+        h = self._d.get(chave) if chave else None
+        return h if h and indice_pronto(caminho_indice(h, base)) else None
+
+    def marcar(self, chave: Optional[str], h: str):
+        if not chave:
+            return
+        with self._lock:
+            self._d[chave] = h
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._d, f)
+            os.replace(tmp, self.path)
+
+
+def _log(nome: str, msg: str):
+    with _lock_saida:
+        print(f"[{nome}] {msg}", file=sys.stderr, flush=True)
+
+
+def _resultado(dados: Dict):
+    with _lock_saida:
+        print(json.dumps(dados, ensure_ascii=False), flush=True)
+
+
+def indexar_corpus(nome, itens, args, estado: Estado) -> bool:
+    t0 = time.monotonic()
+    chave = chave_corpus(itens, args.modelo, args.dims, args.divisao)
+    h = estado.hash_de(chave, args.base)
+    if h and not args.forcar:
+        _log(nome, f"sem mudanças desde a última execução ({h}).")
+        _resultado({"nome": nome, "hash": h, "status": "inalterado", "segundos": 0.0})
+        return True
+
+    ultimo_detalhe = [0.0]
+
+    def progresso(step=None, pct=None, log=None, detalhe=None):
+        if log:
+            _log(nome, log)
+        if detalhe and time.monotonic() - ultimo_detalhe[0] >= INTERVALO_LOG_ANDAMENTO:
+            ultimo_detalhe[0] = time.monotonic()
+            _log(nome, detalhe)
+
+    def progresso_pdf(feitos, total, log=None):
+        if log:
+            _log(nome, log)
+        elif feitos == total or feitos % 10 == 0:
+            _log(nome, f"PDF: {feitos}/{total} trechos extraídos")
+
+    retomada = chave_retomada(itens, args.modelo, args.dims, args.divisao)
+    anterior = estado.hash_de(retomada, args.base)
+    try:
+        with rastreio(nome):
+            h, novo = indexar(
+                iter_fontes(
+                    itens, pdf_workers=args.pdf_workers, progresso=progresso_pdf,
+                    andamento=lambda feito: progresso(detalhe=f"Leitura: {feito.texto()}"),
+                ),
+                embed_model=args.modelo, dims=args.dims, base=args.base, progresso=progresso,
+                tipo_indice=args.tipo_indice, max_workers=args.embed_workers,
+                retomada=retomada, splitter=divisor(args.divisao, args.modelo),
+            )
+    except Exception as e:
+        _log(nome, f"Erro: {e}")
+        _resultado({"nome": nome, "status": "erro", "erro": str(e), "segundos": round(time.monotonic() - t0, 2)})
+        return False
+    estado.marcar(chave, h)
+    estado.marcar(retomada, h)
+    resultado = {"nome": nome, "hash": h, "status": "novo" if novo else "existente", "segundos": round(time.monotonic() - t0, 2)}
+    if anterior and anterior != h:
+        # mesmos arquivos com conteúdo novo: quais páginas mudaram desde a última versão
+        mudadas = paginas_alteradas(anterior, h, args.base)
+        if mudadas is not None:
+            _log(nome, f"{len(mudadas)} página(s) diferente(s) de {anterior}.")
+            resultado.update(anterior=anterior, paginas_alteradas=mudadas)
+    _resultado(resultado)
+    return True
+
+
+def cmd_indexar(args) -> int:
+    corpora = corpora_de(args.entradas, juntar=args.juntar)
+    estado = Estado(args.base)
+    servir()
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        oks = list(pool.map(lambda c: indexar_corpus(c[0], c[1], args, estado), corpora))
+    if args.metricas:
+        with open(args.metricas, "w", encoding="utf-8") as f:
+            f.write(registro.prometheus())
+    return 0 if all(oks) else 1
+
+
+def cmd_listar(args) -> int:
+    for h in listar_indices(args.base):
+        print(h)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    modelos = [m for lista in BACKENDS_EMBEDDING.values() for m in lista]
+    parser = argparse.ArgumentParser(prog="python -m sagebot.cli", description="Indexação do SageBot sem o Streamlit.")
+    parser.add_argument("--base", default=BASE_INDEX, help=f"diretório dos índices (padrão: {BASE_INDEX})")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("indexar", help="constrói índices a partir de diretórios, arquivos, URLs, @listas ou manifestos .json")
+    p.add_argument("entradas", nargs="+")
+    p.add_argument("--modelo", default=modelos[0], help=f"modelo de embeddings ({', '.join(modelos)})")
+    p.add_argument("--dims", type=int, default=None)
+    p.add_argument("--tipo-indice", default="auto", choices=ann.TIPOS_INDICE)
+    p.add_argument("--divisao", default=MODO_DIVISAO, choices=MODOS_DIVISAO, help="caracteres (1500) ou estrutura (títulos/código, em tokens)")
+    p.add_argument("--embed-workers", type=int, default=EMBED_WORKERS, help="lotes de embedding em paralelo")
+    p.add_argument("--pdf-workers", type=int, default=PDF_WORKERS, help="processos para extrair PDFs (padrão: nº de núcleos)")
+    p.add_argument("--jobs", type=int, default=1, help="corpora indexados ao mesmo tempo")
+    p.add_argument("--juntar", action="store_true", help="um índice só com todas as entradas")
+    p.add_argument("--forcar", action="store_true", help="reindexa mesmo sem mudanças nos arquivos")
+    p.add_argument("--metricas", default=None, help="grava no fim as métricas (formato texto do Prometheus) neste arquivo")
+    p.set_defaults(func=cmd_indexar)
+
+    p = sub.add_parser("listar", help="lista os índices completos")
+    p.set_defaults(func=cmd_listar)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+# contexto.py
+import re, threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain.schema import Document
+
+from .lotes import estimar_tokens
+
+# orçamento padrão quando o modelo não declara o seu em CONFIG_MODELOS
+ORCAMENTO_PADRAO = {"contexto": 3000, "historico": 1500}
+
+MIN_SOBREPOSICAO = 20   # menos que isso pode ser coincidência (", e a")
+MAX_SOBREPOSICAO = 400  # o split_text usa chunk_overlap=100; sobra folga para separadores
+LIMIAR_DUPLICATA = 0.85
+SEPARADOR = "\n\n"
+
+_encoders: Dict[str, Optional[Callable[[str], int]]] = {}
+_lock = threading.Lock()
+
+
+def contador_tokens(modelo: str = "") -> Callable[[str], int]:
+    """Conta tokens com o tiktoken do modelo (cl100k_base para modelos de
+    outros provedores). Sem o arquivo de encoding (ex.: máquina sem rede),
+    cai na estimativa de ~4 caracteres por token."""
+    with _lock:
+        if modelo not in _encoders:
+            try:
+                import tiktoken
+                try:
+                    enc = tiktoken.encoding_for_model(modelo)
+                except KeyError:
+                    enc = tiktoken.get_encoding("cl100k_base")
+                _encoders[modelo] = lambda t, enc=enc: len(enc.encode(t, disallowed_special=()))
+            except Exception:
+                _encoders[modelo] = None
+        contar = _encoders[modelo]
+    return contar or estimar_tokens
+
+
+def _sobreposicao(a: str, b: str) -> int:
+    """Tamanho do maior sufixo de `a` que é prefixo de `b` (0 se < MIN_SOBREPOSICAO)."""
+    for k in range(min(len(a), len(b), MAX_SOBREPOSICAO), MIN_SOBREPOSICAO - 1, -1):
+        if a.endswith(b[:k]):
+            return k
+    return 0
+
+
+def _mesma_fonte(a: Document, b: Document) -> bool:
+    return a.metadata.get("source") == b.metadata.get("source") and a.metadata.get("page") == b.metadata.get("page")
+
+
+def mesclar(docs: Sequence[Document]) -> List[Document]:
+    """Junta chunks vizinhos da mesma fonte que se sobrepõem (o overlap do
+    splitter) num trecho só, na posição do mais bem ranqueado deles. Um
+    chunk contido em outro some."""
+    trechos: List[Document] = [Document(page_content=d.page_content, metadata=dict(d.metadata)) for d in docs]
+    mudou = True
+    while mudou:
+        mudou = False
+        for i in range(len(trechos)):
+            for j in range(len(trechos)):
+                if i == j or not _mesma_fonte(trechos[i], trechos[j]):
+                    continue
+                a, b = trechos[i].page_content, trechos[j].page_content
+                if b in a:
+                    novo = a
+                else:
+                    k = _sobreposicao(a, b)
+                    if not k:
+                        continue
+                    novo = a + b[k:]
+                alvo, fora = min(i, j), max(i, j)
+                trechos[alvo].page_content = novo
+                del trechos[fora]
+                mudou = True
+                break
+            if mudou:
+                break
+    return trechos
+
+
+_PALAVRA = re.compile(r"\w+")
+
+
+def _shingles(texto: str, n: int = 3) -> set:
+    p = _PALAVRA.findall(texto.lower())
+    return {tuple(p[i:i + n]) for i in range(max(1, len(p) - n + 1))}
+
+
+def sem_duplicatas(docs: Sequence[Document], limiar: float = LIMIAR_DUPLICATA) -> List[Document]:
+    """Descarta trechos quase iguais a um mais bem ranqueado (Jaccard de
+    trigramas de palavras), ex.: a mesma página em duas versões do PDF."""
+    mantidos: List[Tuple[Document, set]] = []
+    for d in docs:
+        sh = _shingles(d.page_content)
+        if any(len(sh & s) / (len(sh | s) or 1) >= limiar for _, s in mantidos):
+            continue
+        mantidos.append((d, sh))
+    return [d for d, _ in mantidos]
+
+
+def montar_contexto(docs: Sequence[Document], orcamento: int, modelo: str = "") -> Tuple[str, List[Document]]:
+    """Mescla, deduplica e empacota os trechos na ordem do retriever até
+    `orcamento` tokens. Um trecho que não cabe é pulado (um menor, mais
+    abaixo, ainda pode caber). Retorna (texto, trechos usados)."""
+    contar = contador_tokens(modelo)
+    sep = contar(SEPARADOR)
+    usados, total = [], 0
+    for d in sem_duplicatas(mesclar(docs)):
+        n = contar(d.page_content) + (sep if usados else 0)
+        if total + n > orcamento:
+            continue
+        usados.append(d)
+        total += n
+    return SEPARADOR.join(d.page_content for d in usados), usados
+
+
+def historico_no_orcamento(mensagens: Sequence, orcamento: int, modelo: str = "") -> List:
+    """As mensagens mais recentes que cabem em `orcamento` tokens, em pares
+    pergunta/resposta inteiros."""
+    contar = contador_tokens(modelo)
+    escolhidas, total = [], 0
+    fim = len(mensagens) - len(mensagens) % 2
+    for i in range(fim - 2, -1, -2):
+        par = mensagens[i:i + 2]
+        n = sum(contar(m.content) for m in par)
+        if total + n > orcamento:
+            break
+        escolhidas[:0] = par
+        total += n
+    return escolhidas
@@ -0,0 +1,393 @@
+# divisor.py
+"""Divisão dos documentos em trechos respeitando a estrutura do texto.
+
+O modo "caracteres" é o RecursiveCharacterTextSplitter de sempre (1500
+caracteres, 100 de overlap). O modo "estrutura" (DivisorEstruturado):
+
+- nunca junta trechos de páginas (Documents) ou seções Markdown diferentes;
+- não quebra blocos de código cercados (``` / ~~~), a não ser que sozinhos
+  passem do tamanho, e aí quebra por linha reabrindo a cerca;
+- mede os trechos em tokens do modelo de embedding (tiktoken; sem ele, a
+  estimativa de ~4 caracteres por token), limitados à entrada do modelo;
+- grava em metadata["secao"] o caminho dos títulos ("Guia > IAM > Políticas");
+- divide muitos documentos (ou fatias de um texto gigante) num pool de
+  processos, mantendo a ordem.
+
+O modo "pais" (DivisorPais) divide assim em seções grandes e cada seção em
+trechos pequenos: só os pequenos são embedados e vão para o FAISS, com
+metadata["pai"] apontando para a seção, que fica em pais.jsonl ao lado do
+índice (ver busca.RetrieverPais).
+"""
+import multiprocessing, os, re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from langchain.schema import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from .contexto import contador_tokens
+from .embeddings_locais import backend_de
+from .index_store import ARQ_PAIS, ARQ_PAIS_OFF, EscritorDocstore
+
+MODOS_DIVISAO = ["caracteres", "estrutura", "pais"]
+MODO_DIVISAO = os.environ.get("SAGEBOT_DIVISAO", "caracteres")
+TOKENS_TRECHO = int(os.environ.get("SAGEBOT_TOKENS_TRECHO", "350"))
+# abaixo do MAX_SOBREPOSICAO do contexto.mesclar (~400 caracteres), que junta os vizinhos de volta
+TOKENS_SOBREPOSICAO = int(os.environ.get("SAGEBOT_TOKENS_SOBREPOSICAO", "50"))
+# modo "pais": a seção devolvida ao LLM e o trecho que é embedado
+TOKENS_PAI = int(os.environ.get("SAGEBOT_TOKENS_PAI", "1200"))
+TOKENS_FILHO = int(os.environ.get("SAGEBOT_TOKENS_FILHO", "120"))
+DIVISAO_WORKERS = int(os.environ.get("SAGEBOT_DIVISAO_WORKERS", str(os.cpu_count() or 1)))
+
+# entrada máxima (tokens) dos embeddings; os modelos locais são BERT
+LIMITE_TOKENS = {"openai": 8191, "local": 512, "sintetico": 8191}
+MARGEM_TOKENS = 16  # a contagem do cl100k não é a do tokenizer do modelo local
+
+DOCS_POR_TAREFA = 64
+TAM_FATIA = 1 << 20  # caracteres: texto maior que isso é fatiado para dividir em paralelo
+MIN_PARALELO = 4 * TAM_FATIA  # abaixo disso subir os processos custa mais do que dividir em série
+SEP = "\n\n"
+
+_TITULO = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t]*#*[ \t]*$")
+_CERCA = re.compile(r"^[ \t]{0,3}(`{3,}|~{3,})(.*)$")
+
+Secao = Tuple[Tuple[int, str], ...]  # ((nível, título), ...)
+
+
+class _Estado:
+    """Seção corrente e cerca de código aberta, linha a linha."""
+
+    def __init__(self, secao: Secao = ()):
+        self.secao = secao
+        self.cerca: Optional[str] = None
+
+    def linha(self, linha: str) -> str:
+        """Classifica a linha: "cerca", "codigo", "titulo", "vazia" ou "texto"."""
+        m = _CERCA.match(linha)
+        if self.cerca is not None:
+            if m and m.group(1)[0] == self.cerca[0] and len(m.group(1)) >= len(self.cerca) and not m.group(2).strip():
+                self.cerca = None
+                return "cerca"
+            return "codigo"
+        if m:
+            self.cerca = m.group(1)
+            return "cerca"
+        t = _TITULO.match(linha)
+        if t:
+            nivel = len(t.group(1))
+            self.secao = tuple(s for s in self.secao if s[0] < nivel) + ((nivel, t.group(2)),)
+            return "titulo"
+        return "vazia" if not linha.strip() else "texto"
+
+
+def fatiar(doc: Document, tamanho: int = TAM_FATIA) -> List[Document]:
+    """Corta um Document enorme em linhas em branco fora de código, a cada
+    ~`tamanho` caracteres; cada fatia leva a seção em que começa."""
+    texto = doc.page_content
+    if len(texto) <= tamanho:
+        return [doc]
+    fatias, estado = [], _Estado()
+    ini, secao_ini, pos = 0, (), 0
+    for linha in texto.splitlines(keepends=True):
+        tipo = estado.linha(linha.rstrip("\r\n"))
+        pos += len(linha)
+        if tipo == "vazia" and pos - ini >= tamanho:
+            fatias.append(Document(page_content=texto[ini:pos], metadata={**doc.metadata, "_secao": secao_ini}))
+            ini, secao_ini = pos, estado.secao
+    if ini < len(texto):
+        fatias.append(Document(page_content=texto[ini:], metadata={**doc.metadata, "_secao": secao_ini}))
+    return fatias
+
+
+class DivisorEstruturado:
+    """Splitter por estrutura e tokens (ver o docstring do módulo).
+
+    Tem a mesma interface usada do RecursiveCharacterTextSplitter no projeto
+    (split_text, split_documents) e, para muitos documentos, dividir().
+    """
+
+    modo = "estrutura"
+
+    def __init__(
+        self,
+        embed_model: str = "text-embedding-3-small",
+        tokens: int = TOKENS_TRECHO,
+        sobreposicao: int = TOKENS_SOBREPOSICAO,
+        workers: int = DIVISAO_WORKERS,
+    ):
+        self.embed_model = embed_model
+        self.tokens = min(tokens, LIMITE_TOKENS.get(backend_de(embed_model), 8191) - MARGEM_TOKENS)
+        self.sobreposicao = min(sobreposicao, self.tokens // 2)
+        self.workers = workers
+        self._contar = None
+
+    @property
+    def assinatura(self) -> str:
+        """Entra no hash do índice: outra divisão, outro índice."""
+        return f"estrutura:{self.tokens}:{self.sobreposicao}"
+
+    def __getstate__(self):
+        # o contador (tiktoken) não é serializável; cada processo monta o seu
+        return {**self.__dict__, "_contar": None}
+
+    def contar(self, texto: str) -> int:
+        if self._contar is None:
+            self._contar = contador_tokens(self.embed_model)
+        return self._contar(texto)
+
+    # -- blocos ---------------------------------------------------------
+
+    def _blocos(self, texto: str, secao: Secao) -> Iterator[Tuple[Secao, str, bool]]:
+        """(seção, texto, é_código) de cada parágrafo, título ou bloco de código."""
+        estado = _Estado(secao)
+        atual: List[str] = []
+        codigo = False
+
+        def soltar():
+            bloco = "\n".join(atual).strip("\n")
+            atual.clear()
+            return bloco
+
+        for linha in texto.splitlines():
+            secao_antes = estado.secao
+            tipo = estado.linha(linha)
+            if tipo == "cerca" and estado.cerca is not None:
+                # abriu um bloco de código: o parágrafo anterior termina aqui
+                if atual:
+                    yield secao_antes, soltar(), False
+                codigo = True
+                atual.append(linha)
+            elif tipo == "cerca":
+                atual.append(linha)
+                yield estado.secao, soltar(), True
+                codigo = False
+            elif tipo == "codigo":
+                atual.append(linha)
+            elif tipo == "titulo":
+                if atual:
+                    yield secao_antes, soltar(), False
+                yield estado.secao, linha.strip(), False
+            elif tipo == "vazia":
+                if atual:
+                    yield estado.secao, soltar(), False
+            else:
+                atual.append(linha)
+        if atual:
+            # cerca não fechada no fim do documento: fica como código mesmo assim
+            yield estado.secao, soltar(), codigo
+
+    def _quebrar(self, bloco: str, codigo: bool) -> List[str]:
+        """Bloco maior que o limite: código por linhas, texto pelo splitter recursivo em tokens."""
+        if not codigo:
+            return RecursiveCharacterTextSplitter(
+                chunk_size=self.tokens, chunk_overlap=self.sobreposicao,
+                length_function=self.contar, separators=["\n", ". ", "? ", " ", ""], keep_separator="end",
+            ).split_text(bloco)
+        linhas = bloco.split("\n")
+        abre, fecha = linhas[0], linhas[-1] if len(linhas) > 1 and _CERCA.match(linhas[-1]) else ""
+        corpo = linhas[1:-1] if fecha else linhas[1:]
+        pedacos, atual, n = [], [], self.contar(abre + fecha)
+        for linha in corpo:
+            t = self.contar(linha) + 1
+            if atual and n + t > self.tokens:
+                pedacos.append("\n".join([abre, *atual, fecha or abre[:3]]))
+                atual, n = [], self.contar(abre + fecha)
+            atual.append(linha)
+            n += t
+        if atual:
+            pedacos.append("\n".join([abre, *atual, fecha or abre[:3]]))
+        return pedacos
+
+    def _empacotar(self, blocos: Iterable[Tuple[Secao, str, bool]]) -> Iterator[Tuple[Secao, str]]:
+        sep = self.contar(SEP)
+        atual: List[Tuple[str, int]] = []  # (bloco, tokens)
+        secao_atual: Optional[Secao] = None
+
+        def soltar():
+            return secao_atual, SEP.join(b for b, _ in atual)
+
+        for secao, bloco, codigo in blocos:
+            if secao != secao_atual:
+                if atual:
+                    yield soltar()
+                atual, secao_atual = [], secao
+            t = self.contar(bloco)
+            if t > self.tokens:
+                if atual:
+                    yield soltar()
+                    atual = []
+                for pedaco in self._quebrar(bloco, codigo):
+                    yield secao, pedaco
+                continue
+            total = sum(n for _, n in atual) + sep * len(atual)
+            if atual and total + t > self.tokens:
+                yield soltar()
+                # overlap: os últimos blocos inteiros que cabem na sobreposição
+                resto, n = [], 0
+                for b, nb in reversed(atual[1:]):
+                    if n + nb + sep > self.sobreposicao:
+                        break
+                    resto.insert(0, (b, nb))
+                    n += nb + sep
+                atual = resto
+                if sum(n for _, n in atual) + sep * len(atual) + t > self.tokens:
+                    atual = []
+            atual.append((bloco, t))
+        if atual:
+            yield soltar()
+
+    # -- interface de splitter -------------------------------------------
+
+    def split_documents(self, docs: Iterable[Document]) -> List[Document]:
+        saida = []
+        for doc in docs:
+            meta = dict(doc.metadata)
+            secao_ini = tuple(tuple(s) for s in meta.pop("_secao", ()))
+            for secao, texto in self._empacotar(self._blocos(doc.page_content, secao_ini)):
+                if not texto.strip():
+                    continue
+                m = dict(meta)
+                if secao:
+                    m["secao"] = " > ".join(t for _, t in secao)
+                saida.append(Document(page_content=texto, metadata=m))
+        return saida
+
+    def split_text(self, texto: str) -> List[str]:
+        return [d.page_content for d in self.split_documents([Document(page_content=texto)])]
+
+    def dividir(self, docs: Iterable[Document]) -> Iterator[Document]:
+        """Como split_documents, em streaming e, para entradas grandes, em
+        `workers` processos (lotes de DOCS_POR_TAREFA, ordem preservada)."""
+        fatias = (f for d in docs for f in fatiar(d))
+        # lê adiante só até decidir se vale subir o pool
+        inicio, tamanho = [], 0
+        for f in fatias:
+            inicio.append(f)
+            tamanho += len(f.page_content)
+            if tamanho >= MIN_PARALELO:
+                break
+        if self.workers <= 1 or tamanho < MIN_PARALELO:
+            yield from self.split_documents(inicio)
+            for f in fatias:
+                yield from self.split_documents([f])
+            return
+
+        ctx = multiprocessing.get_context("spawn")  # fork dentro da thread do Streamlit não é seguro
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx) as pool:
+            pendentes = deque()
+            for lote in _lotes(chain(inicio, fatias)):
+                pendentes.append(pool.submit(_dividir_lote, self, lote))
+                if len(pendentes) >= 2 * self.workers:
+                    yield from pendentes.popleft().result()
+            while pendentes:
+                yield from pendentes.popleft().result()
+
+
+class DivisorPais(DivisorEstruturado):
+    """Seções de até `tokens` (não embedadas, sem limite do modelo), cada uma
+    dividida em trechos de `tokens_filho` pelo DivisorEstruturado.
+
+    dividir() devolve só os trechos, com metadata["pai"] = posição da seção
+    no docstore de pais, gravado em streaming por abrir()/publicar().
+    """
+
+    modo = "pais"
+
+    def __init__(
+        self,
+        embed_model: str = "text-embedding-3-small",
+        tokens: int = TOKENS_PAI,
+        tokens_filho: int = TOKENS_FILHO,
+        sobreposicao_filho: int = TOKENS_SOBREPOSICAO // 2,
+        workers: int = DIVISAO_WORKERS,
+    ):
+        super().__init__(embed_model=embed_model, tokens=tokens, sobreposicao=0, workers=workers)
+        self.tokens = tokens
+        self.filho = DivisorEstruturado(embed_model=embed_model, tokens=tokens_filho, sobreposicao=sobreposicao_filho, workers=1)
+        self._escritor: Optional[EscritorDocstore] = None
+
+    @property
+    def assinatura(self) -> str:
+        return f"pais:{self.tokens}:{self.filho.tokens}:{self.filho.sobreposicao}"
+
+    def __getstate__(self):
+        return {**super().__getstate__(), "_escritor": None}
+
+    def abrir(self, path: str, anexar: bool = False):
+        """Começa a gravar as seções em `path`: um diretório temporário ou,
+        com `anexar` (delta), o do próprio índice, depois das que já existem."""
+        self._escritor = EscritorDocstore(path, ARQ_PAIS, ARQ_PAIS_OFF, anexar=anexar)
+
+    def publicar(self, destino: str):
+        self._escritor.publicar(destino)
+        self._escritor = None
+
+    def descartar(self):
+        if self._escritor is not None:
+            self._escritor.descartar()
+            self._escritor = None
+
+    def split_documents(self, docs: Iterable[Document]) -> List[Document]:
+        # roda também nos processos do pool: a seção volta no primeiro
+        # trecho dela ("_pai") e é gravada por dividir(), no processo principal
+        saida = []
+        for pai in super().split_documents(docs):
+            filhos = self.filho.split_documents([pai])
+            for f in filhos:
+                f.metadata.pop("secao", None)
+                if "secao" in pai.metadata:
+                    # a seção nunca cruza títulos: o caminho completo é o dela
+                    f.metadata["secao"] = pai.metadata["secao"]
+            if filhos:
+                filhos[0].metadata["_pai"] = {"page_content": pai.page_content, "metadata": pai.metadata}
+            saida.extend(filhos)
+        return saida
+
+    def dividir(self, docs: Iterable[Document]) -> Iterator[Document]:
+        pos = None
+        for f in super().dividir(docs):
+            pai = f.metadata.pop("_pai", None)
+            if pai is not None:
+                if self._escritor is None:
+                    pos = None  # sem abrir(): trechos soltos, como no modo estrutura
+                else:
+                    n = len(self._escritor)
+                    pos = self._escritor.adicionar({"id": str(n), **pai})
+            if pos is not None:
+                f.metadata["pai"] = pos
+            yield f
+
+
+def _lotes(docs: Iterable[Document]) -> Iterator[List[Document]]:
+    """Até DOCS_POR_TAREFA documentos ou ~TAM_FATIA caracteres por tarefa."""
+    lote, tamanho = [], 0
+    for d in docs:
+        lote.append(d)
+        tamanho += len(d.page_content)
+        if len(lote) >= DOCS_POR_TAREFA or tamanho >= TAM_FATIA:
+            yield lote
+            lote, tamanho = [], 0
+    if lote:
+        yield lote
+
+
+def _dividir_lote(divisor: DivisorEstruturado, docs: List[Document]) -> List[Document]:
+    """Roda no processo filho."""
+    return divisor.split_documents(docs)
+
+
+def divisor(modo: str = MODO_DIVISAO, embed_model: str = "text-embedding-3-small"):
+    """Splitter do `modo` ("caracteres", "estrutura" ou "pais") para `embed_model`."""
+    if modo == "pais":
+        return DivisorPais(embed_model=embed_model)
+    if modo == "estrutura":
+        return DivisorEstruturado(embed_model=embed_model)
+    if modo != "caracteres":
+        raise ValueError(f"Modo de divisão desconhecido: {modo}")
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1500,
+        chunk_overlap=100,
+        separators=["\n\n", "\n", ". ", "? ", " ", ""],
+    )
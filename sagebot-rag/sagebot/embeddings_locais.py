@@ -0,0 +1,110 @@
+# embeddings_locais.py
+import hashlib, os, threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# o backend vai no próprio nome do modelo ("local:<modelo>"): namespace do
+# cache de chunks, hash do corpus e chave do registro já separam os vetores
+PREFIXO_LOCAL = "local:"
+# "sintetico:<dims>": vetores determinísticos, sem rede nem modelo (benchmark, testes offline)
+PREFIXO_SINTETICO = "sintetico:"
+
+BACKENDS_EMBEDDING = {
+    "OpenAI": ["text-embedding-3-small", "text-embedding-3-large"],
+    "Local (CPU, ONNX)": [
+        PREFIXO_LOCAL + "BAAI/bge-small-en-v1.5",
+        PREFIXO_LOCAL + "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+        PREFIXO_LOCAL + "intfloat/multilingual-e5-large",
+    ],
+}
+
+LOCAL_THREADS = int(os.environ.get("SAGEBOT_LOCAL_THREADS", "0")) or None
+LOCAL_BATCH = int(os.environ.get("SAGEBOT_LOCAL_BATCH", "64"))
+LOCAL_CACHE = os.environ.get("SAGEBOT_LOCAL_MODELS", "data/modelos")
+
+
+def eh_local(model: Optional[str]) -> bool:
+    return bool(model) and model.startswith(PREFIXO_LOCAL)
+
+
+def eh_sintetico(model: Optional[str]) -> bool:
+    return bool(model) and model.startswith(PREFIXO_SINTETICO)
+
+
+def backend_de(model: Optional[str]) -> str:
+    if eh_sintetico(model):
+        return "sintetico"
+    return "local" if eh_local(model) else "openai"
+
+
+class EmbeddingsLocais(Embeddings):
+    """Modelo de embeddings rodando na CPU via fastembed (ONNX Runtime).
+
+    Os textos são embedados em lotes de `batch_size`; o ONNX usa `threads`
+    núcleos por lote (None = todos). Não depende de rede depois que o modelo
+    foi baixado para `cache_dir`.
+    """
+
+    def __init__(self, model: str, threads: Optional[int] = LOCAL_THREADS, batch_size: int = LOCAL_BATCH, cache_dir: str = LOCAL_CACHE):
+        try:
+            from fastembed import TextEmbedding
+        except ImportError as e:
+            raise ImportError(
+                "Backend local de embeddings precisa do pacote fastembed: pip install fastembed"
+            ) from e
+        self.model = model
+        self.batch_size = batch_size
+        self._modelo = TextEmbedding(model_name=model, threads=threads, cache_dir=cache_dir)
+        # a sessão ONNX não é reentrante
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            return [v.tolist() for v in self._modelo.embed(texts, batch_size=self.batch_size)]
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            return next(iter(self._modelo.query_embed(text))).tolist()
+
+
+_modelos: Dict[str, EmbeddingsLocais] = {}
+_lock = threading.Lock()
+
+
+def embeddings_locais(model: str, dimensions=None) -> EmbeddingsLocais:
+    """Um modelo carregado por processo (carregar o ONNX custa segundos e RAM)."""
+    if dimensions is not None:
+        raise ValueError("Modelos locais não suportam reduzir dimensões.")
+    nome = model[len(PREFIXO_LOCAL):] if eh_local(model) else model
+    with _lock:
+        emb = _modelos.get(nome)
+        if emb is None:
+            emb = EmbeddingsLocais(nome)
+            _modelos[nome] = emb
+        return emb
+
+
+class EmbeddingsSinteticas(Embeddings):
+    """Vetor unitário pseudoaleatório semeado pelo hash do texto: o mesmo
+    texto dá sempre o mesmo vetor, em qualquer máquina. Não tem semântica
+    nenhuma; serve para medir o pipeline sem depender da API."""
+
+    def __init__(self, dims: int = 384):
+        self.dims = dims
+
+    def _vetor(self, texto: str) -> List[float]:
+        semente = int.from_bytes(hashlib.sha256(texto.encode("utf-8")).digest()[:8], "little")
+        v = np.random.default_rng(semente).standard_normal(self.dims, dtype=np.float32)
+        return (v / np.linalg.norm(v)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vetor(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vetor(text)
+
+
+def embeddings_sinteticas(model: str, dimensions=None) -> EmbeddingsSinteticas:
+    return EmbeddingsSinteticas(dimensions or int(model[len(PREFIXO_SINTETICO):] or 384))
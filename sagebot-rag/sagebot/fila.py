@@ -0,0 +1,258 @@
+# fila.py
+import hashlib, json, os, sqlite3, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from openai import APIConnectionError, AuthenticationError, RateLimitError
+
+from .divisor import divisor
+from .indexador import BASE_INDEX, INTERVALO_DETALHE, caminho_indice, indexar, indice_pronto
+from .loader import eh_url, iter_fontes
+from .metricas import rastreio
+
+DB_JOBS = os.environ.get("SAGEBOT_JOBS_DB", "data/jobs.sqlite3")
+INDEX_WORKERS = int(os.environ.get("SAGEBOT_INDEX_WORKERS", "2"))
+MAX_LOG = 200
+
+ATIVOS = ("fila", "rodando")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    chave TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    status TEXT NOT NULL,
+    etapa TEXT,
+    pct REAL DEFAULT 0,
+    log TEXT DEFAULT '[]',
+    detalhe TEXT,
+    erro TEXT,
+    hash TEXT,
+    novo INTEGER,
+    pid INTEGER,
+    criado REAL,
+    atualizado REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_chave ON jobs (chave, status);
+"""
+
+
+def chave_job(spec: Dict) -> str:
+    """Identifica o conteúdo do job: bytes dos arquivos (não o caminho
+    temporário do upload), URLs ou texto, + modelo/dims (e a divisão, fora a padrão)."""
+    cfg = [spec.get("embed_model"), spec.get("dims")]
+    if spec.get("divisao", "caracteres") != "caracteres":
+        cfg.append(spec["divisao"])
+    h = hashlib.sha1(json.dumps(cfg).encode("utf-8"))
+    if spec.get("texto") is not None:
+        h.update(b"texto\0" + spec["texto"].encode("utf-8"))
+    for alvo, nome in spec.get("itens", []):
+        h.update(f"\0{nome}\0".encode("utf-8"))
+        if eh_url(alvo):
+            h.update(alvo.encode("utf-8"))
+            continue
+        with open(alvo, "rb") as f:
+            for bloco in iter(lambda: f.read(1 << 20), b""):
+                h.update(bloco)
+    return h.hexdigest()
+
+
+def _vivo(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def mensagem_erro(e: Exception) -> str:
+    if isinstance(e, AuthenticationError):
+        return "OPENAI_API_KEY inválida ou ausente."
+    if isinstance(e, RateLimitError):
+        return "Rate limit excedido."
+    if isinstance(e, APIConnectionError):
+        return "Problemas de conexão com a OpenAI."
+    return str(e)
+
+
+class FilaIndexacao:
+    """Fila de indexação do processo, persistida em SQLite.
+
+    No máximo `max_workers` jobs embedam ao mesmo tempo; o resto espera na
+    fila. Um job com o mesmo conteúdo de outro em andamento (ou já pronto e
+    com o índice no disco, se não tiver URL) não é duplicado: devolve o id
+    existente. Jobs que
+    ficaram pendentes quando o processo morreu voltam para a fila no próximo
+    start, desde que os arquivos ainda existam.
+    """
+
+    def __init__(self, db: str = DB_JOBS, max_workers: int = INDEX_WORKERS, base: str = BASE_INDEX):
+        self.db, self.base = db, base
+        os.makedirs(os.path.dirname(db) or ".", exist_ok=True)
+        with self._conn() as c:
+            c.executescript(_SCHEMA)
+            colunas = {r["name"] for r in c.execute("PRAGMA table_info(jobs)")}
+            if "detalhe" not in colunas:
+                # banco criado antes da coluna existir
+                c.execute("ALTER TABLE jobs ADD COLUMN detalhe TEXT")
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="sagebot-index")
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _conn(self):
+        c = sqlite3.connect(self.db, timeout=30)
+        c.row_factory = sqlite3.Row
+        try:
+            c.execute("PRAGMA journal_mode=WAL")
+            with c:
+                yield c
+        finally:
+            c.close()
+
+    def _atualizar(self, job_id: str, **campos):
+        campos["atualizado"] = time.time()
+        sets = ", ".join(f"{k} = ?" for k in campos)
+        with self._conn() as c:
+            c.execute(f"UPDATE jobs SET {sets} WHERE id = ?", (*campos.values(), job_id))
+
+    def submeter(self, spec: Dict) -> str:
+        """Enfileira a indexação de `spec` ({"itens": [(alvo, nome)], "texto":
+        str, "embed_model", "dims"}) e devolve o id do job."""
+        chave = chave_job(spec)
+        tem_url = any(eh_url(alvo) for alvo, _ in spec.get("itens", []))
+        with self._lock, self._conn() as c:
+            for row in c.execute("SELECT id, status, hash FROM jobs WHERE chave = ? ORDER BY criado DESC", (chave,)):
+                if row["status"] in ATIVOS:
+                    return row["id"]
+                # a chave de uma URL é o endereço, não o conteúdo: a página pode
+                # ter mudado, então só um job em andamento é reaproveitado
+                if row["status"] == "pronto" and not tem_url and indice_pronto(caminho_indice(row["hash"], self.base)):
+                    return row["id"]
+            job_id = uuid.uuid4().hex
+            agora = time.time()
+            c.execute(
+                "INSERT INTO jobs (id, chave, spec, status, etapa, pid, criado, atualizado) VALUES (?, ?, ?, 'fila', 'fila', ?, ?, ?)",
+                (job_id, chave, json.dumps(spec, ensure_ascii=False), os.getpid(), agora, agora),
+            )
+        self._pool.submit(self._rodar, job_id)
+        return job_id
+
+    def retomar(self) -> List[str]:
+        """Reenfileira os jobs pendentes de um processo que não existe mais.
+        Os que perderam os arquivos (uploads temporários apagados) viram erro."""
+        with self._lock, self._conn() as c:
+            rows = c.execute("SELECT id, pid, spec FROM jobs WHERE status IN ('fila', 'rodando')").fetchall()
+            ids = []
+            for r in rows:
+                if _vivo(r["pid"]):
+                    continue
+                itens = json.loads(r["spec"]).get("itens", [])
+                faltando = [nome for alvo, nome in itens if not eh_url(alvo) and not os.path.exists(alvo)]
+                if faltando:
+                    c.execute(
+                        "UPDATE jobs SET status = 'erro', etapa = 'error', erro = ?, atualizado = ? WHERE id = ?",
+                        (f"Arquivos não encontrados ao retomar: {', '.join(faltando)}", time.time(), r["id"]),
+                    )
+                    continue
+                ids.append(r["id"])
+            for job_id in ids:
+                c.execute("UPDATE jobs SET status = 'fila', etapa = 'fila', pid = ? WHERE id = ?", (os.getpid(), job_id))
+        for job_id in ids:
+            self._pool.submit(self._rodar, job_id)
+        return ids
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        with self._conn() as c:
+            row = c.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            job["log"] = json.loads(job["log"] or "[]")
+            job["posicao"] = 0
+            if job["status"] == "fila":
+                job["posicao"] = c.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'fila' AND criado < ?", (job["criado"],)
+                ).fetchone()[0] + 1
+        return job
+
+    def _rodar(self, job_id: str):
+        with self._conn() as c:
+            row = c.execute("SELECT chave, spec FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        spec = json.loads(row["spec"])
+        logs: List[str] = []
+        detalhes = {"leitura": "", "indexar": ""}
+
+        def progresso(step=None, pct=None, log=None, detalhe=None):
+            campos = {}
+            if step is not None:
+                campos["etapa"] = step
+            if pct is not None:
+                campos["pct"] = float(pct)
+            if log:
+                logs.append(log)
+                del logs[:-MAX_LOG]
+                campos["log"] = json.dumps(logs, ensure_ascii=False)
+            if detalhe is not None:
+                # o do indexar (embeddings) fica junto com o da leitura
+                detalhes["indexar"] = detalhe
+                if not detalhe:
+                    detalhes["leitura"] = ""
+                campos["detalhe"] = " | ".join(d for d in detalhes.values() if d)
+            if campos:
+                self._atualizar(job_id, **campos)
+
+        def progresso_pdf(feitos, total, log=None):
+            if log:
+                progresso(log=log)
+
+        ultimo = [0.0]
+
+        def andamento_paginas(feito):
+            # leitura, split e embedding andam juntos: as páginas entregues
+            # movem a barra entre 40% e 80%; a vazão/ETA vai a cada segundo
+            agora = time.monotonic()
+            if agora - ultimo[0] >= INTERVALO_DETALHE or feito.feitos == feito.total:
+                ultimo[0] = agora
+                detalhes["leitura"] = f"Leitura: {feito.texto()}"
+                progresso(pct=0.40 + 0.40 * (feito.fracao or 0.0), detalhe=detalhes["indexar"])
+
+        self._atualizar(job_id, status="rodando", pid=os.getpid())
+        progresso(step="init", pct=0.0, log="Iniciando indexação...")
+        try:
+            documento = spec["texto"] if spec.get("texto") is not None else iter_fontes(
+                spec["itens"], progresso=progresso_pdf, andamento=andamento_paginas,
+            )
+            with rastreio(job_id):
+                h, novo = indexar(
+                    documento, embed_model=spec.get("embed_model"), dims=spec.get("dims"),
+                    base=self.base, progresso=progresso, retomada=row["chave"],
+                    splitter=divisor(spec.get("divisao", "caracteres"), spec.get("embed_model")),
+                )
+        except Exception as e:
+            msg = mensagem_erro(e)
+            progresso(step="error", pct=0.0, log=msg if msg != str(e) else f"Erro: {e}")
+            self._atualizar(job_id, status="erro", erro=msg)
+            return
+        progresso(step="done", pct=1.0)
+        self._atualizar(job_id, status="pronto", hash=h, novo=int(novo))
+
+
+_fila: Optional[FilaIndexacao] = None
+_lock = threading.Lock()
+
+
+def fila() -> FilaIndexacao:
+    """A fila do processo; na primeira chamada retoma o que ficou pendente."""
+    global _fila
+    with _lock:
+        if _fila is None:
+            _fila = FilaIndexacao()
+            _fila.retomar()
+        return _fila
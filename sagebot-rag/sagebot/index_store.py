@@ -0,0 +1,264 @@
+# index_store.py
+import json, mmap, os
+from array import array
+from collections.abc import Mapping
+from typing import Callable, Dict, Optional, Union
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from . import ann
+
+ARQ_INDICE  = "index.faiss"
+ARQ_DOCS    = "docstore.jsonl"
+ARQ_OFFSETS = "docstore.off"
+ARQ_META    = "meta.json"
+ARQ_PAIS    = "pais.jsonl"  # seções maiores que os trechos indexados (divisor.DivisorPais)
+ARQ_PAIS_OFF = "pais.off"
+FORMATO     = 2
+
+# faiss >= 1.10 mapeia também índices flat/HNSW; versões antigas só mapeiam IVF
+FLAG_MMAP = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+class MapaPosicional(Mapping):
+    """index_to_docstore_id sem dicionário: a posição i no FAISS é o id "i"."""
+
+    def __init__(self, n: int):
+        self.n = n
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.n:
+            raise KeyError(i)
+        return str(i)
+
+    def __iter__(self):
+        return iter(range(self.n))
+
+    def __len__(self):
+        return self.n
+
+
+class DocstoreEmDisco(Docstore):
+    """Docstore somente-leitura: registros JSON num arquivo mapeado em memória.
+
+    `docstore.off` guarda o offset de cada registro, então buscar o documento
+    da posição i lê só aquela linha. Todas as sessões do processo (e de outros
+    processos na mesma máquina) dividem as mesmas páginas do page cache.
+    """
+
+    def __init__(self, path: str, arq_docs: str = ARQ_DOCS, arq_offsets: str = ARQ_OFFSETS):
+        self.path = path
+        self.offsets = np.memmap(os.path.join(path, arq_offsets), dtype="<u8", mode="r")
+        with open(os.path.join(path, arq_docs), "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def registro(self, pos: int) -> dict:
+        ini, fim = int(self.offsets[pos]), int(self.offsets[pos + 1])
+        return json.loads(self._mm[ini:fim])
+
+    def search(self, search: str) -> Union[str, Document]:
+        try:
+            pos = int(search)
+        except ValueError:
+            return f"ID {search} not found."
+        if not 0 <= pos < len(self):
+            return f"ID {search} not found."
+        rec = self.registro(pos)
+        return Document(page_content=rec["page_content"], metadata=rec.get("metadata") or {}, id=rec.get("id"))
+
+
+class EscritorDocstore:
+    """Grava registros no formato do DocstoreEmDisco, um por vez (em
+    streaming), como `arq_docs`.tmp/`arq_offsets`.tmp; publicar() troca
+    pelos definitivos no diretório de destino.
+
+    Com `anexar=True` e o docstore já existente em `path`, continua as
+    posições dele: os registros vão para o fim do próprio `arq_docs` (quem
+    está com ele mapeado só lê até os offsets antigos) e publicar() troca
+    apenas os offsets.
+    """
+
+    def __init__(self, path: str, arq_docs: str = ARQ_DOCS, arq_offsets: str = ARQ_OFFSETS, anexar: bool = False):
+        self.path, self.arq_docs, self.arq_offsets = path, arq_docs, arq_offsets
+        os.makedirs(path, exist_ok=True)
+        self.anexar = anexar and os.path.exists(os.path.join(path, arq_offsets))
+        if self.anexar:
+            self.offsets = array("Q", np.fromfile(os.path.join(path, arq_offsets), dtype="<u8").tolist())
+            self._f = open(os.path.join(path, arq_docs), "r+b")
+            # sobra de um delta que falhou depois de escrever: fora dos offsets, pode ir
+            self._f.truncate(self.offsets[-1])
+            self._f.seek(self.offsets[-1])
+        else:
+            self.offsets = array("Q", [0])
+            self._f = open(os.path.join(path, arq_docs + ".tmp"), "wb")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def adicionar(self, rec: dict) -> int:
+        """Grava `rec` e devolve a posição dele."""
+        linha = json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n"
+        self._f.write(linha)
+        self.offsets.append(self.offsets[-1] + len(linha))
+        return len(self) - 1
+
+    def fechar(self):
+        if self._f.closed:
+            return
+        self._f.close()
+        with open(os.path.join(self.path, self.arq_offsets + ".tmp"), "wb") as f:
+            f.write(np.asarray(self.offsets, dtype="<u8").tobytes())
+
+    def _arquivos_tmp(self):
+        return (self.arq_offsets,) if self.anexar else (self.arq_docs, self.arq_offsets)
+
+    def publicar(self, destino: Optional[str] = None):
+        self.fechar()
+        destino = destino or self.path
+        if self.anexar and os.path.abspath(destino) != os.path.abspath(self.path):
+            raise ValueError("Docstore anexado só pode ser publicado no próprio diretório.")
+        os.makedirs(destino, exist_ok=True)
+        for arq in self._arquivos_tmp():
+            os.replace(os.path.join(self.path, arq + ".tmp"), os.path.join(destino, arq))
+
+    def descartar(self):
+        self.fechar()
+        for arq in self._arquivos_tmp():
+            try:
+                os.remove(os.path.join(self.path, arq + ".tmp"))
+            except FileNotFoundError:
+                pass
+
+
+def _escrever_docstore(path: str, registros) -> int:
+    escritor = EscritorDocstore(path)
+    for rec in registros:
+        escritor.adicionar(rec)
+    escritor.fechar()
+    return len(escritor)
+
+
+def salvar_indice(vs: FAISS, path: str, divisao: Optional[str] = None, antes_do_meta: Optional[Callable[[], None]] = None):
+    """Grava o índice no formato v2 (vetores faiss + docstore com offsets).
+
+    Os arquivos são escritos como .tmp e trocados com os.replace no fim, então
+    sessões que estão com o índice antigo mapeado continuam lendo a versão delas.
+    `divisao` é o modo do splitter (divisor.MODOS_DIVISAO), usado pelos deltas;
+    sem ele, regravar o índice (compactação) mantém o que já estava no meta.json.
+    `antes_do_meta` roda com os vetores e o docstore já no lugar, antes do
+    meta.json, que é o que marca o índice como pronto (indexador.indice_pronto).
+    """
+    os.makedirs(path, exist_ok=True)
+    if divisao is None:
+        divisao = (ler_meta(path) or {}).get("divisao")
+    faiss.write_index(vs.index, os.path.join(path, ARQ_INDICE + ".tmp"))
+
+    def registros():
+        for i in range(vs.index.ntotal):
+            _id = vs.index_to_docstore_id[i]
+            doc = vs.docstore.search(_id)
+            yield {"id": getattr(doc, "id", None) or _id, "page_content": doc.page_content, "metadata": doc.metadata}
+
+    n = _escrever_docstore(path, registros())
+    meta = {
+        "formato": FORMATO,
+        "n": n,
+        "tipo": ann.tipo_de(vs.index),
+        "normalize_L2": bool(getattr(vs, "_normalize_L2", False)),
+        "distance_strategy": str(getattr(vs.distance_strategy, "value", vs.distance_strategy)),
+    }
+    if divisao:
+        meta["divisao"] = divisao
+    with open(os.path.join(path, ARQ_META + ".tmp"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    for arq in (ARQ_INDICE, ARQ_DOCS, ARQ_OFFSETS):
+        os.replace(os.path.join(path, arq + ".tmp"), os.path.join(path, arq))
+    if antes_do_meta is not None:
+        # arquivos que dependem do index.faiss final (BM25, árvore de hashes):
+        # quem vê o meta.json já os encontra
+        antes_do_meta()
+    os.replace(os.path.join(path, ARQ_META + ".tmp"), os.path.join(path, ARQ_META))
+    # remove o formato antigo (pickle) para não ficarem duas cópias
+    for antigo in ("index.pkl",):
+        p = os.path.join(path, antigo)
+        if os.path.exists(p):
+            os.remove(p)
+
+
+def ler_meta(path: str) -> Optional[Dict]:
+    p = os.path.join(path, ARQ_META)
+    if not os.path.exists(p):
+        return None
+    with open(p, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def carregar_indice(path: str, emb, mmap: bool = True) -> Optional[FAISS]:
+    """Carrega um índice salvo.
+
+    Com `mmap=True` a matriz de vetores e o docstore ficam mapeados em memória
+    (somente leitura). Com `mmap=False` tudo é materializado em RAM e o índice
+    aceita add/delete/merge. Diretórios no formato antigo (index.pkl) caem no
+    FAISS.load_local.
+    """
+    if not os.path.isdir(path):
+        return None
+    meta = ler_meta(path)
+    if meta is None:
+        if os.path.exists(os.path.join(path, "index.pkl")):
+            return FAISS.load_local(path, emb, allow_dangerous_deserialization=True)
+        return None
+
+    arq = os.path.join(path, ARQ_INDICE)
+    if mmap:
+        index = faiss.read_index(arq, FLAG_MMAP)
+        docstore = DocstoreEmDisco(path)
+        mapa = MapaPosicional(len(docstore))
+    else:
+        index = faiss.read_index(arq)
+        disco = DocstoreEmDisco(path)
+        docs, mapa = {}, {}
+        for i in range(len(disco)):
+            rec = disco.registro(i)
+            docs[rec["id"]] = Document(page_content=rec["page_content"], metadata=rec.get("metadata") or {}, id=rec["id"])
+            mapa[i] = rec["id"]
+        docstore = InMemoryDocstore(docs)
+    ann.ajustar_busca(index)
+
+    return FAISS(
+        emb,
+        index,
+        docstore,
+        mapa,
+        normalize_L2=meta.get("normalize_L2", False),
+        distance_strategy=DistanceStrategy(meta.get("distance_strategy", "EUCLIDEAN_DISTANCE")),
+    )
+
+
+def modo_divisao(path: str) -> str:
+    """Modo do splitter com que o índice foi feito (meta.json; índices
+    anteriores ao registro: "pais" se houver seções-pai, senão o padrão)."""
+    modo = (ler_meta(path) or {}).get("divisao")
+    if modo:
+        return modo
+    return "pais" if os.path.exists(os.path.join(path, ARQ_PAIS_OFF)) else "caracteres"
+
+
+def carregar_pais(path: str) -> Optional[DocstoreEmDisco]:
+    """Docstore das seções-pai do índice; None se ele não foi indexado com pais."""
+    if not os.path.exists(os.path.join(path, ARQ_PAIS_OFF)):
+        return None
+    return DocstoreEmDisco(path, ARQ_PAIS, ARQ_PAIS_OFF)
+
+
+def somente_leitura(vs: FAISS) -> bool:
+    return isinstance(vs.docstore, DocstoreEmDisco)
@@ -0,0 +1,183 @@
+# indexador.py
+import os, shutil, tempfile, time
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+from langchain.schema import Document
+
+from . import lexical
+from .checkpoint import CheckpointEmbeddings, caminho_parcial
+from .index_store import ARQ_META, salvar_indice
+from .lotes import EMBED_WORKERS
+from .metricas import Andamento, Cronometro, etapa, observar_etapa, registro
+from .rag import build_vectorstore, split_documents, split_text
+from .segmentos import assinatura
+from .utils import ArvoreMerkle, HashCorpus, arvore_texto, hash_arvore
+
+BASE_INDEX = "data/index"
+ARQ_MERKLE = "merkle.bin"  # folhas da árvore de hashes das páginas indexadas
+
+# progresso(step=..., pct=..., log=..., detalhe=...), mesma assinatura de progress.atualizar
+Progresso = Callable[..., None]
+INTERVALO_DETALHE = 1.0  # segundos entre atualizações de vazão/ETA
+
+
+def _nada(**_):
+    pass
+
+
+def caminho_indice(h: str, base: str = BASE_INDEX) -> str:
+    return os.path.join(base, h)
+
+
+def indice_pronto(path: str) -> bool:
+    """meta.json é o último arquivo trocado no salvar_indice: sem ele o
+    diretório ainda está sendo escrito (ex.: pelo CLI em outro processo)."""
+    return os.path.exists(os.path.join(path, ARQ_META)) or os.path.exists(os.path.join(path, "index.pkl"))
+
+
+def listar_indices(base: str = BASE_INDEX) -> List[str]:
+    """Hashes dos índices completos em `base`, do mais recente para o mais antigo."""
+    if not os.path.isdir(base):
+        return []
+    dirs = [
+        d for d in os.listdir(base)
+        if not d.startswith(".") and os.path.isdir(os.path.join(base, d)) and indice_pronto(os.path.join(base, d))
+    ]
+    dirs.sort(key=lambda d: os.path.getmtime(os.path.join(base, d)), reverse=True)
+    return dirs
+
+
+def indexar(
+    documento: Union[str, Iterable[Document]],
+    embed_model="text-embedding-3-small",
+    dims=None,
+    base: str = BASE_INDEX,
+    progresso: Optional[Progresso] = None,
+    splitter=None,
+    tipo_indice: str = "auto",
+    n_estimado: Optional[int] = None,
+    max_workers: int = EMBED_WORKERS,
+    retomada: Optional[str] = None,
+) -> Tuple[str, bool]:
+    """Indexa `documento` em `base/<hash>` sem depender do Streamlit.
+
+    `documento` é uma string ou um iterável de Documents (loader.iter_*).
+    Retorna (hash, novo); `novo` é False quando o índice já existia no disco
+    e nada foi gravado. Grava também o BM25, a árvore de hashes das páginas
+    (merkle.bin, ver paginas_alteradas) e, com divisor.DivisorPais, as
+    seções-pai (pais.jsonl) ao lado do FAISS.
+
+    `retomada` identifica a entrada entre execuções (para string, o próprio
+    hash do documento): os lotes embedados ficam em base/.parcial/<retomada> até o
+    índice ser salvo, e uma nova execução depois de uma falha continua de lá.
+    """
+    progresso = progresso or _nada
+    progresso(step="split", pct=0.10, log="Preparando splitter...")
+    splitter = splitter or split_text(chunk_size=1500, chunk_overlap=100)
+    divisao = getattr(splitter, "assinatura", None)
+
+    spool = None
+    if hasattr(splitter, "abrir"):
+        # divisor.DivisorPais: as seções-pai são gravadas em streaming,
+        # junto com o split, e só entram no índice no salvar
+        os.makedirs(base, exist_ok=True)
+        spool = tempfile.mkdtemp(prefix=".pais-", dir=base)
+        splitter.abrir(spool)
+    try:
+        hasher = None
+        paginas = None
+        if isinstance(documento, str):
+            arvore = arvore_texto(documento)
+            h = hash_arvore(arvore, model=embed_model, dims=dims, divisao=divisao)
+            if indice_pronto(caminho_indice(h, base)):
+                return h, False
+            with etapa("split"):
+                trechos = list(split_documents([Document(page_content=documento)], splitter))
+            n_estimado = len(trechos)
+            docs = iter(trechos)
+            retomada = retomada or h
+        else:
+            # em streaming o hash só fica pronto no fim; o cache de chunks
+            # evita pagar de novo pelos embeddings de um corpus repetido
+            hasher = HashCorpus(model=embed_model, dims=dims, divisao=divisao)
+
+            def com_hash():
+                for doc in documento:
+                    hasher.atualizar(doc)
+                    yield doc
+
+            # leitura e split correm dentro do laço do embedding: cada um é
+            # cronometrado à parte (o tempo do split inclui o da leitura)
+            paginas = Cronometro(com_hash())
+            docs = split_documents(paginas, splitter)
+        docs = Cronometro(docs)
+        ultimo = [0.0]
+
+        def ao_lote(feito: Andamento):
+            # em streaming o total de trechos é desconhecido: a barra fica com
+            # quem lê as fontes (loader.iter_fontes), aqui só vazão e contagem
+            if feito.total:
+                progresso(pct=0.40 + 0.40 * feito.fracao)
+            agora = time.monotonic()
+            if agora - ultimo[0] >= INTERVALO_DETALHE:
+                ultimo[0] = agora
+                progresso(detalhe=f"Embeddings: {feito.texto()}")
+
+        checkpoint = CheckpointEmbeddings(caminho_parcial(base, retomada)) if retomada else None
+        if checkpoint is not None and checkpoint.lotes:
+            progresso(log=f"Retomando do checkpoint: {len(checkpoint.lotes)} lotes ({checkpoint.linhas} trechos) já embedados.")
+
+        progresso(step="embed", pct=0.40, log=f"Gerando embeddings ({embed_model})...")
+        with etapa("indexacao", modelo=embed_model):
+            vs = build_vectorstore(
+                docs, embed_model=embed_model, dims=dims,
+                max_workers=max_workers, tipo_indice=tipo_indice, n_estimado=n_estimado,
+                checkpoint=checkpoint, andamento=ao_lote,
+            )
+        if paginas is not None:
+            observar_etapa("leitura", paginas.segundos)
+            observar_etapa("split", docs.segundos - paginas.segundos)
+            registro.contar("sagebot_paginas_total", paginas.itens)
+        registro.contar("sagebot_trechos_total", docs.itens)
+
+        if hasher is not None:
+            arvore = hasher.arvore()
+            h = hash_arvore(arvore, model=embed_model, dims=dims, divisao=divisao)
+            if indice_pronto(caminho_indice(h, base)):
+                if checkpoint is not None:
+                    checkpoint.descartar()
+                return h, False
+
+        path = caminho_indice(h, base)
+        progresso(step="index", pct=0.80, log="Construindo índice lexical (BM25)...", detalhe="")
+        with etapa("bm25"):
+            bm25 = lexical.construir(vs)
+
+        def antes_do_meta():
+            # com o meta.json o índice já aparece como pronto (listar_indices,
+            # sessões do app): BM25 e árvore de hashes precisam estar lá
+            arvore.salvar(os.path.join(path, ARQ_MERKLE))
+            bm25.salvar(path, assinatura(path))
+
+        progresso(log="Salvando índice no disco...")
+        with etapa("salvar"):
+            if spool is not None:
+                splitter.publicar(path)
+            salvar_indice(vs, path, divisao=getattr(splitter, "modo", "caracteres"), antes_do_meta=antes_do_meta)
+        if checkpoint is not None:
+            checkpoint.descartar()
+        return h, True
+    finally:
+        if spool is not None:
+            splitter.descartar()
+            shutil.rmtree(spool, ignore_errors=True)
+
+
+def paginas_alteradas(h_antigo: str, h_novo: str, base: str = BASE_INDEX) -> Optional[List[int]]:
+    """Posições das páginas (blocos, para string) que mudaram entre dois
+    índices, comparando as árvores de hashes; None se faltar a de algum."""
+    antiga = ArvoreMerkle.carregar(os.path.join(caminho_indice(h_antigo, base), ARQ_MERKLE))
+    nova = ArvoreMerkle.carregar(os.path.join(caminho_indice(h_novo, base), ARQ_MERKLE))
+    if antiga is None or nova is None:
+        return None
+    return nova.diferentes(antiga)
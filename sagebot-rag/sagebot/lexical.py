@@ -0,0 +1,183 @@
+# lexical.py
+import gzip, hashlib, json, math, os, re, threading, weakref
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from langchain_community.vectorstores import FAISS
+
+from .metricas import etapa
+
+ARQ_BM25 = "bm25.json.gz"
+MODOS_BUSCA = ["Vetorial (MMR)", "Híbrida (BM25 + vetorial)", "Lexical (BM25)"]
+
+# mantém nomes de ação/serviço/erro inteiros (s3:GetObject, ml.m5.xlarge,
+# AccessDeniedException) e indexa também as partes separadas por : . - /
+_TOKEN = re.compile(r"\w+(?:[.:\-/]\w+)*")
+_PARTES = re.compile(r"[.:\-/]")
+
+
+def tokenizar(texto: str) -> List[str]:
+    tokens = []
+    for m in _TOKEN.finditer((texto or "").lower()):
+        tok = m.group(0)
+        tokens.append(tok)
+        if _PARTES.search(tok):
+            tokens.extend(p for p in _PARTES.split(tok) if p)
+    return tokens
+
+
+class IndiceLexical:
+    """Índice invertido BM25 por posição no FAISS (a mesma ordem do docstore)."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.tamanhos: List[int] = []
+        self.postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @property
+    def n(self) -> int:
+        return len(self.tamanhos)
+
+    def adicionar(self, textos: Iterable[str]):
+        for texto in textos:
+            pos = len(self.tamanhos)
+            tf = Counter(tokenizar(texto))
+            self.tamanhos.append(sum(tf.values()))
+            for termo, c in tf.items():
+                docs, freqs = self.postings.setdefault(termo, ([], []))
+                docs.append(pos)
+                freqs.append(c)
+        self._arrays.clear()
+
+    def _termo(self, termo):
+        arr = self._arrays.get(termo)
+        if arr is None:
+            docs, freqs = self.postings[termo]
+            arr = (np.asarray(docs, dtype="int64"), np.asarray(freqs, dtype="float32"))
+            self._arrays[termo] = arr
+        return arr
+
+    def buscar(self, consulta: str, k: int = 4) -> List[Tuple[int, float]]:
+        termos = [t for t in set(tokenizar(consulta)) if t in self.postings]
+        if not termos or not self.n:
+            return []
+        lens = np.asarray(self.tamanhos, dtype="float32")
+        media = float(lens.mean()) or 1.0
+        scores = np.zeros(self.n, dtype="float32")
+        for termo in termos:
+            docs, tf = self._termo(termo)
+            idf = math.log(1 + (self.n - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = tf + self.k1 * (1 - self.b + self.b * lens[docs] / media)
+            scores[docs] += idf * tf * (self.k1 + 1) / norm
+        k = min(k, int((scores > 0).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def salvar(self, path: str, assinatura: str = ""):
+        # nome único: o indexador e uma sessão (lexical_de) podem gravar o mesmo índice
+        tmp = os.path.join(path, f"{ARQ_BM25}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump({
+                "assinatura": assinatura, "k1": self.k1, "b": self.b,
+                "tamanhos": self.tamanhos, "postings": self.postings,
+            }, f)
+        os.replace(tmp, os.path.join(path, ARQ_BM25))
+
+    @classmethod
+    def carregar(cls, path: str, assinatura: str = "") -> Optional["IndiceLexical"]:
+        """Lê o BM25 salvo; None se não existir ou for de outra versão do índice."""
+        p = os.path.join(path, ARQ_BM25)
+        if not os.path.exists(p):
+            return None
+        with gzip.open(p, "rt", encoding="utf-8") as f:
+            dados = json.load(f)
+        if dados.get("assinatura", "") != assinatura:
+            return None
+        idx = cls(k1=dados["k1"], b=dados["b"])
+        idx.tamanhos = dados["tamanhos"]
+        idx.postings = {t: (d, f) for t, (d, f) in dados["postings"].items()}
+        return idx
+
+
+def construir(vs: FAISS) -> IndiceLexical:
+    idx = IndiceLexical()
+    idx.adicionar(vs.docstore.search(vs.index_to_docstore_id[i]).page_content for i in range(vs.index.ntotal))
+    return idx
+
+
+_por_indice: "weakref.WeakKeyDictionary[FAISS, IndiceLexical]" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def lexical_de(vs: FAISS, path: Optional[str] = None, assinatura: Optional[str] = None) -> IndiceLexical:
+    """Índice BM25 do `vs` (um por objeto, compartilhado pelas sessões).
+
+    Lê de `path` quando a assinatura gravada bate com a do índice em disco;
+    senão constrói a partir do docstore e grava ao lado do FAISS. Sem
+    assinatura (índice com delta pendente) fica só em memória.
+    """
+    with _lock:
+        idx = _por_indice.get(vs)
+        if idx is not None:
+            return idx
+        if path and assinatura is not None:
+            idx = IndiceLexical.carregar(path, assinatura)
+        if idx is None or idx.n != vs.index.ntotal:
+            idx = construir(vs)
+            if path and assinatura is not None:
+                idx.salvar(path, assinatura)
+        _por_indice[vs] = idx
+        return idx
+
+
+def _doc(vs: FAISS, pos: int) -> Document:
+    return vs.docstore.search(vs.index_to_docstore_id[pos])
+
+
+def _chave(doc: Document) -> str:
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+class RetrieverLexical(BaseRetriever):
+    """Busca só por palavras-chave: não chama a API de embeddings."""
+
+    vs: FAISS
+    lexical: IndiceLexical
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        with etapa("busca_lexical"):
+            return [_doc(self.vs, pos) for pos, _ in self.lexical.buscar(query, self.k)]
+
+
+class RetrieverHibrido(BaseRetriever):
+    """Funde o retriever denso e o BM25 por reciprocal rank fusion."""
+
+    denso: BaseRetriever
+    lexical: RetrieverLexical
+    k: int = 4
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        with etapa("busca_lexical"):
+            lex = self.lexical.lexical.buscar(query, max(self.k * 3, 10))
+            lex_docs = [_doc(self.lexical.vs, pos) for pos, _ in lex]
+        den_docs = self.denso.invoke(query)
+
+        scores: Dict[str, float] = {}
+        docs: Dict[str, Document] = {}
+        for lista in (den_docs, lex_docs):
+            for rank, d in enumerate(lista):
+                c = _chave(d)
+                docs.setdefault(c, d)
+                scores[c] = scores.get(c, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        ordem = sorted(scores, key=scores.get, reverse=True)
+        return [docs[c] for c in ordem[: self.k]]
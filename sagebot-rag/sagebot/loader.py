@@ -1,9 +1,25 @@
 from pathlib import Path
 from langchain_community.document_loaders import TextLoader, WebBaseLoader,PyPDFLoader
+from langchain.schema import Document
+from pypdf import PdfReader
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from typing import Callable, Iterator, List, Optional, Tuple
+import multiprocessing
+import queue
 import tempfile
+import time
 import os
 
+from .metricas import Andamento
+
 DEFAULT_UA = os.environ.get("USER_AGENT", "SageBot/1.0 (Streamlit)")
+PDF_WORKERS = int(os.environ.get("SAGEBOT_PDF_WORKERS", str(os.cpu_count() or 2)))
+PDF_TIMEOUT = float(os.environ.get("SAGEBOT_PDF_TIMEOUT", "120"))
+PAGINAS_POR_TAREFA = 32
+ESPERA_AVISO = 0.5  # de quanto em quanto tempo o consumidor confere se o trecho já começou
+EXT_TEXTO = (".md", ".markdown", ".txt")
+EXT_PDF = (".pdf",)
 
 def carrega_md(arquivo):
     uploads = arquivo if isinstance(arquivo, list) else [arquivo]
@@ -39,3 +55,209 @@ def salvar_tmp(upload, suffix):
             tmp.write(up.read())
             paths.append(tmp.name)
     return paths
+
+
+def salvar_uploads(upload, suffix) -> List[Tuple[str, str]]:
+    """Como salvar_tmp, mas devolve (caminho, nome original) para virar metadata."""
+    if upload is None:
+        return []
+    uploads = upload if isinstance(upload, list) else [upload]
+    paths = salvar_tmp(uploads, suffix)
+    return [(p, getattr(up, "name", None) or p) for p, up in zip(paths, uploads)]
+
+def iter_md(arquivos) -> Iterator[Document]:
+    """Um Document por arquivo .md; `arquivos` é uma lista de (caminho, nome)."""
+    for caminho, nome in arquivos:
+        for doc in TextLoader(caminho, encoding="utf-8").lazy_load():
+            doc.metadata["source"] = nome
+            yield doc
+
+def iter_pdf(caminho, nome=None) -> Iterator[Document]:
+    """Um Document por página, com metadata source/page, lido sob demanda."""
+    for doc in PyPDFLoader(caminho).lazy_load():
+        if nome:
+            doc.metadata["source"] = nome
+        yield doc
+
+def iter_site(url) -> Iterator[Document]:
+    yield from WebBaseLoader(url).lazy_load()
+
+_inicios = None  # no processo filho: fila onde cada trecho avisa que começou
+
+
+def _iniciar_worker(fila):
+    global _inicios
+    _inicios = fila
+
+def _extrair_paginas(caminho, inicio, fim, tarefa=None):
+    """Roda no processo filho: extrai o texto das páginas [inicio, fim)."""
+    if _inicios is not None and tarefa is not None:
+        # o prazo do trecho conta daqui, não de quando ele entrou na fila do pool
+        _inicios.put((tarefa, time.time()))
+    reader = PdfReader(caminho)
+    fim = min(fim, len(reader.pages))
+    return [(i, reader.pages[i].extract_text() or "") for i in range(inicio, fim)]
+
+def _drenar(avisos, inicio):
+    while True:
+        try:
+            tarefa, t = avisos.get_nowait()
+        except (queue.Empty, OSError, ValueError):
+            return
+        inicio[tarefa] = t
+
+def _derrubar(pool):
+    # o worker preso não respeita cancel(): encerra os processos na marra
+    procs = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for proc in procs:
+        proc.terminate()
+
+def iter_pdfs_paralelo(
+    arquivos,
+    max_workers: int = PDF_WORKERS,
+    timeout: float = PDF_TIMEOUT,
+    progresso: Optional[Callable[[int, int, Optional[str]], None]] = None,
+) -> Iterator[Document]:
+    """Extrai vários PDFs num pool de processos, em trechos de páginas.
+
+    Os Documents saem na ordem arquivo/página, como em iter_pdf. Um trecho que
+    passa de `timeout` segundos desde que um worker o começou é pulado (o
+    arquivo segue com o resto); o pool é trocado para o worker preso não
+    segurar a vaga e os trechos em voo são reenviados. `progresso(feitos,
+    total, log)` é chamado a cada trecho concluído.
+    """
+    tarefas = []
+    for caminho, nome in arquivos:
+        n = len(PdfReader(caminho).pages)
+        for ini in range(0, n, PAGINAS_POR_TAREFA):
+            tarefas.append((caminho, nome, ini, ini + PAGINAS_POR_TAREFA))
+    total = len(tarefas)
+    if total == 0:
+        return
+
+    ctx = multiprocessing.get_context("spawn")  # fork dentro da thread do Streamlit não é seguro
+
+    def abrir_pool():
+        avisos = ctx.Queue()
+        pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx, initializer=_iniciar_worker, initargs=(avisos,))
+        return pool, avisos
+
+    def enviar(pool, i):
+        caminho, _, ini, fim = tarefas[i]
+        return pool.submit(_extrair_paginas, caminho, ini, fim, i)
+
+    pool, avisos = abrir_pool()
+    inicio = {}  # trecho -> instante em que um worker o começou
+    pendentes = deque()  # (trecho, future)
+    try:
+        proxima = 0
+        feitos = 0
+        while True:
+            # no máximo 2 trechos por worker em voo, para a memória não crescer com o upload
+            while len(pendentes) < 2 * max_workers and proxima < total:
+                pendentes.append((proxima, enviar(pool, proxima)))
+                proxima += 1
+            if not pendentes:
+                break
+            i, fut = pendentes[0]
+            _, nome, ini, fim = tarefas[i]
+            paginas = None
+            while paginas is None:
+                _drenar(avisos, inicio)
+                # ainda sem aviso de início: o trecho espera worker livre e o prazo não corre
+                resta = inicio[i] + timeout - time.time() if i in inicio else timeout
+                try:
+                    paginas = fut.result(timeout=max(0.0, min(resta, ESPERA_AVISO)))
+                except FuturesTimeout:
+                    if resta <= 0:
+                        break
+            pendentes.popleft()
+            log = None
+            if paginas is None:
+                log = f"{nome}: páginas {ini + 1}-{fim} excederam {timeout:.0f}s e foram puladas."
+                # troca o pool: os que já terminaram ficam, os em voo voltam com o prazo zerado
+                prontos = {j for j, f in pendentes if f.done() and not f.cancelled() and f.exception() is None}
+                _derrubar(pool)
+                avisos.close()
+                pool, avisos = abrir_pool()
+                inicio.clear()
+                pendentes = deque((j, f if j in prontos else enviar(pool, j)) for j, f in pendentes)
+            else:
+                for pagina, texto in paginas:
+                    yield Document(page_content=texto, metadata={"source": nome, "page": pagina})
+            feitos += 1
+            if progresso:
+                progresso(feitos, total, log)
+    finally:
+        if any(not f.done() for _, f in pendentes):
+            # consumidor parou no meio (ou trecho preso): não espera os workers
+            _derrubar(pool)
+        else:
+            pool.shutdown(cancel_futures=True)
+        avisos.close()
+
+
+def eh_url(s: str) -> bool:
+    return s.startswith(("http://", "https://"))
+
+def contar_paginas(itens) -> int:
+    """Páginas esperadas de iter_fontes: as do PDF, 1 por arquivo de texto ou URL."""
+    total = 0
+    for alvo, _ in itens:
+        if not eh_url(alvo) and alvo.lower().endswith(EXT_PDF):
+            try:
+                total += len(PdfReader(alvo).pages)
+            except Exception:
+                total += 1
+        else:
+            total += 1
+    return total
+
+def iter_fontes(
+    itens,
+    pdf_workers: int = PDF_WORKERS,
+    progresso: Optional[Callable[[int, int, Optional[str]], None]] = None,
+    andamento: Optional[Callable[[Andamento], None]] = None,
+) -> Iterator[Document]:
+    """Documents de uma lista de (caminho ou URL, nome da fonte), na ordem dada.
+
+    .md/.txt vão pelo iter_md, URLs pelo iter_site e PDFs consecutivos são
+    extraídos juntos no pool de processos (ou em série com pdf_workers <= 1).
+    `progresso` recebe os trechos de PDF concluídos (e avisos de timeout);
+    `andamento`, as páginas entregues do total de contar_paginas, com vazão e ETA.
+    """
+    if andamento is not None:
+        feito = Andamento(total=contar_paginas(itens), unidade="páginas")
+        # conta depois do yield: a página só está feita quando quem consome volta a pedir
+        for doc in iter_fontes(itens, pdf_workers=pdf_workers, progresso=progresso):
+            yield doc
+            feito.avancar()
+            andamento(feito)
+        return
+
+    pdfs: List[Tuple[str, str]] = []
+
+    def soltar_pdfs():
+        if not pdfs:
+            return
+        lote = list(pdfs)
+        pdfs.clear()
+        if pdf_workers <= 1:
+            for caminho, nome in lote:
+                yield from iter_pdf(caminho, nome)
+        else:
+            yield from iter_pdfs_paralelo(lote, max_workers=pdf_workers, progresso=progresso)
+
+    for alvo, nome in itens:
+        if not eh_url(alvo) and alvo.lower().endswith(EXT_PDF):
+            pdfs.append((alvo, nome))
+            continue
+        yield from soltar_pdfs()
+        if eh_url(alvo):
+            for doc in iter_site(alvo):
+                doc.metadata["source"] = nome
+                yield doc
+        else:
+            yield from iter_md([(alvo, nome)])
+    yield from soltar_pdfs()
@@ -0,0 +1,134 @@
+# lotes.py
+import contextvars, os, random, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from langchain.schema import Document
+from openai import RateLimitError, APIConnectionError, APITimeoutError
+
+from .metricas import observar_etapa, registro
+
+EMBED_WORKERS = int(os.environ.get("SAGEBOT_EMBED_WORKERS", "4"))
+EMBED_TPM = int(os.environ.get("SAGEBOT_EMBED_TPM", "0")) or None
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimativa barata (~4 caracteres por token), suficiente para o orçamento."""
+    return len(texto) // 4 + 1
+
+
+class LimiteTokens:
+    """Orçamento de tokens por minuto compartilhado entre as threads de embedding."""
+
+    def __init__(self, tpm: int):
+        self.tpm = tpm
+        self._janela = deque()  # (instante, tokens)
+        self._usados = 0
+        self._lock = threading.Lock()
+
+    def consumir(self, tokens: int):
+        # um lote maior que o orçamento inteiro passa sozinho na janela
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                while self._janela and agora - self._janela[0][0] >= 60.0:
+                    self._usados -= self._janela.popleft()[1]
+                if self._usados + tokens <= self.tpm:
+                    self._janela.append((agora, tokens))
+                    self._usados += tokens
+                    return
+                espera = 60.0 - (agora - self._janela[0][0])
+            time.sleep(max(espera, 0.05))
+
+
+def _retry_after(err) -> Optional[float]:
+    resp = getattr(err, "response", None)
+    if resp is None:
+        return None
+    try:
+        return float(resp.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def embed_com_retry(emb, textos: List[str], tentativas: int = 6, espera_base: float = 1.0) -> List[List[float]]:
+    """Embeda um lote, refazendo só este lote em caso de rate limit / falha transitória."""
+    for tentativa in range(tentativas):
+        try:
+            registro.contar("sagebot_embed_chamadas_total")
+            return emb.embed_documents(textos)
+        except (RateLimitError, APIConnectionError, APITimeoutError) as e:
+            registro.contar("sagebot_embed_falhas_total", erro=type(e).__name__)
+            if tentativa == tentativas - 1:
+                raise
+            espera = _retry_after(e) or espera_base * (2 ** tentativa)
+            time.sleep(espera + random.uniform(0, espera_base))
+
+
+def _do_cache(emb, textos: List[str]):
+    """Vetores já no cache por chunk (rag.cached_embeddings), com None onde falta.
+
+    Devolve também os embeddings que de fato chamam a API e o store onde
+    gravar os que faltam; sem cache, tudo falta e vai direto para `emb`.
+    """
+    store = getattr(emb, "document_embedding_store", None)
+    if store is None:
+        return [None] * len(textos), emb, None
+    return store.mget(textos), emb.underlying_embeddings, store
+
+
+def embed_em_lotes(
+    emb,
+    lotes: Iterable[List[Document]],
+    max_workers: int = EMBED_WORKERS,
+    tpm: Optional[int] = EMBED_TPM,
+) -> Iterator[Tuple[List[Document], List[List[float]]]]:
+    """Embeda lotes de documentos com até `max_workers` requisições em paralelo.
+
+    Os resultados saem na mesma ordem de entrada e no máximo 2 * max_workers
+    lotes ficam em memória ao mesmo tempo, então `lotes` pode ser um gerador.
+    Com o cache por chunk, só os trechos que faltam no cache gastam a cota
+    de tokens e vão para a API.
+    """
+    limite = LimiteTokens(tpm) if tpm else None
+
+    def tarefa(lote):
+        textos = [d.page_content for d in lote]
+        vetores, api, store = _do_cache(emb, textos)
+        faltam = [i for i, v in enumerate(vetores) if v is None]
+        registro.contar("sagebot_embed_trechos_total", len(textos))
+        registro.contar("sagebot_embed_cache_hits_total", len(textos) - len(faltam))
+        if not faltam:
+            # lote inteiro no cache por chunk: não espera cota nem chama a API
+            return lote, vetores
+        novos = [textos[i] for i in faltam]
+        tokens = sum(estimar_tokens(t) for t in novos)
+        if limite is not None:
+            t0 = time.perf_counter()
+            limite.consumir(tokens)
+            observar_etapa("embed_espera_cota", time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        calculados = embed_com_retry(api, novos)
+        observar_etapa("embed_lote", time.perf_counter() - t0)
+        if store is not None:
+            store.mset(list(zip(novos, calculados)))
+        for i, v in zip(faltam, calculados):
+            vetores[i] = v
+        registro.contar("sagebot_embed_tokens_estimados_total", tokens)
+        return lote, vetores
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pendentes = deque()
+        try:
+            for lote in lotes:
+                # cada lote leva o contexto de quem chamou (rastreio das métricas)
+                pendentes.append(pool.submit(contextvars.copy_context().run, tarefa, lote))
+                if len(pendentes) >= 2 * max_workers:
+                    yield pendentes.popleft().result()
+            while pendentes:
+                yield pendentes.popleft().result()
+        finally:
+            for fut in pendentes:
+                fut.cancel()
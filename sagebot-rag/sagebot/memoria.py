@@ -0,0 +1,156 @@
+# memoria.py
+import gzip, json, os, threading, time, uuid
+from typing import Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from .contexto import contador_tokens, historico_no_orcamento
+
+BASE_CONVERSAS = os.environ.get("SAGEBOT_CONVERSAS", "data/conversas")
+PALAVRAS_RESUMO = 250
+
+_PROMPT_RESUMO = (
+    "Você mantém o resumo de uma conversa de suporte técnico sobre AWS. "
+    "Atualize o resumo com as mensagens novas, em até {palavras} palavras, "
+    "preservando perguntas do usuário, decisões, nomes de serviços, recursos, "
+    "comandos e erros citados. Responda só com o resumo."
+)
+
+_TIPOS = {"human": HumanMessage, "ai": AIMessage}
+
+
+class Conversa:
+    """Histórico de uma conversa, fora do session_state.
+
+    Todas as mensagens vão para data/conversas/<id>.jsonl.gz (gzip
+    só-de-acréscimo, um membro por mensagem); em memória ficam só as
+    mensagens ainda não resumidas. As mais antigas são condensadas num
+    resumo pelo próprio LLM do chat (resumir/aresumir), gravado em <id>.json.
+    """
+
+    def __init__(self, id: Optional[str] = None, base: str = BASE_CONVERSAS):
+        self.id = id or uuid.uuid4().hex
+        self.base = base
+        self.resumo = ""
+        self.n_resumidas = 0
+        self.recentes: List[BaseMessage] = []
+        self._lock = threading.Lock()
+        self._resumindo = False
+        meta = self._ler_meta()
+        if meta:
+            self.resumo, self.n_resumidas = meta["resumo"], meta["n_resumidas"]
+            self.recentes = self.mensagens()[self.n_resumidas:]
+
+    @property
+    def _arq(self) -> str:
+        return os.path.join(self.base, self.id + ".jsonl.gz")
+
+    @property
+    def _arq_meta(self) -> str:
+        return os.path.join(self.base, self.id + ".json")
+
+    def _ler_meta(self) -> Optional[Dict]:
+        try:
+            with open(self._arq_meta, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _gravar_meta(self):
+        os.makedirs(self.base, exist_ok=True)
+        tmp = self._arq_meta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"resumo": self.resumo, "n_resumidas": self.n_resumidas}, f, ensure_ascii=False)
+        os.replace(tmp, self._arq_meta)
+
+    def __len__(self) -> int:
+        return self.n_resumidas + len(self.recentes)
+
+    def adicionar(self, *mensagens: BaseMessage):
+        linhas = "".join(
+            json.dumps({"t": m.type, "c": m.content, "ts": time.time()}, ensure_ascii=False) + "\n"
+            for m in mensagens
+        )
+        with self._lock:
+            os.makedirs(self.base, exist_ok=True)
+            with gzip.open(self._arq, "at", encoding="utf-8") as f:
+                f.write(linhas)
+            self.recentes.extend(mensagens)
+
+    def mensagens(self) -> List[BaseMessage]:
+        """A conversa inteira, lida do disco."""
+        if not os.path.exists(self._arq):
+            return []
+        with gzip.open(self._arq, "rt", encoding="utf-8") as f:
+            return [_TIPOS[r["t"]](content=r["c"]) for r in map(json.loads, f) if r["t"] in _TIPOS]
+
+    def historico(self, orcamento: int, modelo: str = "") -> List[BaseMessage]:
+        """Resumo (se houver) + as mensagens recentes que cabem em `orcamento` tokens."""
+        with self._lock:
+            resumo, recentes = self.resumo, list(self.recentes)
+        hist: List[BaseMessage] = []
+        if resumo:
+            hist.append(SystemMessage(content=f"Resumo da conversa até aqui: {resumo}"))
+            orcamento -= contador_tokens(modelo)(hist[0].content)
+        return hist + historico_no_orcamento(recentes, max(orcamento, 0), modelo)
+
+    def _a_resumir(self, orcamento: int, modelo: str) -> int:
+        """Quantas mensagens do início de `recentes` resumir: ao passar do
+        orçamento, sobra só o que cabe na metade dele (para não resumir a
+        cada pergunta)."""
+        contar = contador_tokens(modelo)
+        if sum(contar(m.content) for m in self.recentes) <= orcamento:
+            return 0
+        manter = len(historico_no_orcamento(self.recentes, orcamento // 2, modelo))
+        n = len(self.recentes) - max(manter, 2)
+        return n - n % 2
+
+    def _prompt(self, novas: List[BaseMessage]) -> List[BaseMessage]:
+        linhas = "\n".join(f"{'Usuário' if m.type == 'human' else 'SageBot'}: {m.content}" for m in novas)
+        return [
+            SystemMessage(content=_PROMPT_RESUMO.format(palavras=PALAVRAS_RESUMO)),
+            HumanMessage(content=f"Resumo atual:\n{self.resumo or '(vazio)'}\n\nMensagens novas:\n{linhas}"),
+        ]
+
+    def _preparar(self, orcamento: int, modelo: str):
+        with self._lock:
+            if self._resumindo:
+                return None
+            n = self._a_resumir(orcamento, modelo)
+            if n <= 0:
+                return None
+            self._resumindo = True
+            return n, self._prompt(self.recentes[:n])
+
+    def _concluir(self, n: int, resumo: Optional[str]):
+        with self._lock:
+            self._resumindo = False
+            if not resumo:
+                return
+            # só há acréscimos no fim enquanto o LLM resume, então as n primeiras são as mesmas
+            del self.recentes[:n]
+            self.resumo = resumo.strip()
+            self.n_resumidas += n
+            self._gravar_meta()
+
+    def resumir(self, llm, orcamento: int, modelo: str = ""):
+        preparo = self._preparar(orcamento, modelo)
+        if preparo is None:
+            return
+        n, prompt = preparo
+        resumo = None
+        try:
+            resumo = llm.invoke(prompt).content
+        finally:
+            self._concluir(n, resumo)
+
+    async def aresumir(self, llm, orcamento: int, modelo: str = ""):
+        preparo = self._preparar(orcamento, modelo)
+        if preparo is None:
+            return
+        n, prompt = preparo
+        resumo = None
+        try:
+            resumo = (await llm.ainvoke(prompt)).content
+        finally:
+            self._concluir(n, resumo)
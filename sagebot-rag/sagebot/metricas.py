@@ -0,0 +1,259 @@
+# metricas.py
+"""Tempos por etapa e contadores do processo (indexação e chat).
+
+Tudo vai para o `registro` do processo, que exporta no formato texto do
+Prometheus (registro.prometheus(), ou o endpoint /metrics de servir()) e,
+com SAGEBOT_METRICAS_ARQ definido, grava cada etapa cronometrada como uma
+linha JSONL. Cada evento leva o id do rastreio corrente (job de indexação
+ou pergunta do chat), para juntar as etapas de uma mesma operação.
+"""
+import contextvars, json, os, sys, threading, time, uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple, TypeVar
+
+ARQ_METRICAS = os.environ.get("SAGEBOT_METRICAS_ARQ", "")  # vazio = sem JSONL
+PORTA_METRICAS = int(os.environ.get("SAGEBOT_METRICAS_PORTA", "0"))  # 0 = sem endpoint
+
+# limites (segundos) dos histogramas: de uma busca em memória a um job de indexação
+BALDES = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_rastreio: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("sagebot_rastreio", default=None)
+
+T = TypeVar("T")
+Rotulos = Tuple[Tuple[str, str], ...]
+
+
+def _rotulos(labels: Dict) -> Rotulos:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _fmt(nome: str, rotulos: Rotulos, extra: Rotulos = ()) -> str:
+    todos = rotulos + extra
+    if not todos:
+        return nome
+    return nome + "{" + ",".join(f'{k}="{v}"' for k, v in todos) + "}"
+
+
+class Registro:
+    """Contadores e histogramas de tempo, com rótulos, seguros entre threads."""
+
+    def __init__(self, arq: str = ARQ_METRICAS):
+        self.arq = arq
+        self._contadores: Dict[Tuple[str, Rotulos], float] = {}
+        self._histogramas: Dict[Tuple[str, Rotulos], list] = {}  # [contagens por balde..., soma, n]
+        self._lock = threading.Lock()
+
+    def contar(self, nome: str, valor: float = 1, **labels):
+        chave = (nome, _rotulos(labels))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def observar(self, nome: str, segundos: float, **labels):
+        chave = (nome, _rotulos(labels))
+        with self._lock:
+            h = self._histogramas.get(chave)
+            if h is None:
+                h = self._histogramas[chave] = [0] * len(BALDES) + [0.0, 0]
+            for i, limite in enumerate(BALDES):
+                if segundos <= limite:
+                    h[i] += 1
+            h[-2] += segundos
+            h[-1] += 1
+        if self.arq:
+            self._gravar({"ts": round(time.time(), 3), "rastreio": _rastreio.get(), "metrica": nome, "segundos": round(segundos, 6), **labels})
+
+    def _gravar(self, evento: Dict):
+        linha = json.dumps(evento, ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.arq) or ".", exist_ok=True)
+            with open(self.arq, "a", encoding="utf-8") as f:
+                f.write(linha)
+
+    def prometheus(self) -> str:
+        """Formato texto de exposição do Prometheus."""
+        with self._lock:
+            contadores = dict(self._contadores)
+            histogramas = {k: list(v) for k, v in self._histogramas.items()}
+        linhas = []
+        for nome in sorted({n for n, _ in contadores}):
+            linhas.append(f"# TYPE {nome} counter")
+            linhas += [f"{_fmt(n, r)} {v:g}" for (n, r), v in sorted(contadores.items()) if n == nome]
+        for nome in sorted({n for n, _ in histogramas}):
+            linhas.append(f"# TYPE {nome} histogram")
+            for (n, r), h in sorted(histogramas.items()):
+                if n != nome:
+                    continue
+                linhas += [f"{_fmt(n + '_bucket', r, (('le', f'{b:g}'),))} {c}" for b, c in zip(BALDES, h)]
+                linhas.append(f"{_fmt(n + '_bucket', r, (('le', '+Inf'),))} {h[-1]}")
+                linhas.append(f"{_fmt(n + '_sum', r)} {h[-2]:.6f}")
+                linhas.append(f"{_fmt(n + '_count', r)} {h[-1]}")
+        return "\n".join(linhas) + "\n"
+
+    def resumo(self) -> Dict[str, Dict]:
+        """{etapa: {n, segundos, media_ms}} do histograma de etapas (para logs e UI)."""
+        with self._lock:
+            itens = [(dict(r).get("etapa"), h) for (n, r), h in self._histogramas.items() if n == "sagebot_etapa_segundos"]
+        saida: Dict[str, Dict] = {}
+        for etapa, h in itens:
+            e = saida.setdefault(etapa, {"n": 0, "segundos": 0.0})
+            e["n"] += h[-1]
+            e["segundos"] += h[-2]
+        for e in saida.values():
+            e["media_ms"] = round(1000 * e["segundos"] / max(e["n"], 1), 2)
+            e["segundos"] = round(e["segundos"], 4)
+        return saida
+
+
+registro = Registro()
+
+
+@contextmanager
+def rastreio(id: Optional[str] = None) -> Iterator[str]:
+    """Marca os eventos gerados dentro do bloco com `id` (novo, se None)."""
+    id = id or uuid.uuid4().hex[:12]
+    token = _rastreio.set(id)
+    try:
+        yield id
+    finally:
+        _rastreio.reset(token)
+
+
+def observar_etapa(nome: str, segundos: float, **labels):
+    registro.observar("sagebot_etapa_segundos", segundos, etapa=nome, **labels)
+
+
+@contextmanager
+def etapa(nome: str, **labels):
+    """Cronometra o bloco como a etapa `nome`."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar_etapa(nome, time.perf_counter() - t0, **labels)
+
+
+class Cronometro:
+    """Soma o tempo gasto produzindo os itens de um iterador (etapas em
+    streaming, como leitura e split, que correm junto com o embedding)."""
+
+    def __init__(self, it: Iterable[T]):
+        self._it = iter(it)
+        self.segundos = 0.0
+        self.itens = 0
+
+    def __iter__(self) -> Iterator[T]:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(self._it)
+            except StopIteration:
+                self.segundos += time.perf_counter() - t0
+                return
+            self.segundos += time.perf_counter() - t0
+            self.itens += 1
+            yield item
+
+
+def _duracao(segundos: float) -> str:
+    s = int(round(segundos))
+    if s < 60:
+        return f"{s}s"
+    if s < 3600:
+        return f"{s // 60}m{s % 60:02d}s"
+    return f"{s // 3600}h{s % 3600 // 60:02d}m"
+
+
+class Andamento:
+    """Quanto de uma etapa já foi feito, com vazão e ETA.
+
+    A vazão é medida nos últimos `janela` segundos (o começo de um job,
+    com conexões abrindo e cache quente, não distorce o ETA do resto).
+    Sem `total`, só há contagem e vazão.
+    """
+
+    def __init__(self, total: Optional[int] = None, unidade: str = "trechos", janela: float = 30.0):
+        self.total = total
+        self.unidade = unidade
+        self.janela = janela
+        self.feitos = 0
+        self.inicio = time.monotonic()
+        self._marcas = deque([(self.inicio, 0)])
+
+    def avancar(self, n: int = 1):
+        agora = time.monotonic()
+        self.feitos += n
+        self._marcas.append((agora, self.feitos))
+        while len(self._marcas) > 2 and agora - self._marcas[1][0] >= self.janela:
+            self._marcas.popleft()
+
+    @property
+    def vazao(self) -> float:
+        """Itens por segundo na janela recente."""
+        (t0, f0), (t1, f1) = self._marcas[0], self._marcas[-1]
+        return (f1 - f0) / (t1 - t0) if t1 > t0 else 0.0
+
+    @property
+    def fracao(self) -> Optional[float]:
+        return min(self.feitos / self.total, 1.0) if self.total else None
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Segundos restantes estimados; None sem total ou sem vazão ainda."""
+        if not self.total or self.vazao <= 0:
+            return None
+        return max(self.total - self.feitos, 0) / self.vazao
+
+    def texto(self) -> str:
+        partes = [f"{self.feitos}/{self.total} {self.unidade}" if self.total else f"{self.feitos} {self.unidade}"]
+        if self.vazao > 0:
+            partes.append(f"{self.vazao:.1f}/s")
+        if self.eta is not None:
+            partes.append(f"faltam ~{_duracao(self.eta)}")
+        return " · ".join(partes)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        corpo = registro.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+_servidor: Optional[ThreadingHTTPServer] = None
+_portas_falhas: Set[int] = set()
+_lock_servidor = threading.Lock()
+
+
+def servir(porta: int = PORTA_METRICAS) -> Optional[ThreadingHTTPServer]:
+    """Sobe (uma vez por processo) o endpoint /metrics numa thread; 0 = desligado.
+
+    Se a porta estiver ocupada, avisa uma vez e não tenta de novo (o app
+    chama servir() a cada rerun do Streamlit).
+    """
+    global _servidor
+    if not porta:
+        return None
+    with _lock_servidor:
+        if _servidor is None:
+            if porta in _portas_falhas:
+                return None
+            try:
+                _servidor = ThreadingHTTPServer(("0.0.0.0", porta), _Handler)
+            except OSError as e:
+                # porta ocupada (ex.: outro processo do app na mesma máquina)
+                _portas_falhas.add(porta)
+                print(f"[metricas] endpoint /metrics desligado: porta {porta} indisponível ({e})", file=sys.stderr, flush=True)
+                return None
+            threading.Thread(target=_servidor.serve_forever, name="sagebot-metricas", daemon=True).start()
+        return _servidor
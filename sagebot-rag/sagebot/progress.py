@@ -1,5 +1,5 @@
 import streamlit as st
-from typing import Optional
+from typing import Callable, Optional
 
 KEY_STATUS = "index_status"   # "idle" | "building" | "ready" | "error" | "error: ..."
 KEY_STEP   = "index_step"     # "init" | "split" | "embed" | "index" | "ready"
@@ -7,6 +7,9 @@ KEY_PCT    = "index_pct"      # float 0..1
 KEY_LOG    = "index_log"      # list[str]
 KEY_RERUN  = "__needs_rerun"  # bool
 KEY_ERRMSG = "index_error"    # str (detalhe do erro, quando existir)
+KEY_DETALHE = "index_detalhe" # str (feitos/total, vazão e ETA da etapa atual)
+
+INTERVALO_STATUS = 2.0  # segundos entre leituras do andamento enquanto indexa
 
 def progress():
     """Reseta o estado de progresso antes de iniciar a indexação."""
@@ -15,6 +18,7 @@ def progress():
     st.session_state[KEY_PCT]    = 0.0
     st.session_state[KEY_LOG]    = []
     st.session_state.pop(KEY_ERRMSG, None)
+    st.session_state.pop(KEY_DETALHE, None)
 
 def adicionar_log(msg: str):
     
@@ -22,7 +26,7 @@ def adicionar_log(msg: str):
     buf.append(msg)
     st.session_state[KEY_LOG] = buf[-200:]
 
-def atualizar(step: Optional[str] = None, pct: Optional[float] = None, log: Optional[str] = None):
+def atualizar(step: Optional[str] = None, pct: Optional[float] = None, log: Optional[str] = None, detalhe: Optional[str] = None):
    
     if step is not None:
         st.session_state[KEY_STEP] = step
@@ -35,6 +39,8 @@ def atualizar(step: Optional[str] = None, pct: Optional[float] = None, log: Opti
         st.session_state[KEY_PCT]  = p
     if log:
         adicionar_log(log)
+    if detalhe is not None:
+        st.session_state[KEY_DETALHE] = detalhe
 
 def mark_ready():
     
@@ -63,14 +69,38 @@ def mark_idle():
     st.session_state[KEY_PCT]     = 0.0
     st.session_state[KEY_LOG]     = []
     st.session_state.pop(KEY_ERRMSG, None)
+    st.session_state.pop(KEY_DETALHE, None)
     st.session_state.pop(KEY_RERUN, None)
 
-def render_status():
+def render_status(acompanhar: Optional[Callable[[], None]] = None):
+    """Mostra o estado da indexação.
+
+    Com `acompanhar` (que atualiza o session_state a partir do job) e um job
+    em andamento, o quadro vira um fragmento que se redesenha sozinho a cada
+    INTERVALO_STATUS segundos, sem rodar o app inteiro; só quando o job
+    termina o app roda de novo, para montar o chat com o índice.
+    """
+    if acompanhar is not None and st.session_state.get(KEY_STATUS) == "building":
+        _status_ao_vivo(acompanhar)
+    else:
+        _desenhar_status()
+
+@st.fragment(run_every=INTERVALO_STATUS)
+def _status_ao_vivo(acompanhar: Callable[[], None]):
+    acompanhar()
+    if st.session_state.get(KEY_STATUS) != "building":
+        # este rerun já é o pedido por acompanhar ao terminar
+        st.session_state.pop(KEY_RERUN, None)
+        st.rerun()
+    _desenhar_status()
+
+def _desenhar_status():
     status = st.session_state.get(KEY_STATUS, "idle")
     step   = st.session_state.get(KEY_STEP, None)
     pct    = st.session_state.get(KEY_PCT, 0.0)
     logs   = st.session_state.get(KEY_LOG, [])
     errmsg = st.session_state.get(KEY_ERRMSG, None)
+    andamento = st.session_state.get(KEY_DETALHE, None)
 
     pct_int = int(round((pct or 0.0) * 100))
 
@@ -81,6 +111,8 @@ def render_status():
                 st.write(f"Progresso: **{pct_int}%**")
                 if step:
                     st.write(f"Etapa: **{step}**")
+                if andamento:
+                    st.caption(andamento)
                 for line in logs[-6:]:
                     st.write(f"- {line}")
         except Exception:
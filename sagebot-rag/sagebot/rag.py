@@ -1,11 +1,24 @@
 # rag.py
-from typing import List, Optional, Sequence, Union
+import re
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Union
 from langchain_openai import OpenAIEmbeddings
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain_core.embeddings import Embeddings
+from langchain.storage import LocalFileStore
 from langchain_community.vectorstores import FAISS
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.schema import Document
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import EmbeddingsFilter
+from langchain_community.docstore.in_memory import InMemoryDocstore
+import numpy as np
+from . import ann
+from .lotes import embed_em_lotes, EMBED_WORKERS, EMBED_TPM
+from .cache_consultas import embeddings_consulta
+from .busca import RetrieverVetorial
+from .metricas import Andamento, etapa
+from .embeddings_locais import eh_local, eh_sintetico, embeddings_locais, embeddings_sinteticas
+
+BASE_EMBED_CACHE = "data/embed_cache"
 
 def split_text(chunk_size = 1500, chunk_overlap = 100):
     return RecursiveCharacterTextSplitter(
@@ -14,52 +27,163 @@ def split_text(chunk_size = 1500, chunk_overlap = 100):
         separators=["\n\n", "\n", ". ", "? ", " ", ""],
     )
 
-def to_documents(chunks: Sequence[Union[str, Document]]) -> List[Document]:
-
-    docs: List[Document] = []
+def iter_documents(chunks: Iterable[Union[str, Document]]) -> Iterator[Document]:
     for c in chunks:
         if isinstance(c, Document):
-            docs.append(c)
+            yield c
         else:
             text = (c or "").strip()
             if text:
-                docs.append(Document(page_content=text))
-    return docs
+                yield Document(page_content=text)
+
+def to_documents(chunks: Sequence[Union[str, Document]]) -> List[Document]:
+    return list(iter_documents(chunks))
 
-def embeddings(model= "text-embedding-3-small", dimensions= None) -> OpenAIEmbeddings:
+def em_lotes(docs: Iterable[Document], step: int) -> Iterator[List[Document]]:
+    it = iter(docs)
+    while True:
+        lote = list(islice(it, step))
+        if not lote:
+            return
+        yield lote
+
+def split_documents(docs: Iterable[Document], splitter=None) -> Iterator[Document]:
+    """Divide página a página, mantendo source/page de cada chunk."""
+    splitter = splitter or split_text()
+    if hasattr(splitter, "dividir"):
+        # divisor.DivisorEstruturado: em paralelo quando a entrada é grande
+        yield from splitter.dividir(docs)
+        return
+    for doc in docs:
+        yield from splitter.split_documents([doc])
+
+def embeddings(model= "text-embedding-3-small", dimensions= None) -> Embeddings:
+    """OpenAI ou, para nomes "local:<modelo>", um modelo ONNX na CPU
+    ("sintetico:<dims>" dá vetores determinísticos, para o benchmark)."""
+    if eh_local(model):
+        return embeddings_locais(model, dimensions)
+    if eh_sintetico(model):
+        return embeddings_sinteticas(model, dimensions)
     return OpenAIEmbeddings(model=model,dimensions=dimensions)
 
+def query_embeddings(model= "text-embedding-3-small", dimensions= None):
+    """Embeddings para busca, com cache LRU+TTL da consulta compartilhado no processo."""
+    return embeddings_consulta(embeddings, model, dimensions)
+
+def cache_namespace(model, dims=None) -> str:
+    """Namespace do cache de chunks: modelo + dimensões (nunca mistura vetores)."""
+    ns = f"{model}_{dims if dims is not None else 'native'}"
+    return re.sub(r"[^a-zA-Z0-9_.\-]", "_", ns) + "/"
+
+def cached_embeddings(model= "text-embedding-3-small", dimensions= None, cache_dir= None):
+    """Embeddings com cache persistente por chunk (texto + modelo + dims).
+
+    O cache é compartilhado por todos os índices: só os chunks que nunca
+    foram vistos vão para a API. Sem `cache_dir`, usa BASE_EMBED_CACHE
+    (lido na chamada, não na importação).
+    """
+    store = LocalFileStore(cache_dir or BASE_EMBED_CACHE)
+    return CacheBackedEmbeddings.from_bytes_store(
+        embeddings(model=model, dimensions=dimensions),
+        store,
+        namespace=cache_namespace(model, dimensions),
+    )
+
 
 def build_vectorstore(
-    docs: Sequence[Union[str, Document]],
+    docs: Iterable[Union[str, Document]],
     embed_model = "text-embedding-3-small",
     dims = None,
+    cache = True,
+    step = 128,
+    max_workers = EMBED_WORKERS,
+    tpm = EMBED_TPM,
+    tipo_indice = "auto",
+    n_estimado: Optional[int] = None,
+    checkpoint=None,
+    andamento: Optional[Callable[[Andamento], None]] = None,
 ) -> FAISS:
-    emb = embeddings(model=embed_model, dimensions=dims)
-    docs_ = to_documents(docs)
-    
-    step = 128
-    vs: Optional[FAISS] = None 
-    
-    for i in range(0, len(docs_), step):
-        batch = docs_[i:i+step]
-        if vs is None:
-            vs = FAISS.from_documents(batch, emb)
-        else:
-            vs.add_documents(batch, embedding=emb)
+    """Embeda os chunks e monta o índice FAISS.
+
+    `tipo_indice` é "flat", "hnsw", "ivf", "ivfpq" ou "auto" (escolhido pelo
+    tamanho do corpus). Com `n_estimado`, os primeiros vetores servem de
+    amostra de treino e o resto vai direto para o índice final; sem
+    estimativa, IVF e "auto" montam flat e convertem no fim, amostrando o
+    corpus inteiro. Com `checkpoint` (checkpoint.CheckpointEmbeddings) cada
+    lote embedado é gravado em disco e os já gravados não voltam para a API.
+    `andamento` é chamado a cada lote embedado, com os trechos feitos, a
+    vazão e o ETA (o total é `n_estimado`, se houver).
+    """
+    if cache:
+        emb = cached_embeddings(model=embed_model, dimensions=dims)
+    else:
+        emb = embeddings(model=embed_model, dimensions=dims)
+    if eh_local(embed_model):
+        # o ONNX já usa todos os núcleos em cada lote e não há cota de tokens
+        max_workers, tpm = 1, None
+
+    tipo = tipo_indice
+    if tipo == "auto" and n_estimado:
+        tipo = ann.escolher_tipo(n_estimado)
+    final = None
+    if tipo in ("ivf", "ivfpq") and not n_estimado:
+        # sem o tamanho do corpus não dá para dimensionar nlist nem a amostra
+        # de treino: monta flat e converte no fim, amostrando o corpus inteiro
+        tipo, final = "flat", tipo
+    amostra = ann.tamanho_amostra(tipo, n_estimado or 0) if tipo in ("ivf", "ivfpq") else 0
+    espera_pares, espera_metas = [], []
+
+    # aceita gerador: só ~2 * max_workers lotes ficam em memória por vez
+    lotes = em_lotes(iter_documents(docs), step)
+    vs: Optional[FAISS] = None
+
+    feito = Andamento(total=n_estimado, unidade="trechos")
+    embedar = checkpoint.embed_em_lotes if checkpoint is not None else embed_em_lotes
+    for batch, vetores in embedar(emb, lotes, max_workers=max_workers, tpm=tpm):
+        feito.avancar(len(batch))
+        if andamento is not None:
+            andamento(feito)
+        pares = list(zip([d.page_content for d in batch], vetores))
+        metas = [d.metadata for d in batch]
+        if vs is None and tipo not in ("auto", "flat"):
+            # segura os primeiros vetores até ter amostra suficiente para treinar
+            espera_pares += pares
+            espera_metas += metas
+            if len(espera_pares) < max(amostra, 1):
+                continue
+            with etapa("faiss_treino", tipo=tipo):
+                vs = _vs_vazio(emb, tipo, espera_pares, n_estimado or len(espera_pares))
+            pares, metas = espera_pares, espera_metas
+            espera_pares, espera_metas = [], []
+        with etapa("faiss_add"):
+            if vs is None:
+                vs = FAISS.from_embeddings(pares, emb, metadatas=metas)
+            else:
+                vs.add_embeddings(pares, metadatas=metas)
+
+    if vs is None and espera_pares:
+        # corpus menor que a amostra pedida: monta flat e converte
+        with etapa("faiss_converter", tipo=tipo):
+            vs = FAISS.from_embeddings(espera_pares, emb, metadatas=espera_metas)
+            vs = ann.converter_indice(vs, tipo)
 
     if vs is None:
         vs = FAISS.from_documents([Document(page_content="")], emb)
+    elif tipo == "auto" or final:
+        with etapa("faiss_converter", tipo=final or "auto"):
+            vs = ann.converter_indice(vs, final or "auto")
 
     return vs
 
-def retriever(vs: FAISS, k= 4):
-    return vs.as_retriever(
-        search_type="mmr",
-        search_kwargs={"k": k, "fetch_k": 30, "lambda_mult": 0.5, "score_threshold": 0.3}
-    )
+def _vs_vazio(emb, tipo, pares, n) -> FAISS:
+    amostra = np.asarray([v for _, v in pares], dtype="float32")
+    index = ann.indice_treinado(tipo, amostra, n)
+    return FAISS(emb, index, InMemoryDocstore(), {})
+
+def retriever(vs: FAISS, k= 4, fetch_k= 30):
+    return RetrieverVetorial(vs=vs, k=k, fetch_k=fetch_k, lambda_mult=0.5)
 
-def compressed_retriever(vs: FAISS, k: int = 4, similarity_threshold: float = 0.35):
-    base = retriever(vs, k=k)
-    comp = EmbeddingsFilter(embeddings=embeddings(), similarity_threshold=similarity_threshold)
-    return ContextualCompressionRetriever(base_compressor=comp, base_retriever=base)
+def compressed_retriever(vs: FAISS, k: int = 4, similarity_threshold: float = 0.35, fetch_k: int = 30):
+    """MMR + limiar de similaridade sobre os vetores guardados no índice
+    (sem embedar de novo os chunks retornados)."""
+    return RetrieverVetorial(vs=vs, k=k, fetch_k=fetch_k, lambda_mult=0.5, similarity_threshold=similarity_threshold)
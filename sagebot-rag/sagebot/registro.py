@@ -0,0 +1,136 @@
+# registro.py
+import os, threading, weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from langchain_community.vectorstores import FAISS
+
+from .index_store import DocstoreEmDisco
+
+INDEX_MEM_MB = int(os.environ.get("SAGEBOT_INDEX_MEM_MB", "2048"))
+
+Chave = Tuple[str, str, Optional[int]]  # (hash do índice, modelo de embeddings, dims)
+
+
+def chave_indice(h: str, embed_model: str = "", dims=None) -> Chave:
+    return (h, embed_model or "", dims)
+
+
+def estimar_bytes(vs: FAISS) -> int:
+    """Estimativa do custo em memória de um índice (vetores + textos)."""
+    total = vs.index.ntotal * vs.index.d * 4
+    ds = vs.docstore
+    if isinstance(ds, DocstoreEmDisco):
+        total += len(ds._mm)
+    else:
+        for doc in getattr(ds, "_dict", {}).values():
+            total += len(getattr(doc, "page_content", "") or "")
+    return total
+
+
+class Referencia:
+    """O que a sessão guarda: aponta para o índice compartilhado.
+
+    Quando a sessão troca de índice ou é descartada, o objeto é coletado e a
+    referência é devolvida ao registro automaticamente.
+    """
+
+    def __init__(self, registro: "RegistroIndices", chave: Chave, entrada: "_Entrada"):
+        self.chave = chave
+        self.vs = entrada.vs
+        self._fim = weakref.finalize(self, registro._soltar, entrada)
+
+    def liberar(self):
+        self._fim()
+
+
+class _Entrada:
+    def __init__(self, vs: FAISS):
+        self.vs = vs
+        self.refs = 0
+        self.bytes = estimar_bytes(vs)
+
+
+class RegistroIndices:
+    """Índices FAISS compartilhados por todas as sessões do processo.
+
+    Cada índice é carregado uma vez por chave; entradas sem referências são
+    despejadas em ordem LRU quando o total passa de `orcamento_bytes`.
+    """
+
+    def __init__(self, orcamento_bytes: int):
+        self.orcamento_bytes = orcamento_bytes
+        self._itens: "OrderedDict[Chave, _Entrada]" = OrderedDict()
+        self._carregando: Dict[Chave, threading.Lock] = {}
+        self._lock = threading.RLock()  # o finalize da Referencia pode rodar dentro do lock (GC)
+
+    def obter(self, chave: Chave, carregar: Callable[[], Optional[FAISS]]) -> Optional[Referencia]:
+        with self._lock:
+            ref = self._referenciar(chave)
+            if ref is not None:
+                return ref
+            trava = self._carregando.setdefault(chave, threading.Lock())
+
+        # só uma sessão carrega cada chave; as outras esperam e reaproveitam
+        with trava:
+            with self._lock:
+                ref = self._referenciar(chave)
+                if ref is not None:
+                    return ref
+            try:
+                vs = carregar()
+                if vs is None:
+                    return None
+                with self._lock:
+                    return self._inserir(chave, vs)
+            finally:
+                with self._lock:
+                    self._carregando.pop(chave, None)
+
+    def registrar(self, chave: Chave, vs: FAISS) -> Referencia:
+        with self._lock:
+            return self._inserir(chave, vs)
+
+    def _soltar(self, ent: "_Entrada"):
+        with self._lock:
+            if ent.refs > 0:
+                ent.refs -= 1
+            self._despejar()
+
+    def invalidar(self, chave: Chave):
+        """Remove a entrada (ex.: o índice mudou em disco). Quem já tem referência mantém o objeto."""
+        with self._lock:
+            self._itens.pop(chave, None)
+
+    def uso_bytes(self) -> int:
+        with self._lock:
+            return sum(e.bytes for e in self._itens.values())
+
+    def _referenciar(self, chave: Chave) -> Optional[Referencia]:
+        ent = self._itens.get(chave)
+        if ent is None:
+            return None
+        self._itens.move_to_end(chave)
+        ent.refs += 1
+        return Referencia(self, chave, ent)
+
+    def _inserir(self, chave: Chave, vs: FAISS) -> Referencia:
+        ent = _Entrada(vs)
+        ent.refs = 1
+        self._itens[chave] = ent
+        self._itens.move_to_end(chave)
+        self._despejar()
+        return Referencia(self, chave, ent)
+
+    def _despejar(self):
+        total = sum(e.bytes for e in self._itens.values())
+        for chave in list(self._itens):
+            if total <= self.orcamento_bytes:
+                break
+            ent = self._itens[chave]
+            if ent.refs == 0:
+                total -= ent.bytes
+                del self._itens[chave]
+
+
+REGISTRO = RegistroIndices(INDEX_MEM_MB * 1024 * 1024)
@@ -0,0 +1,209 @@
+# segmentos.py
+import hashlib, json, os, shutil, threading
+from typing import Dict, Iterable, List, Optional
+
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+
+from . import ann
+from .divisor import divisor
+from .index_store import carregar_indice, modo_divisao, salvar_indice
+from .rag import build_vectorstore, split_documents
+
+ARQ_MANIFESTO = "manifesto.json"
+MAX_SEGMENTOS = int(os.environ.get("SAGEBOT_MAX_SEGMENTOS", "8"))
+MAX_TOMBSTONES = 0.2  # fração do índice apagada que dispara compactação
+
+_lock = threading.Lock()
+
+
+def chunk_hash(doc: Document) -> str:
+    src = str(doc.metadata.get("source") or "")
+    return hashlib.sha1((src + "\0" + doc.page_content).encode("utf-8")).hexdigest()
+
+
+def ler_manifesto(path: str) -> Optional[Dict]:
+    p = os.path.join(path, ARQ_MANIFESTO)
+    if not os.path.exists(p):
+        return None
+    with open(p, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _gravar_manifesto(path: str, man: Dict):
+    tmp = os.path.join(path, ARQ_MANIFESTO + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(man, f)
+    os.replace(tmp, os.path.join(path, ARQ_MANIFESTO))
+
+
+def _manifesto_de(vs: FAISS) -> Dict:
+    """Monta o manifesto (fonte -> {chunk_hash: docstore_id}) de um índice sem um."""
+    fontes: Dict[str, Dict[str, str]] = {}
+    for i in range(vs.index.ntotal):
+        _id = vs.index_to_docstore_id[i]
+        doc = vs.docstore.search(_id)
+        src = str(doc.metadata.get("source") or "")
+        fontes.setdefault(src, {})[doc.metadata.get("chunk_hash") or chunk_hash(doc)] = getattr(doc, "id", None) or _id
+    return {"fontes": fontes, "segmentos": [], "tombstones": []}
+
+
+def assinatura(path: str) -> Optional[str]:
+    """Identifica a versão da base em disco; None se houver delta pendente
+    (aí as posições em memória não batem com as do disco)."""
+    man = ler_manifesto(path)
+    if man and (man["segmentos"] or man["tombstones"]):
+        return None
+    try:
+        st = os.stat(os.path.join(path, "index.faiss"))
+    except FileNotFoundError:
+        return None
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def carregar(path: str, emb, mmap: bool = True) -> Optional[FAISS]:
+    """Carrega base + segmentos, sem os chunks marcados como apagados.
+
+    Sem delta pendente o índice é aberto direto (mapeado em memória); com
+    delta, base e segmentos são juntados numa cópia em RAM até a próxima
+    compactação.
+    """
+    man = ler_manifesto(path)
+    if not man or (not man["segmentos"] and not man["tombstones"]):
+        return carregar_indice(path, emb, mmap=mmap)
+
+    vs = carregar_indice(path, emb, mmap=False)
+    if vs is None:
+        return None
+    for seg in man["segmentos"]:
+        parte = carregar_indice(os.path.join(path, seg), emb, mmap=False)
+        if parte is not None:
+            _anexar(vs, parte)
+    if man["tombstones"]:
+        mortos = set(man["tombstones"])
+        if ann.suporta_remocao(vs.index):
+            apagar = [t for t in vs.index_to_docstore_id.values() if t in mortos]
+            if apagar:
+                vs.delete(apagar)
+        else:
+            manter = [i for i, _id in vs.index_to_docstore_id.items() if _id not in mortos]
+            if len(manter) < vs.index.ntotal:
+                vs = ann.converter_indice(vs, ann.tipo_de(vs.index), manter=manter)
+    return vs
+
+
+def _anexar(vs: FAISS, parte: FAISS):
+    """Acrescenta os vetores de um segmento (flat) ao índice base, de qualquer tipo."""
+    if parte.index.ntotal == 0:
+        return
+    ids = [parte.index_to_docstore_id[i] for i in range(parte.index.ntotal)]
+    docs = [parte.docstore.search(_id) for _id in ids]
+    vetores = ann.vetores(parte.index)
+    vs.add_embeddings(
+        list(zip([d.page_content for d in docs], vetores)),
+        metadatas=[d.metadata for d in docs],
+        ids=ids,
+    )
+
+
+def compactar(path: str, emb):
+    """Reescreve base + segmentos - tombstones como uma base única."""
+    with _lock:
+        man = ler_manifesto(path)
+        if not man or (not man["segmentos"] and not man["tombstones"]):
+            return
+        vs = carregar(path, emb, mmap=False)
+        salvar_indice(vs, path)
+        for seg in man["segmentos"]:
+            shutil.rmtree(os.path.join(path, seg), ignore_errors=True)
+        man["segmentos"], man["tombstones"] = [], []
+        _gravar_manifesto(path, man)
+
+
+def _precisa_compactar(man: Dict) -> bool:
+    vivos = sum(len(v) for v in man["fontes"].values()) or 1
+    return len(man["segmentos"]) >= MAX_SEGMENTOS or len(man["tombstones"]) > MAX_TOMBSTONES * vivos
+
+
+def _novo_segmento(path: str, man: Dict, chunks: List[Document], embed_model, dims) -> List[str]:
+    vs = build_vectorstore(chunks, embed_model=embed_model, dims=dims, tipo_indice="flat")
+    nome = f"seg-{len(man['segmentos']) + 1:04d}"
+    while os.path.exists(os.path.join(path, nome)):
+        nome = f"seg-{int(nome[4:]) + 1:04d}"
+    salvar_indice(vs, os.path.join(path, nome))
+    man["segmentos"].append(nome)
+    return [vs.index_to_docstore_id[i] for i in range(vs.index.ntotal)]
+
+
+def aplicar_delta(
+    path: str,
+    emb,
+    novas_fontes: Dict[str, Iterable[Document]],
+    embed_model="text-embedding-3-small",
+    dims=None,
+    substituir: bool = True,
+    splitter=None,
+) -> Dict[str, int]:
+    """Atualiza o índice em `path` só com o que mudou.
+
+    Para cada fonte, os chunks da versão nova são comparados por hash com os
+    que já estão no índice: os removidos viram tombstones, os novos são
+    embedados num segmento próprio e o resto não é tocado. Com
+    `substituir=False` nada é apagado (só acrescenta). Retorna contagens.
+
+    Sem `splitter`, usa o mesmo modo de divisão com que o índice foi feito
+    (meta.json); no modo "pais" as seções novas vão para o fim do pais.jsonl
+    do índice, publicadas junto com o segmento.
+    """
+    splitter = splitter or divisor(modo_divisao(path), embed_model)
+    pais = hasattr(splitter, "abrir")
+    with _lock:
+        man = ler_manifesto(path)
+        if man is None:
+            base = carregar_indice(path, emb, mmap=True)
+            if base is None:
+                raise RuntimeError(f"Índice {path} não encontrado.")
+            man = _manifesto_de(base)
+
+        if pais:
+            splitter.abrir(path, anexar=True)
+        try:
+            novos: List[Document] = []
+            fonte_de: List[str] = []
+            removidos = 0
+            for fonte, paginas in novas_fontes.items():
+                atuais = man["fontes"].get(fonte, {})
+                vistos = {}
+                for ch in split_documents(paginas, splitter):
+                    ch.metadata.setdefault("source", fonte)
+                    h = chunk_hash(ch)
+                    if h in vistos:
+                        continue
+                    ch.metadata["chunk_hash"] = h
+                    vistos[h] = ch
+                if substituir:
+                    for h in set(atuais) - set(vistos):
+                        man["tombstones"].append(atuais.pop(h))
+                        removidos += 1
+                for h, ch in vistos.items():
+                    if h not in atuais:
+                        novos.append(ch)
+                        fonte_de.append(fonte)
+                man["fontes"][fonte] = atuais
+
+            if novos:
+                ids = _novo_segmento(path, man, novos, embed_model, dims)
+                for ch, fonte, _id in zip(novos, fonte_de, ids):
+                    man["fontes"][fonte][ch.metadata["chunk_hash"]] = _id
+                if pais:
+                    # antes do manifesto: o segmento visível já acha as seções dele
+                    splitter.publicar(path)
+            if novos or removidos:
+                _gravar_manifesto(path, man)
+        finally:
+            if pais:
+                splitter.descartar()
+
+    if _precisa_compactar(man):
+        compactar(path, emb)
+    return {"adicionados": len(novos), "removidos": removidos}
@@ -1,30 +1,144 @@
 import hashlib,json
 from langchain.schema import Document
-from typing import Iterable
+from typing import Iterable, List, Optional
+from .embeddings_locais import backend_de
 
+# sha256 truncado em 160 bits: mesmo tamanho do sha1 de antes nos nomes dos
+# diretórios, e com as instruções SHA dos processadores atuais é o mais
+# rápido do hashlib (mais que sha1 e blake2b)
+TAM_DIGEST = 20
+BLOCO_TEXTO = 1 << 20  # caracteres por folha quando o documento é uma string
+_VERSAO = b"sagebot-hash-v2"
+_FOLHA, _NO = b"\0", b"\1"
 
-def doc_hash(content, model= "", dims=None):
-    cfg = {
-        "model": model or "",
-        "dims": dims if dims is not None else "native"
-    }
-    payload = json.dumps(
-        {"content": content, "cfg": cfg},
-        ensure_ascii=False,
-        sort_keys=True
-    ).encode("utf-8")
 
-    return hashlib.sha1(payload).hexdigest()
+def _digest(*partes: bytes) -> bytes:
+    h = hashlib.sha256()
+    for p in partes:
+        h.update(p)
+    return h.digest()[:TAM_DIGEST]
 
-def corpus_hash(docs: Iterable[Document], model= "", dims=None) -> str:
 
-    cfg = {"model": model or "", "dims": dims if dims is not None else "native"}
-    items = []
+def _campo(v) -> bytes:
+    """Valor com prefixo de tamanho: concatenar campos não gera ambiguidade e dispensa o JSON."""
+    b = b"" if v is None else (v if isinstance(v, bytes) else str(v).encode("utf-8"))
+    return len(b).to_bytes(8, "little") + b
+
+
+def _cfg(model, dims, divisao=None):
+    # "backend" e a raiz de Merkle (hash v2) mudaram o hash de todos os índices
+    # feitos antes deles: esses diretórios ficam órfãos e são refeitos uma vez
+    cfg = {"model": model or "", "dims": dims if dims is not None else "native", "backend": backend_de(model)}
+    if divisao:
+        # só fora do padrão (1500 caracteres): o modo padrão não entra no hash
+        cfg["divisao"] = divisao
+    return cfg
+
+
+def hash_folha(d: Document) -> bytes:
+    """Digest de uma página/chunk: texto, fonte e página."""
+    return _digest(_FOLHA, _campo(d.page_content or ""), _campo(d.metadata.get("source")), _campo(d.metadata.get("page")))
+
+
+class ArvoreMerkle:
+    """Árvore de hashes sobre as folhas (uma por página ou chunk, na ordem).
+
+    A raiz identifica a sequência inteira; comparando duas árvores só se
+    desce pelos ramos cujos hashes diferem, então achar as folhas que
+    mudaram custa O(k log n) em vez de reler o corpus. Em disco são só as
+    folhas (TAM_DIGEST bytes cada); os níveis de cima são refeitos ao ler.
+    """
+
+    def __init__(self, folhas: List[bytes]):
+        self.folhas = list(folhas)
+        self.niveis: List[List[bytes]] = [self.folhas]
+        nivel = self.folhas
+        while len(nivel) > 1:
+            # nó ímpar sobe sozinho, sem duplicar (não confunde [a] com [a, a])
+            nivel = [_digest(_NO, *nivel[i:i + 2]) if i + 1 < len(nivel) else nivel[i] for i in range(0, len(nivel), 2)]
+            self.niveis.append(nivel)
+
+    def __len__(self) -> int:
+        return len(self.folhas)
+
+    @property
+    def raiz(self) -> bytes:
+        return self.niveis[-1][0] if self.folhas else _digest(_NO)
+
+    def diferentes(self, outra: "ArvoreMerkle") -> List[int]:
+        """Posições das folhas que mudaram (inclui as que só existem numa das duas)."""
+        if len(self) != len(outra):
+            # inserir/remover desloca tudo: compara posição a posição
+            n = min(len(self), len(outra))
+            return [i for i in range(n) if self.folhas[i] != outra.folhas[i]] + list(range(n, max(len(self), len(outra))))
+        if not self.folhas or self.raiz == outra.raiz:
+            return []
+        pendentes = [(len(self.niveis) - 1, 0)]
+        mudadas = []
+        while pendentes:
+            nivel, i = pendentes.pop()
+            if self.niveis[nivel][i] == outra.niveis[nivel][i]:
+                continue
+            if nivel == 0:
+                mudadas.append(i)
+                continue
+            pendentes.extend((nivel - 1, j) for j in (2 * i + 1, 2 * i) if j < len(self.niveis[nivel - 1]))
+        return sorted(mudadas)
+
+    def salvar(self, arq: str):
+        with open(arq, "wb") as f:
+            f.write(b"".join(self.folhas))
+
+    @classmethod
+    def carregar(cls, arq: str) -> Optional["ArvoreMerkle"]:
+        try:
+            with open(arq, "rb") as f:
+                dados = f.read()
+        except FileNotFoundError:
+            return None
+        return cls([dados[i:i + TAM_DIGEST] for i in range(0, len(dados), TAM_DIGEST)])
+
+
+def hash_arvore(arvore: ArvoreMerkle, model= "", dims=None, divisao=None) -> str:
+    """Hash do índice: raiz da árvore + configuração do embedding (e da divisão em trechos)."""
+    cfg = json.dumps(_cfg(model, dims, divisao), sort_keys=True).encode("utf-8")
+    return _digest(_VERSAO, _campo(cfg), arvore.raiz).hex()
+
+
+def arvore_texto(content: str, bloco: int = BLOCO_TEXTO) -> ArvoreMerkle:
+    """Folhas em blocos de `bloco` caracteres: só um bloco codificado por vez em memória."""
+    folhas = [
+        _digest(_FOLHA, _campo(content[i:i + bloco]))
+        for i in range(0, len(content), bloco)
+    ]
+    return ArvoreMerkle(folhas)
+
+
+def doc_hash(content, model= "", dims=None, divisao=None):
+    return hash_arvore(arvore_texto(content), model=model, dims=dims, divisao=divisao)
+
+class HashCorpus:
+    """Hash incremental do corpus: recebe um Document por vez e guarda só o
+    digest de cada um (as folhas da ArvoreMerkle).
+
+    Produz exatamente o mesmo valor que `corpus_hash` sobre a mesma sequência.
+    """
+
+    def __init__(self, model= "", dims=None, divisao=None):
+        self.model, self.dims, self.divisao = model, dims, divisao
+        self._folhas: List[bytes] = []
+
+    def atualizar(self, d: Document):
+        self._folhas.append(hash_folha(d))
+
+    def arvore(self) -> ArvoreMerkle:
+        return ArvoreMerkle(self._folhas)
+
+    def hexdigest(self) -> str:
+        return hash_arvore(self.arvore(), model=self.model, dims=self.dims, divisao=self.divisao)
+
+def corpus_hash(docs: Iterable[Document], model= "", dims=None, divisao=None) -> str:
+    hc = HashCorpus(model=model, dims=dims, divisao=divisao)
     for d in docs:
-        items.append({
-            "text": (d.page_content or ""),
-            "src": d.metadata.get("source"),
-            "page": d.metadata.get("page"),
-        })
-    payload = json.dumps({"docs": items, "cfg": cfg}, ensure_ascii=False, sort_keys=True).encode("utf-8")
-    return hashlib.sha1(payload).hexdigest()
+        hc.atualizar(d)
+    return hc.hexdigest()
@@ -1,119 +1,164 @@
-import os, threading
+import os
 import streamlit as st
 from langchain_community.vectorstores import FAISS
-from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from langchain.schema import Document
 
 # importe só o que usa (evita colisão de nomes)
 from .rag import *
 from .progress import * 
 from .utils import *
-from openai import APIConnectionError, RateLimitError, AuthenticationError
 from typing import List, Optional
 from .rag import retriever as base_retriever
-
-
-BASE_INDEX = "data/index"
+from .index_store import salvar_indice
+from .segmentos import aplicar_delta, assinatura, carregar as carregar_segmentado
+from .busca import FILHOS_POR_PAI, RetrieverPais, pais_de
+from .lexical import MODOS_BUSCA, RetrieverHibrido, RetrieverLexical, lexical_de
+from .registro import REGISTRO, chave_indice
+from .indexador import BASE_INDEX, listar_indices
+from .fila import fila
+from .divisor import MODO_DIVISAO, divisor
 
 def save_index(vs: FAISS, h):
     path = os.path.join(BASE_INDEX, h)
-    os.makedirs(path, exist_ok=True)
-    vs.save_local(path)
+    salvar_indice(vs, path)
 
-def load_index(h, emb):
+def load_index(h, emb, mmap=True):
+    """Vetores e docstore mapeados do disco (somente leitura) por padrão."""
     path = os.path.join(BASE_INDEX, h)
-    if os.path.isdir(path):
-        return FAISS.load_local(path, emb, allow_dangerous_deserialization=True)
-    return None
-
-def iniciar_async(documento, embed_model = "text-embedding-3-small", dims=None, k = 4):
-    if st.session_state.get("index_status") == "building":
+    return carregar_segmentado(path, emb, mmap=mmap)
+
+def usar_indice(h, emb, embed_model="text-embedding-3-small", dims=None) -> Optional[FAISS]:
+    """Pega o índice do registro do processo; a sessão guarda só a referência."""
+    ref = REGISTRO.obter(chave_indice(h, embed_model, dims), lambda: load_index(h, emb))
+    if ref is None:
+        return None
+    st.session_state["vs_ref"] = ref
+    st.session_state["current_index_hash"] = h
+    st.session_state["vs"] = ref.vs
+    return ref.vs
+
+def indice_lexical(vs, h):
+    path = os.path.join(BASE_INDEX, h)
+    return lexical_de(vs, path, assinatura(path))
+
+def montar_retriever(vs, h, k=4, modo_busca=MODOS_BUSCA[0], compressed=False, fetch_k=30):
+    """Retriever da sessão: MMR, BM25 puro ou a fusão dos dois. Em índices
+    com seções-pai (divisão "pais"), devolve as seções dos trechos achados."""
+    st.session_state["retriever_cfg"] = {"k": k, "modo_busca": modo_busca, "compressed": compressed, "fetch_k": fetch_k}
+    pais = pais_de(os.path.join(BASE_INDEX, h))
+    k_trechos = k * FILHOS_POR_PAI if pais is not None else k
+    fetch_k = max(fetch_k, k_trechos)
+    denso = compressed_retriever(vs, k=k_trechos, fetch_k=fetch_k) if compressed else base_retriever(vs, k=k_trechos, fetch_k=fetch_k)
+    if modo_busca == MODOS_BUSCA[0]:
+        ret = denso
+    else:
+        lex = RetrieverLexical(vs=vs, lexical=indice_lexical(vs, h), k=k_trechos)
+        ret = lex if modo_busca == MODOS_BUSCA[2] else RetrieverHibrido(denso=denso, lexical=lex, k=k_trechos)
+    if pais is not None:
+        ret = RetrieverPais(base=ret, pais=pais, k=k)
+    return ret
+
+def _indice_pronto(vs, h, k, modo_busca, log, fetch_k=30):
+    st.session_state["retriever"] = montar_retriever(vs, h, k=k, modo_busca=modo_busca, fetch_k=fetch_k)
+    st.session_state["index_status"] = "ready"
+    atualizar(step="done", pct=1.0, log=log)
+
+def iniciar_async(documento, embed_model = "text-embedding-3-small", dims=None, k = 4, modo_busca=MODOS_BUSCA[0], fetch_k=30, divisao=MODO_DIVISAO):
+    """Põe a indexação na fila do processo (fila.FilaIndexacao).
+
+    `documento` pode ser uma string (formato antigo) ou uma lista de
+    (caminho ou URL, nome da fonte), lida com loader.iter_fontes e embedada em
+    lotes sem juntar o corpus inteiro em memória. O andamento é lido da fila
+    por acompanhar_job (chamado pelo fragmento de render_status). `divisao`
+    é o modo do splitter (divisor.MODOS_DIVISAO).
+    """
+    if st.session_state.get("index_status") == "building" and st.session_state.get("index_job"):
         return
 
     progress()
     st.session_state["index_status"] = "building"
-    atualizar(step="init", pct=0.0, log="Iniciando indexação...")
-
-    ctx = get_script_run_ctx()
-
-    def job():
-        try:
-            atualizar(step="split", pct=0.10, log="Preparando splitter...")
-            splitter = split_text(chunk_size=1500, chunk_overlap=100)
-            chunks = splitter.split_text(documento)
-            docs = [Document(page_content=c) for c in chunks]
-
-            h = doc_hash(documento, model=embed_model, dims=dims)
-
-            emb = embeddings(model=embed_model, dimensions=dims)
-
-            cached = load_index(h, emb)
-            if cached:
-                st.session_state["vs"] = cached
-                st.session_state["retriever"] = retriever(cached, k=k)
-                st.session_state["index_status"] = "ready"
-                atualizar(step="done", pct=1.0, log="Índice carregado do cache.")
-                return
 
-            atualizar(step="embed", pct=0.40, log="Gerando embeddings (OpenAI)...")
-            vs = build_vectorstore(docs, embed_model=embed_model, dims=dims)
-
-            atualizar(step="index", pct=0.80, log="Salvando índice no disco...")
-            save_index(vs, h)
+    if isinstance(documento, str):
+        emb = query_embeddings(model=embed_model, dimensions=dims)
+        h = doc_hash(documento, model=embed_model, dims=dims, divisao=getattr(divisor(divisao, embed_model), "assinatura", None))
+        cached = usar_indice(h, emb, embed_model, dims)
+        if cached:
+            _indice_pronto(cached, h, k, modo_busca, "Índice carregado do cache.", fetch_k)
+            return
+        spec = {"texto": documento}
+    else:
+        spec = {"itens": [list(item) for item in documento]}
+    spec.update(embed_model=embed_model, dims=dims, divisao=divisao)
 
-            st.session_state["vs"] = vs
-            st.session_state["retriever"] = retriever(vs, k=k)
-            st.session_state["index_status"] = "ready"
-            atualizar(step="done", pct=1.0, log="Indexação concluída.")
-        except AuthenticationError:
-            st.session_state["index_status"] = "error"
-            st.session_state["index_error"] = "OPENAI_API_KEY inválida ou ausente."
-            atualizar(step="error", pct=0.0, log="OPENAI_API_KEY inválida ou ausente.")
-        except RateLimitError:
-            st.session_state["index_status"] = "error"
-            st.session_state["index_error"] = "Rate limit excedido."
-            atualizar(step="error", pct=0.0, log="Rate limit excedido.")
-        except APIConnectionError:
-            st.session_state["index_status"] = "error"
-            st.session_state["index_error"] = "Problemas de conexão com a OpenAI."
-            atualizar(step="error", pct=0.0, log="Problemas de conexão com a OpenAI.")
-        except Exception as e:
-            st.session_state["index_status"] = "error"
-            st.session_state["index_error"] = str(e)
-            atualizar(step="error", pct=0.0, log=f"Erro: {e}")
+    try:
+        st.session_state["index_job"] = fila().submeter(spec)
+    except Exception as e:
+        mark_error(e)
+        return
+    st.session_state["index_job_cfg"] = {"embed_model": embed_model, "dims": dims, "k": k, "modo_busca": modo_busca, "fetch_k": fetch_k}
+    acompanhar_job()
+
+def acompanhar_job():
+    """Copia o estado do job da sessão para o session_state (lido pelo
+    render_status) e, quando ele termina, monta o retriever desta sessão."""
+    job_id = st.session_state.get("index_job")
+    if not job_id:
+        return
+    job = fila().status(job_id)
+    if job is None:
+        st.session_state.pop("index_job", None)
+        return
 
-    t = threading.Thread(target=job, daemon=True)
-    add_script_run_ctx(t, ctx=ctx)
-    t.start()
+    st.session_state[KEY_STEP] = job["etapa"]
+    st.session_state[KEY_PCT] = job["pct"] or 0.0
+    st.session_state[KEY_LOG] = list(job["log"])
+    st.session_state[KEY_DETALHE] = job.get("detalhe") or ""
+    if job["status"] == "fila":
+        st.session_state[KEY_STATUS] = "building"
+        adicionar_log(f"Aguardando vaga na fila de indexação (posição {job['posicao']}).")
+        return
+    if job["status"] == "rodando":
+        st.session_state[KEY_STATUS] = "building"
+        return
 
+    st.session_state.pop("index_job", None)
+    cfg = st.session_state.pop("index_job_cfg", {})
+    if job["status"] == "erro":
+        st.session_state[KEY_STATUS] = "error"
+        st.session_state[KEY_ERRMSG] = job["erro"]
+        return
 
+    h = job["hash"]
+    try:
+        emb = query_embeddings(model=cfg.get("embed_model"), dimensions=cfg.get("dims"))
+        vs = usar_indice(h, emb, cfg.get("embed_model"), cfg.get("dims"))
+        if vs is None:
+            raise RuntimeError(f"Índice {h} não encontrado.")
+        indice_lexical(vs, h)
+    except Exception as e:
+        mark_error(e)
+        return
+    log = "Indexação concluída." if job["novo"] else "Índice já existia; reaproveitado do disco."
+    _indice_pronto(vs, h, cfg.get("k", 4), cfg.get("modo_busca", MODOS_BUSCA[0]), log, cfg.get("fetch_k", 30))
+    st.session_state[KEY_RERUN] = True
 
 def listar_indices_existentes() -> List[str]:
-    path = BASE_INDEX
-    if not os.path.isdir(path):
-        return []
-    dirs = [d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d))]
-    dirs.sort(key=lambda d: os.path.getmtime(os.path.join(path, d)), reverse=True)
-    return dirs
-
-def carregar_indice_existente(h: str, embed_model="text-embedding-3-small", dims=None, k=4, compressed=True):
+    return listar_indices(BASE_INDEX)
+
+def carregar_indice_existente(h: str, embed_model="text-embedding-3-small", dims=None, k=4, compressed=True, modo_busca=MODOS_BUSCA[0], fetch_k=30):
     progress()
     st.session_state["index_status"] = "building"
     try:
         atualizar(step="load", pct=0.10, log=f"Carregando índice: {h}")
-        emb = embeddings(model=embed_model, dimensions=dims)
-        vs = load_index(h, emb)
+        emb = query_embeddings(model=embed_model, dimensions=dims)
+        vs = usar_indice(h, emb, embed_model, dims)
         if vs is None:
             st.session_state["index_status"] = "error"
             st.session_state["index_error"] = f"Índice {h} não encontrado."
             atualizar(step="error", pct=0.0, log=f"Índice {h} não encontrado.")
             return
 
-        st.session_state["vs"] = vs
-        if compressed:
-            st.session_state["retriever"] = compressed_retriever(vs, k=k)
-        else:
-            st.session_state["retriever"] = base_retriever(vs, k=k)
+        st.session_state["retriever"] = montar_retriever(vs, h, k=k, modo_busca=modo_busca, compressed=compressed, fetch_k=fetch_k)
         st.session_state["index_status"] = "ready"
         atualizar(step="done", pct=1.0, log=f"Índice {h} carregado.")
     except Exception as e:
@@ -121,29 +166,44 @@ def carregar_indice_existente(h: str, embed_model="text-embedding-3-small", dims
         st.session_state["index_error"] = str(e)
         atualizar(step="error", pct=0.0, log=f"Erro ao carregar índice {h}: {e}")
 
-def incrementar_indice(docs_novos: List[Document], embed_model="text-embedding-3-small", dims=None, k=4):
-    
-    from progress import atualizar
-    vs = st.session_state.get("vs")
-    if vs is None:
+def _aplicar_delta_sessao(fontes, embed_model, dims, k, substituir):
+    current_hash = st.session_state.get("current_index_hash")
+    if st.session_state.get("vs") is None or not current_hash:
         raise RuntimeError("Nenhum índice carregado. Carregue um índice antes de incrementar.")
 
-    atualizar(step="embed", pct=0.40, log="Gerando embeddings para novos documentos...")
-    emb = embeddings(model=embed_model, dimensions=dims)
-    vs.add_documents(docs_novos, embedding=emb)
-
-    if isinstance(st.session_state.get("retriever"), ContextualCompressionRetriever):
-        st.session_state["retriever"] = compressed_retriever(vs, k=k)
-    else:
-        st.session_state["retriever"] = base_retriever(vs, k=k)
-
-    atualizar(step="index", pct=0.80, log="Atualizando índice em disco...")
-   
-    current_hash = st.session_state.get("current_index_hash")
-    if current_hash:
-        save_index(vs, current_hash)
-    else:
-        save_index(vs, "ad-hoc-updated")
+    atualizar(step="embed", pct=0.40, log="Gerando embeddings só dos trechos novos...")
+    emb = query_embeddings(model=embed_model, dimensions=dims)
+    stats = aplicar_delta(
+        os.path.join(BASE_INDEX, current_hash), emb, fontes,
+        embed_model=embed_model, dims=dims, substituir=substituir,
+    )
+    atualizar(step="index", pct=0.80, log=f"{stats['adicionados']} trechos novos, {stats['removidos']} removidos.")
+
+    # as próximas sessões (e esta) passam a ver a versão nova do disco
+    REGISTRO.invalidar(chave_indice(current_hash, embed_model, dims))
+    vs = usar_indice(current_hash, emb, embed_model, dims)
+
+    cfg = st.session_state.get("retriever_cfg", {})
+    st.session_state["retriever"] = montar_retriever(
+        vs, current_hash, k=k,
+        modo_busca=cfg.get("modo_busca", MODOS_BUSCA[0]),
+        compressed=cfg.get("compressed", False),
+        fetch_k=cfg.get("fetch_k", 30),
+    )
 
     st.session_state["index_status"] = "ready"
+    return stats
+
+def incrementar_indice(docs_novos: List[Document], embed_model="text-embedding-3-small", dims=None, k=4):
+    """Acrescenta documentos ao índice atual; grava só um segmento novo em disco."""
+    fontes = {}
+    for d in docs_novos:
+        fontes.setdefault(str(d.metadata.get("source") or ""), []).append(d)
+    _aplicar_delta_sessao(fontes, embed_model, dims, k, substituir=False)
     atualizar(step="done", pct=1.0, log="Índice atualizado com novos documentos.")
+
+def atualizar_fonte_indice(fonte: str, docs: List[Document], embed_model="text-embedding-3-small", dims=None, k=4):
+    """Troca a versão de uma fonte no índice atual: apaga trechos que sumiram e embeda só os novos."""
+    stats = _aplicar_delta_sessao({fonte: docs}, embed_model, dims, k, substituir=True)
+    atualizar(step="done", pct=1.0, log=f"Fonte {fonte} atualizada.")
+    return stats
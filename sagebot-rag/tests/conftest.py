@@ -0,0 +1,10 @@
+import pytest
+
+from sagebot import rag
+
+
+@pytest.fixture(autouse=True)
+def cache_embeddings_isolado(tmp_path, monkeypatch):
+    # o cache por chunk fica em data/embed_cache relativo ao diretório atual:
+    # cada teste usa o seu, para não sujar a árvore nem herdar vetores de outra execução
+    monkeypatch.setattr(rag, "BASE_EMBED_CACHE", str(tmp_path / "embed_cache"))
@@ -0,0 +1,58 @@
+import faiss
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+from sagebot import ann
+from sagebot.index_store import carregar_indice, salvar_indice
+from sagebot.rag import build_vectorstore, embeddings, retriever
+
+MODELO = "sintetico:32"
+N = 3000
+
+
+@pytest.fixture(scope="module")
+def docs():
+    return [Document(page_content=f"trecho {i} sobre s3:GetObject e iam número {i * 7}") for i in range(N)]
+
+
+@pytest.mark.parametrize("tipo", ["flat", "hnsw", "ivf", "ivfpq"])
+@pytest.mark.parametrize("n_estimado", [None, N])
+def test_build_consulta_reconstroi(docs, tipo, n_estimado, tmp_path):
+    vs = build_vectorstore(docs, embed_model=MODELO, cache=False, tipo_indice=tipo, n_estimado=n_estimado)
+    assert ann.tipo_de(vs.index) == tipo
+    assert vs.index.ntotal == N
+    if tipo in ("ivf", "ivfpq"):
+        ivf = faiss.extract_index_ivf(vs.index)
+        # nlist do corpus inteiro, não do primeiro lote
+        assert ivf.nlist == ann._nlist(N)
+        assert ivf.nprobe >= ann.NPROBE_MIN
+
+    assert len(retriever(vs, k=4, fetch_k=30).invoke("trecho 5 sobre s3")) == 4
+    if tipo != "ivfpq":
+        # IVF-Flat/HNSW/flat guardam o vetor exato
+        esperado = embeddings(MODELO).embed_documents([docs[10].page_content])[0]
+        assert np.allclose(ann.vetores(vs.index, [10])[0], esperado, atol=1e-5)
+
+    salvar_indice(vs, str(tmp_path))
+    for mmap in (True, False):
+        lido = carregar_indice(str(tmp_path), embeddings(MODELO), mmap=mmap)
+        assert len(retriever(lido, k=4).invoke("trecho 7")) == 4
+        assert ann.vetores(lido.index, [0, 5, N - 1]).shape == (3, 32)
+
+
+def test_ivf_hashtable_antigo_reconstroi():
+    """Índices salvos antes da troca para DirectMap.Array."""
+    x = np.random.default_rng(0).random((2000, 16), dtype="float32")
+    index = faiss.IndexIVFFlat(faiss.IndexFlatL2(16), 16, 32)
+    index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    index.train(x)
+    index.add(x)
+    assert np.allclose(ann.vetores(index, [3, 1999]), x[[3, 1999]])
+
+
+def test_tipo_inviavel_avisa():
+    x = np.random.default_rng(0).random((100, 16), dtype="float32")
+    with pytest.warns(RuntimeWarning, match="ivfpq"):
+        index = ann.indice_treinado("ivfpq", x, 100)
+    assert ann.tipo_de(index) == "flat"
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+from sagebot.busca import mmr_lote
+
+
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.5, 0.9, 1.0])
+def test_mmr_lote_igual_ao_langchain(lambda_mult):
+    rng = np.random.default_rng(1)
+    B, F, d, k = 6, 40, 16, 8
+    consultas = rng.normal(size=(B, d)).astype("float32")
+    candidatos = rng.normal(size=(B, F, d)).astype("float32")
+    saida = mmr_lote(consultas, candidatos, k, lambda_mult=lambda_mult)
+    for b in range(B):
+        esperado = maximal_marginal_relevance(consultas[b], list(candidatos[b]), lambda_mult=lambda_mult, k=k)
+        assert list(saida[b]) == esperado
+
+
+def test_mmr_lote_preenchimento():
+    rng = np.random.default_rng(2)
+    consultas = rng.normal(size=(2, 8)).astype("float32")
+    candidatos = rng.normal(size=(2, 5, 8)).astype("float32")
+    validos = np.ones((2, 5), dtype=bool)
+    validos[1, 2:] = False  # segunda consulta só tem 2 candidatos reais
+    saida = mmr_lote(consultas, candidatos, 4, validos=validos)
+    assert (saida[0] >= 0).all()
+    assert sorted(saida[1, :2]) == [0, 1] and list(saida[1, 2:]) == [-1, -1]
@@ -0,0 +1,79 @@
+import os
+
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+from sagebot.checkpoint import ARQ_LOTES, ARQ_VETORES, CheckpointEmbeddings
+from sagebot.embeddings_locais import EmbeddingsSinteticas
+from sagebot.rag import em_lotes
+
+
+class Contador(EmbeddingsSinteticas):
+    def __init__(self):
+        super().__init__(8)
+        self.textos = 0
+
+    def embed_documents(self, textos):
+        self.textos += len(textos)
+        return super().embed_documents(textos)
+
+
+def _lotes(n=50, passo=5, prefixo="t"):
+    return list(em_lotes((Document(page_content=f"{prefixo} {i}") for i in range(n)), passo))
+
+
+def _rodar(path, lotes, parar=None):
+    emb = Contador()
+    saida = []
+    for i, (lote, vetores) in enumerate(CheckpointEmbeddings(path).embed_em_lotes(emb, lotes, max_workers=1, tpm=None)):
+        saida.append(np.asarray(vetores, dtype="float32"))
+        if parar is not None and i + 1 >= parar:
+            break
+    return emb.textos, saida
+
+
+def test_retoma_sem_reembedar(tmp_path):
+    path = str(tmp_path / "ck")
+    lotes = _lotes()
+    feitos, parcial = _rodar(path, lotes, parar=4)
+    assert feitos >= 20
+
+    chamados, completo = _rodar(path, lotes)
+    assert chamados == 50 - 20  # os 4 primeiros lotes saíram do disco
+    esperado = np.asarray(Contador().embed_documents([d.page_content for l in lotes for d in l]), dtype="float32")
+    assert np.allclose(np.concatenate(completo), esperado)
+    assert all(np.allclose(a, b) for a, b in zip(parcial, completo))
+
+    chamados, _ = _rodar(path, lotes)
+    assert chamados == 0
+    with open(os.path.join(path, ARQ_LOTES), encoding="utf-8") as f:
+        assert len(f.readlines()) == len(lotes)
+
+
+def test_entrada_divergente_trunca(tmp_path):
+    path = str(tmp_path / "ck")
+    _rodar(path, _lotes())
+    outra = _lotes()[:3] + _lotes(prefixo="novo")[3:]
+    chamados, saida = _rodar(path, outra)
+    assert chamados == 50 - 15
+    assert len(CheckpointEmbeddings(path).lotes) == len(outra)
+
+
+@pytest.mark.parametrize("estrago", ["linha_cortada", "vetores_cortados"])
+def test_crash_no_meio_da_escrita(tmp_path, estrago):
+    path = str(tmp_path / "ck")
+    _rodar(path, _lotes(), parar=4)
+    if estrago == "linha_cortada":
+        with open(os.path.join(path, ARQ_LOTES), "a", encoding="utf-8") as f:
+            f.write('{"h": "abc", "n"')
+        with open(os.path.join(path, ARQ_VETORES), "ab") as f:
+            f.write(b"\0" * 12)
+        assert len(CheckpointEmbeddings(path).lotes) == 4
+    else:
+        arq = os.path.join(path, ARQ_VETORES)
+        with open(arq, "r+b") as f:
+            f.truncate(os.path.getsize(arq) - 4)
+        assert len(CheckpointEmbeddings(path).lotes) == 3
+    chamados, saida = _rodar(path, _lotes())
+    assert len(np.concatenate(saida)) == 50
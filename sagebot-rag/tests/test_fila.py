@@ -0,0 +1,71 @@
+import json, time
+
+import pytest
+
+from sagebot.fila import FilaIndexacao, chave_job
+
+MODELO = "sintetico:16"
+PID_MORTO = 2 ** 22 + 12345
+
+
+@pytest.fixture
+def fila(tmp_path):
+    return FilaIndexacao(db=str(tmp_path / "jobs.sqlite3"), max_workers=1, base=str(tmp_path / "index"))
+
+
+def _esperar(fila, job_id, timeout=60):
+    fim = time.time() + timeout
+    while time.time() < fim:
+        job = fila.status(job_id)
+        if job["status"] not in ("fila", "rodando"):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+
+def _inserir(fila, spec, status, pid=PID_MORTO, h=None):
+    with fila._conn() as c:
+        c.execute(
+            "INSERT INTO jobs (id, chave, spec, status, etapa, pid, hash, criado, atualizado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (f"job-{status}", chave_job(spec), json.dumps(spec), status, status, pid, h, time.time(), time.time()),
+        )
+    return f"job-{status}"
+
+
+def test_reaproveita_job_pronto(fila, tmp_path):
+    arq = tmp_path / "a.md"
+    arq.write_text("# Título\n\nconteúdo do arquivo\n", encoding="utf-8")
+    spec = {"itens": [[str(arq), "a.md"]], "embed_model": MODELO, "dims": None}
+    job = _esperar(fila, fila.submeter(spec))
+    assert job["status"] == "pronto", job["erro"]
+    assert fila.submeter(dict(spec)) == job["id"]
+
+    # mesmo nome, conteúdo novo: outro job
+    arq.write_text("# Título\n\nconteúdo alterado\n", encoding="utf-8")
+    novo = fila.submeter(dict(spec))
+    assert novo != job["id"]
+    assert _esperar(fila, novo)["hash"] != job["hash"]
+
+
+def test_url_pronta_nao_reaproveitada(fila, tmp_path):
+    arq = tmp_path / "a.md"
+    arq.write_text("texto", encoding="utf-8")
+    h = _esperar(fila, fila.submeter({"itens": [[str(arq), "a.md"]], "embed_model": MODELO, "dims": None}))["hash"]
+    spec = {"itens": [["https://exemplo.invalid/doc", "doc"]], "embed_model": MODELO, "dims": None}
+    antigo = _inserir(fila, spec, "pronto", h=h)
+    assert fila.submeter(spec) != antigo
+
+
+def test_retomar_confere_arquivos(fila, tmp_path):
+    arq = tmp_path / "b.md"
+    arq.write_text("texto para retomar", encoding="utf-8")
+    existe = _inserir(fila, {"itens": [[str(arq), "b.md"]], "embed_model": MODELO, "dims": None}, "rodando")
+    apagado = tmp_path / "apagado.md"
+    apagado.write_text("upload temporário", encoding="utf-8")
+    sumiu = _inserir(fila, {"itens": [[str(apagado), "apagado.md"]], "embed_model": MODELO, "dims": None}, "fila")
+    apagado.unlink()
+
+    assert fila.retomar() == [existe]
+    assert _esperar(fila, existe)["status"] == "pronto"
+    job = fila.status(sumiu)
+    assert job["status"] == "erro" and "apagado.md" in job["erro"]
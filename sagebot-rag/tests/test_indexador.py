@@ -0,0 +1,43 @@
+import os
+
+from langchain.schema import Document
+
+from sagebot import index_store
+from sagebot.indexador import ARQ_MERKLE, caminho_indice, indexar, paginas_alteradas
+from sagebot.lexical import ARQ_BM25, IndiceLexical
+from sagebot.segmentos import assinatura
+
+MODELO = "sintetico:16"
+
+
+def _paginas(textos):
+    return iter([Document(page_content=t, metadata={"source": "m.pdf", "page": i}) for i, t in enumerate(textos)])
+
+
+def test_meta_por_ultimo(tmp_path, monkeypatch):
+    vistos = {}
+    original = index_store.os.replace
+
+    def replace(src, dst):
+        if os.path.basename(dst) == index_store.ARQ_META:
+            pasta = os.path.dirname(dst)
+            vistos.update({arq: os.path.exists(os.path.join(pasta, arq)) for arq in (ARQ_MERKLE, ARQ_BM25)})
+        return original(src, dst)
+
+    monkeypatch.setattr(index_store.os, "replace", replace)
+    h, _ = indexar(_paginas(["página um", "página dois"]), embed_model=MODELO, base=str(tmp_path))
+    assert vistos == {ARQ_MERKLE: True, ARQ_BM25: True}
+    path = caminho_indice(h, str(tmp_path))
+    # gravado com a assinatura do index.faiss final: as sessões não reconstroem
+    assert IndiceLexical.carregar(path, assinatura(path)) is not None
+    assert not [a for a in os.listdir(path) if a.endswith(".tmp")]
+
+
+def test_paginas_alteradas(tmp_path):
+    base = str(tmp_path)
+    textos = [f"página {i}" for i in range(37)]
+    h1, _ = indexar(_paginas(textos), embed_model=MODELO, base=base)
+    textos[5], textos[30] = "mudou", "mudou também"
+    h2, _ = indexar(_paginas(textos), embed_model=MODELO, base=base)
+    assert h1 != h2
+    assert paginas_alteradas(h1, h2, base) == [5, 30]
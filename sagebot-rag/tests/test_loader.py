@@ -0,0 +1,46 @@
+import os
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+
+from sagebot import loader
+
+
+def _pdf(path, paginas):
+    w = PdfWriter()
+    for _ in range(paginas):
+        w.add_blank_page(width=200, height=200)
+    with open(path, "wb") as f:
+        w.write(f)
+    return str(path)
+
+
+def _rodar(arquivos, **kw):
+    logs = []
+    docs = list(loader.iter_pdfs_paralelo(arquivos, progresso=lambda f, t, log: log and logs.append(log), **kw))
+    return [(d.metadata["source"], d.metadata["page"]) for d in docs], logs
+
+
+def test_prazo_conta_do_inicio_no_worker(tmp_path):
+    # o spawn do worker (importa langchain) já passa do prazo: só o tempo de extração conta
+    arquivos = [(_pdf(tmp_path / f"{n}.pdf", 40), n) for n in "abc"]
+    paginas, logs = _rodar(arquivos, max_workers=1, timeout=0.25)
+    assert logs == []
+    assert paginas == [(n, i) for n in "abc" for i in range(40)]
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="precisa de FIFO")
+def test_trecho_preso_troca_o_pool(tmp_path, monkeypatch):
+    # um FIFO sem escritor trava o worker no open(); só o processo pai vê o número de páginas
+    preso = str(tmp_path / "preso.pdf")
+    os.mkfifo(preso)
+
+    class Falso:
+        pages = [None] * 10
+
+    monkeypatch.setattr(loader, "PdfReader", lambda c: Falso() if c == preso else PdfReader(c))
+    arquivos = [(_pdf(tmp_path / "a.pdf", 3), "a"), (preso, "preso"), (_pdf(tmp_path / "b.pdf", 3), "b")]
+    paginas, logs = _rodar(arquivos, max_workers=1, timeout=2.0)
+    # o trecho preso é pulado e o que estava atrás dele no mesmo worker sai normalmente
+    assert paginas == [("a", 0), ("a", 1), ("a", 2), ("b", 0), ("b", 1), ("b", 2)]
+    assert len(logs) == 1 and logs[0].startswith("preso: páginas 1-32")
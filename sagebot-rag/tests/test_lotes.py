@@ -0,0 +1,152 @@
+import time
+
+import httpx
+import openai
+import pytest
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.schema import Document
+from langchain.storage import LocalFileStore
+
+from sagebot import lotes
+from sagebot.embeddings_locais import EmbeddingsSinteticas
+from sagebot.rag import em_lotes
+
+
+class Contador(EmbeddingsSinteticas):
+    def __init__(self):
+        super().__init__(8)
+        self.textos = []
+
+    def embed_documents(self, textos):
+        self.textos += textos
+        return super().embed_documents(textos)
+
+
+def _lotes(textos, passo=4):
+    return list(em_lotes((Document(page_content=t) for t in textos), passo))
+
+
+def test_cota_so_para_trechos_fora_do_cache(tmp_path, monkeypatch):
+    cobrados = []
+    monkeypatch.setattr(lotes.LimiteTokens, "consumir", lambda self, tokens: cobrados.append(tokens))
+    api = Contador()
+    emb = CacheBackedEmbeddings.from_bytes_store(api, LocalFileStore(str(tmp_path)), namespace="t/")
+    textos = [f"trecho {i}" for i in range(8)]
+
+    primeira = [v for _, vs in lotes.embed_em_lotes(emb, _lotes(textos), max_workers=2, tpm=1000) for v in vs]
+    assert sorted(api.textos) == sorted(textos)
+    assert sum(cobrados) == sum(lotes.estimar_tokens(t) for t in textos)
+
+    # reenvio igual: tudo sai do cache, sem cota nem API
+    api.textos, cobrados[:] = [], []
+    segunda = [v for _, vs in lotes.embed_em_lotes(emb, _lotes(textos), max_workers=2, tpm=1000) for v in vs]
+    assert segunda == primeira
+    assert api.textos == [] and cobrados == []
+
+    # lote misto: só o trecho novo é cobrado e embedado
+    mistos = textos[:3] + ["trecho novo"]
+    saida = list(lotes.embed_em_lotes(emb, _lotes(mistos), max_workers=2, tpm=1000))
+    assert api.textos == ["trecho novo"]
+    assert cobrados == [lotes.estimar_tokens("trecho novo")]
+    assert saida[0][1][:3] == primeira[:3]
+
+
+class Instavel(EmbeddingsSinteticas):
+    """Falha `falhas` vezes com o erro dado antes de responder."""
+
+    def __init__(self, falhas, erro):
+        super().__init__(8)
+        self.falhas, self.erro, self.chamadas = falhas, erro, 0
+
+    def embed_documents(self, textos):
+        self.chamadas += 1
+        if self.chamadas <= self.falhas:
+            raise self.erro
+        return super().embed_documents(textos)
+
+
+class Relogio:
+    """time.monotonic/time.sleep falsos: dormir só avança o relógio."""
+
+    def __init__(self):
+        self.agora, self.esperas = 0.0, []
+
+    def monotonic(self):
+        return self.agora
+
+    def sleep(self, s):
+        self.esperas.append(s)
+        self.agora += s
+
+
+def _req():
+    return httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+
+
+def test_ordem_estavel_no_pool():
+    class Lento(EmbeddingsSinteticas):
+        def embed_documents(self, textos):
+            # lotes pares demoram mais: terminam fora de ordem
+            time.sleep(0.02 if int(textos[0].split()[1]) % 8 == 0 else 0.0)
+            return super().embed_documents(textos)
+
+    emb = Lento(8)
+    textos = [f"t {i}" for i in range(64)]
+    saida = list(lotes.embed_em_lotes(emb, iter(_lotes(textos)), max_workers=4, tpm=None))
+    assert [d.page_content for lote, _ in saida for d in lote] == textos
+    assert [v for _, vs in saida for v in vs] == emb.embed_documents(textos)
+
+
+def test_retry_com_backoff(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(lotes.time, "sleep", relogio.sleep)
+    monkeypatch.setattr(lotes.random, "uniform", lambda a, b: 0.0)
+    emb = Instavel(3, openai.APIConnectionError(request=_req()))
+    assert lotes.embed_com_retry(emb, ["a"], espera_base=1.0) == EmbeddingsSinteticas(8).embed_documents(["a"])
+    assert emb.chamadas == 4
+    assert relogio.esperas == [1.0, 2.0, 4.0]
+
+
+def test_retry_respeita_retry_after(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(lotes.time, "sleep", relogio.sleep)
+    monkeypatch.setattr(lotes.random, "uniform", lambda a, b: 0.0)
+    resp = httpx.Response(429, headers={"retry-after": "7"}, request=_req())
+    emb = Instavel(1, openai.RateLimitError("limite", response=resp, body=None))
+    lotes.embed_com_retry(emb, ["a"])
+    assert relogio.esperas == [7.0]
+
+
+def test_retry_desiste_no_limite(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(lotes.time, "sleep", relogio.sleep)
+    erro = openai.APITimeoutError(request=_req())
+    emb = Instavel(99, erro)
+    with pytest.raises(openai.APITimeoutError):
+        lotes.embed_com_retry(emb, ["a"], tentativas=3)
+    assert emb.chamadas == 3 and len(relogio.esperas) == 2
+
+    # erro que não é transitório não é refeito
+    emb = Instavel(99, ValueError("entrada inválida"))
+    with pytest.raises(ValueError):
+        lotes.embed_com_retry(emb, ["a"])
+    assert emb.chamadas == 1
+
+
+def test_limite_tokens_por_minuto(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(lotes.time, "monotonic", relogio.monotonic)
+    monkeypatch.setattr(lotes.time, "sleep", relogio.sleep)
+    limite = lotes.LimiteTokens(100)
+    marcas = []
+    for tokens in [40, 40, 40, 40, 40, 250]:
+        limite.consumir(tokens)
+        marcas.append((relogio.agora, min(tokens, 100)))
+
+    # os dois primeiros cabem no minuto; o terceiro espera o primeiro sair da janela
+    assert [t for t, _ in marcas[:3]] == [0.0, 0.0, 60.0]
+    # em nenhuma janela de 60s passa mais que o orçamento
+    for t0, _ in marcas:
+        assert sum(n for t, n in marcas if t0 <= t < t0 + 60.0) <= 100
+    # lote maior que o orçamento passa sozinho, sem travar
+    assert marcas[-1][0] > marcas[-2][0]
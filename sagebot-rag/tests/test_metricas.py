@@ -0,0 +1,33 @@
+import socket
+
+from sagebot import metricas
+
+
+def test_porta_ocupada_tenta_uma_vez(monkeypatch, capsys):
+    chamadas = []
+    original = metricas.ThreadingHTTPServer
+
+    def servidor(*args, **kw):
+        chamadas.append(args)
+        return original(*args, **kw)
+
+    monkeypatch.setattr(metricas, "_servidor", None)
+    monkeypatch.setattr(metricas, "_portas_falhas", set())
+    monkeypatch.setattr(metricas, "ThreadingHTTPServer", servidor)
+    with socket.socket() as ocupada:
+        ocupada.bind(("0.0.0.0", 0))
+        ocupada.listen()
+        porta = ocupada.getsockname()[1]
+        assert metricas.servir(porta) is None
+        assert metricas.servir(porta) is None
+    assert len(chamadas) == 1
+    assert capsys.readouterr().err.count("indisponível") == 1
+
+
+def test_andamento_eta():
+    a = metricas.Andamento(total=100)
+    a._marcas[0] = (a._marcas[0][0] - 10, 0)
+    a.avancar(50)
+    assert 4 < a.vazao <= 5.1
+    assert 9 < a.eta < 11
+    assert a.texto().startswith("50/100 trechos")
@@ -0,0 +1,56 @@
+import os
+
+from langchain.schema import Document
+
+from sagebot.busca import RetrieverPais, pais_de
+from sagebot.divisor import DivisorPais
+from sagebot.index_store import ler_meta
+from sagebot.indexador import caminho_indice, indexar
+from sagebot.rag import embeddings, retriever
+from sagebot.segmentos import aplicar_delta, carregar
+
+MODELO = "sintetico:16"
+MD = "# Guia\n\nIntrodução ao guia.\n\n## IAM\n\n" + "Políticas do IAM controlam o acesso. " * 60 + "\n\n```json\n{\"Effect\": \"Allow\"}\n```\n"
+
+
+def _indexar(tmp_path):
+    base = str(tmp_path)
+    h, novo = indexar(iter([Document(page_content=MD, metadata={"source": "guia.md"})]), embed_model=MODELO, base=base, splitter=DivisorPais(embed_model=MODELO, workers=1))
+    assert novo
+    return caminho_indice(h, base)
+
+
+def test_pais_indexados_e_resolvidos(tmp_path):
+    path = _indexar(tmp_path)
+    assert ler_meta(path)["divisao"] == "pais"
+    assert not [d for d in os.listdir(tmp_path) if d.startswith(".pais-")]
+
+    vs = carregar(path, embeddings(MODELO))
+    filhos = [vs.docstore.search(vs.index_to_docstore_id[i]) for i in range(vs.index.ntotal)]
+    assert all("pai" in f.metadata for f in filhos)
+    assert {f.metadata.get("secao") for f in filhos} == {"Guia", "Guia > IAM"}
+
+    pais = pais_de(path)
+    r = RetrieverPais(base=retriever(vs, k=len(filhos), fetch_k=len(filhos)), pais=pais, k=2)
+    docs = r.invoke("Políticas do IAM")
+    assert len(docs) == 2
+    # cada seção contém os trechos dela
+    for f in filhos:
+        assert f.page_content in pais.search(str(f.metadata["pai"])).page_content
+
+
+def test_delta_usa_divisao_do_indice(tmp_path):
+    path = _indexar(tmp_path)
+    n_pais = len(pais_de(path))
+    novo = "# FAQ\n\n" + "Como rotacionar chaves de acesso. " * 40
+    stats = aplicar_delta(path, embeddings(MODELO), {"faq.md": [Document(page_content=novo, metadata={"source": "faq.md"})]}, embed_model=MODELO)
+    assert stats["adicionados"] > 0
+
+    pais = pais_de(path)
+    assert len(pais) > n_pais
+    vs = carregar(path, embeddings(MODELO))
+    faq = [d for d in (vs.docstore.search(vs.index_to_docstore_id[i]) for i in range(vs.index.ntotal)) if d.metadata["source"] == "faq.md"]
+    assert faq and all(d.metadata.get("secao") == "FAQ" for d in faq)
+    for d in faq:
+        pai = pais.search(str(d.metadata["pai"]))
+        assert d.page_content in pai.page_content and pai.metadata["source"] == "faq.md"
@@ -0,0 +1,66 @@
+import os
+
+from langchain.schema import Document
+
+from sagebot import segmentos
+from sagebot.indexador import caminho_indice, indexar
+from sagebot.rag import embeddings
+from sagebot.segmentos import aplicar_delta, carregar, compactar, ler_manifesto
+
+MODELO = "sintetico:16"
+
+
+def _fonte(nome, paragrafos):
+    # um documento por parágrafo, abaixo dos 1500 caracteres do splitter: cada um vira um trecho
+    return [Document(page_content=p * 160, metadata={"source": nome}) for p in paragrafos]
+
+
+def _conteudos(vs):
+    return sorted(vs.docstore.search(vs.index_to_docstore_id[i]).page_content[:6] for i in range(vs.index.ntotal))
+
+
+def _indice(tmp_path):
+    h, _ = indexar(iter(_fonte("a.md", ["aaaaa ", "bbbbb "]) + _fonte("b.md", ["ccccc "])), embed_model=MODELO, base=str(tmp_path))
+    return caminho_indice(h, str(tmp_path)), embeddings(MODELO)
+
+
+def test_delta_segmento_e_tombstones(tmp_path, monkeypatch):
+    # índice pequeno: um tombstone já passaria da fração que compacta sozinha
+    monkeypatch.setattr(segmentos, "MAX_TOMBSTONES", 1.0)
+    path, emb = _indice(tmp_path)
+    assert _conteudos(carregar(path, emb)) == ["aaaaa ", "bbbbb ", "ccccc "]
+
+    stats = aplicar_delta(path, emb, {"a.md": _fonte("a.md", ["aaaaa ", "ddddd "])}, embed_model=MODELO)
+    assert stats == {"adicionados": 1, "removidos": 1}
+    man = ler_manifesto(path)
+    assert len(man["segmentos"]) == 1 and len(man["tombstones"]) == 1
+    assert _conteudos(carregar(path, emb)) == ["aaaaa ", "ccccc ", "ddddd "]
+
+    # reaplicar a mesma versão não muda nada
+    assert aplicar_delta(path, emb, {"a.md": _fonte("a.md", ["aaaaa ", "ddddd "])}, embed_model=MODELO) == {"adicionados": 0, "removidos": 0}
+
+    # só acrescenta
+    aplicar_delta(path, emb, {"b.md": _fonte("b.md", ["eeeee "])}, embed_model=MODELO, substituir=False)
+    assert _conteudos(carregar(path, emb)) == ["aaaaa ", "ccccc ", "ddddd ", "eeeee "]
+
+
+def test_compactacao(tmp_path, monkeypatch):
+    monkeypatch.setattr(segmentos, "MAX_TOMBSTONES", 1.0)
+    path, emb = _indice(tmp_path)
+    aplicar_delta(path, emb, {"a.md": _fonte("a.md", ["aaaaa ", "ddddd "])}, embed_model=MODELO)
+    seg = ler_manifesto(path)["segmentos"][0]
+
+    compactar(path, emb)
+    man = ler_manifesto(path)
+    assert man["segmentos"] == [] and man["tombstones"] == []
+    assert not os.path.exists(os.path.join(path, seg))
+    vs = carregar(path, emb)
+    assert _conteudos(vs) == ["aaaaa ", "ccccc ", "ddddd "]
+    # sem delta pendente volta a abrir mapeado do disco
+    assert segmentos.assinatura(path) is not None
+
+    # muitos tombstones disparam a compactação sozinhos
+    monkeypatch.setattr(segmentos, "MAX_TOMBSTONES", 0.0)
+    aplicar_delta(path, emb, {"b.md": _fonte("b.md", ["fffff "])}, embed_model=MODELO)
+    assert ler_manifesto(path)["tombstones"] == []
+    assert _conteudos(carregar(path, emb)) == ["aaaaa ", "ddddd ", "fffff "]
@@ -0,0 +1,50 @@
+import pytest
+from langchain.schema import Document
+
+from sagebot.utils import ArvoreMerkle, HashCorpus, _digest, arvore_texto, corpus_hash, doc_hash, hash_folha
+
+
+def _folhas(n, mudar=()):
+    return [_digest(b"x" if i in mudar else b"", str(i).encode()) for i in range(n)]
+
+
+@pytest.mark.parametrize("n", [1, 2, 7, 64, 1000])
+def test_diferentes_acha_so_as_folhas_mudadas(n):
+    mudar = {0, n // 2, n - 1}
+    a, b = ArvoreMerkle(_folhas(n)), ArvoreMerkle(_folhas(n, mudar))
+    assert a.diferentes(b) == sorted(mudar)
+    assert a.diferentes(ArvoreMerkle(_folhas(n))) == []
+
+
+def test_tamanhos_diferentes_e_impar():
+    a, b = ArvoreMerkle(_folhas(5)), ArvoreMerkle(_folhas(7))
+    assert b.diferentes(a) == [5, 6]
+    # nó ímpar não é duplicado: [x] e [x, x] têm raízes diferentes
+    f = _folhas(1)
+    assert ArvoreMerkle(f).raiz != ArvoreMerkle(f + f).raiz
+
+
+def test_salvar_carregar(tmp_path):
+    a = ArvoreMerkle(_folhas(33))
+    a.salvar(str(tmp_path / "m.bin"))
+    b = ArvoreMerkle.carregar(str(tmp_path / "m.bin"))
+    assert b.raiz == a.raiz and b.diferentes(a) == []
+    assert ArvoreMerkle.carregar(str(tmp_path / "nao.bin")) is None
+
+
+def test_hashes_de_corpus():
+    docs = [Document(page_content=f"p{i}", metadata={"source": "a.pdf", "page": i}) for i in range(10)]
+    hc = HashCorpus(model="sintetico:8")
+    for d in docs:
+        hc.atualizar(d)
+    assert hc.hexdigest() == corpus_hash(docs, model="sintetico:8")
+    assert hc.arvore().folhas == [hash_folha(d) for d in docs]
+    assert corpus_hash(docs, model="sintetico:8") != corpus_hash(docs, model="sintetico:16")
+    assert corpus_hash(docs, model="sintetico:8", divisao="estrutura:350:50") != corpus_hash(docs, model="sintetico:8")
+
+
+def test_doc_hash_em_blocos():
+    texto = "a" * 2500
+    assert len(arvore_texto(texto, bloco=1000)) == 3
+    assert doc_hash(texto) == doc_hash("a" * 2500)
+    assert doc_hash(texto) != doc_hash(texto + "b")